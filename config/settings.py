@@ -22,6 +22,9 @@ CACHES = {
 
 CACHE_ENABLED = True
 
+TEST_RUNNER = 'config.test_runner.IsolatedCacheTestRunner'
+MAILING_CACHE_TIMEOUT = 300
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -34,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mailing.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +82,55 @@ DATABASES = {
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+MAILING_BATCH_SIZE = 500
+MAILING_MAX_MESSAGES_PER_CONNECTION = 100
+MAILING_CONNECTION_POOL_SIZE = 1
+MAILING_ASYNC_CONCURRENCY = 200
+# адрес сайта для абсолютных ссылок в письмах (например, ссылки отписки)
+MAILING_SITE_URL = 'http://127.0.0.1:8000'
+MAILING_ATTEMPT_FLUSH_SIZE = 500
+MAILING_ATTEMPT_FLUSH_INTERVAL = 5
+MAILING_COMPACT_ATTEMPTS = True
+MAILING_ATTEMPT_RETENTION_DAYS = 180
+MAILING_RETRY_MAX_ATTEMPTS = 5
+MAILING_RETRY_BASE_DELAY = 60
+MAILING_RETRY_MAX_DELAY = 6 * 3600
+MAILING_RETRY_LEASE = 600
+MAILING_JOB_STALE_AFTER = 300
+# метрики копятся в памяти процесса и сбрасываются в Redis раз в N секунд
+MAILING_METRICS_ENABLED = True
+MAILING_METRICS_FLUSH_INTERVAL = 5
+# без токена /metrics отвечает 403 (кроме режима DEBUG)
+MAILING_METRICS_TOKEN = os.getenv('MAILING_METRICS_TOKEN', '')
+# отслеживание открытий и переходов: события буферизуются в процессе,
+# пачками уходят в список Redis и переносятся в EmailEvent обработчиками
+MAILING_TRACKING_ENABLED = True
+MAILING_TRACKING_FLUSH_SIZE = 500
+MAILING_TRACKING_FLUSH_INTERVAL = 1
+MAILING_TRACKING_INGEST_BATCH = 5000
+# профилирование запросов (Server-Timing и лог медленных запросов), по умолчанию выключено;
+# время кеша и шаблонов измеряется только при DEBUG
+MAILING_PROFILING = os.getenv('MAILING_PROFILING', '') == '1'
+MAILING_PROFILING_THRESHOLDS = {
+    'queries': 30,
+    'db_ms': 200,
+    'cache_calls': 20,
+    'total_ms': 1000,
+}
+# лимиты скорости отправки, писем в секунду (0 — без ограничения);
+# ведра токенов хранятся в Redis из CACHES и общие для всех обработчиков
+MAILING_RATE_LIMITS = {
+    'GLOBAL': 0,
+    'PER_OWNER': 0,
+    'PER_DOMAIN': 0,
+    'DOMAINS': {},
+}
+MAILING_STATS_PAGE_SIZE = 50
+MAILING_PAGE_SIZE = 50
+MAILING_MAX_PAGE_SIZE = 500
+MAILING_EXPORT_CHUNK_SIZE = 2000
+MAILING_CLIENT_SEARCH_LIMIT = 20
+
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
@@ -0,0 +1,31 @@
+import os
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class IsolatedCacheTestRunner(DiscoverRunner):
+    # тесты работают с тем же Redis, что и приложение: свой KEY_PREFIX на прогон
+    # отделяет от рабочих данных кеш, счётчики главной, метрики, очередь событий
+    # и ведра ограничителя, а после прогона ключи этого префикса удаляются
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        cache = settings.CACHES['default']
+        self.cache_prefix = f"{cache.get('KEY_PREFIX', '')}:test:{os.getpid()}"
+        self.cache_override = override_settings(
+            CACHES={**settings.CACHES, 'default': {**cache, 'KEY_PREFIX': self.cache_prefix}},
+        )
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        try:
+            import redis
+            client = redis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+            keys = list(client.scan_iter(match=f'{self.cache_prefix}*'))
+            if keys:
+                client.delete(*keys)
+        except Exception:
+            pass
+        self.cache_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,280 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+
+from .delivery import (
+    FAILURE, SMTP_OK, SUCCESS, BaseDeliveryEngine, DeliveryAborted, DeliveryReport, DeliveryResult, classify_error,
+    count_messages, finish_mailing, is_temporary,
+)
+from .metrics import smtp_connect_seconds, smtp_send_seconds
+from .models import Message
+from .ratelimit import recipient_domain
+from .recorder import AttemptRecorder
+from .rendering import MessageRenderer
+from .retries import RetryTracker
+from .runs import claim_chunk, finish_run, snapshot_marker, start_run, take_snapshot
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def async_classify_error(error):
+    # то же, что classify_error, но для исключений aiosmtplib
+    try:
+        import aiosmtplib
+    except ImportError:
+        return classify_error(error)
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused) and error.recipients:
+        code = error.recipients[0].code
+        return code, is_temporary(code), True
+    if isinstance(error, aiosmtplib.SMTPRecipientRefused):
+        return error.code, is_temporary(error.code), True
+    fatal = (aiosmtplib.SMTPAuthenticationError, aiosmtplib.SMTPHeloError, aiosmtplib.SMTPNotSupported)
+    if isinstance(error, fatal) or (
+        isinstance(error, aiosmtplib.SMTPSenderRefused) and not is_temporary(error.code)
+    ):
+        raise DeliveryAborted(f'Отправка остановлена: {error}') from error
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return error.code, is_temporary(error.code), False
+    return classify_error(error)
+
+
+class AsyncSMTPConnection:
+    # SMTP-сессия на aiosmtplib: сотни таких соединений живут в одном event loop
+    def __init__(self, max_messages):
+        try:
+            import aiosmtplib
+        except ImportError:
+            raise ImproperlyConfigured('Для асинхронной отправки через SMTP установите aiosmtplib.')
+        self.client = aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            username=settings.EMAIL_HOST_USER or None,
+            password=settings.EMAIL_HOST_PASSWORD or None,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT,
+        )
+        self.disconnected = aiosmtplib.SMTPServerDisconnected
+        self.max_messages = max_messages
+        self.sent = 0
+
+    async def open(self):
+        with smtp_connect_seconds.time(engine='async'):
+            try:
+                await self.client.connect()
+            except Exception as e:
+                raise DeliveryAborted(f'Не удалось подключиться к SMTP-серверу: {e}') from e
+        self.sent = 0
+
+    async def close(self):
+        if self.client.is_connected:
+            try:
+                await self.client.quit()
+            except Exception:
+                self.client.close()
+
+    async def reconnect(self):
+        await self.close()
+        await self.open()
+
+    async def send(self, message):
+        if not self.client.is_connected:
+            await self.open()
+        elif self.sent >= self.max_messages:
+            await self.reconnect()
+        payload = message.message()
+        recipients = message.recipients()
+        with smtp_send_seconds.time(engine='async'):
+            try:
+                await self.client.send_message(payload, sender=message.from_email, recipients=recipients)
+            except (self.disconnected, ConnectionError):
+                # сервер закрыл соединение — переподключаемся и повторяем один раз
+                await self.reconnect()
+                await self.client.send_message(payload, sender=message.from_email, recipients=recipients)
+        self.sent += 1
+
+
+class ThreadedBackendConnection:
+    # любой другой EMAIL_BACKEND (console, locmem, файлы) вызывается в потоке
+    def __init__(self, max_messages):
+        self.backend = get_connection(fail_silently=False)
+        self.max_messages = max_messages
+
+    async def open(self):
+        await sync_to_async(self.backend.open, thread_sensitive=False)()
+
+    async def close(self):
+        await sync_to_async(self.backend.close, thread_sensitive=False)()
+
+    async def send(self, message):
+        with smtp_send_seconds.time(engine='async'):
+            await sync_to_async(self.backend.send_messages, thread_sensitive=False)([message])
+
+
+class AsyncConnectionPool:
+    def __init__(self, size, max_messages):
+        self.size = size
+        self.max_messages = max_messages
+        self._idle = asyncio.LifoQueue()
+        self._all = []
+
+    def connect(self):
+        if settings.EMAIL_BACKEND == SMTP_BACKEND:
+            return AsyncSMTPConnection(self.max_messages)
+        return ThreadedBackendConnection(self.max_messages)
+
+    async def acquire(self):
+        if self._idle.empty() and len(self._all) < self.size:
+            connection = self.connect()
+            self._all.append(connection)
+            return connection
+        return await self._idle.get()
+
+    def release(self, connection):
+        self._idle.put_nowait(connection)
+
+    async def close(self):
+        await asyncio.gather(*(connection.close() for connection in self._all), return_exceptions=True)
+
+
+class AsyncDeliveryEngine(BaseDeliveryEngine):
+    # concurrency — число одновременных SMTP-сессий: столько же задач
+    # разбирают общую ограниченную очередь писем, а чтение получателей
+    # и запись попыток идут пачками через ORM в отдельном потоке
+    def __init__(self, concurrency=None, **kwargs):
+        super().__init__(**kwargs)
+        self.concurrency = max(concurrency or getattr(settings, 'MAILING_ASYNC_CONCURRENCY', 200), 1)
+
+    async def send_one(self, pool, client, email, owner_id):
+        if self.rate_limiter is not None:
+            while True:
+                delay, scope = await sync_to_async(self.rate_limiter.try_acquire, thread_sensitive=False)(
+                    owner_id, recipient_domain(client.email)
+                )
+                if not delay:
+                    break
+                self.rate_limiter.stats.record(scope, delay)
+                await asyncio.sleep(delay)
+        connection = await pool.acquire()
+        started = time.perf_counter()
+        try:
+            await connection.send(email)
+        except Exception as e:
+            code, transient, recipient = async_classify_error(e)
+            status, response = FAILURE, str(e)
+        else:
+            code, transient, recipient = SMTP_OK, False, False
+            status, response = SUCCESS, f"Письмо успешно отправлено на {client.email}"
+        finally:
+            pool.release(connection)
+        return DeliveryResult(client, status, response, time.perf_counter() - started, code, transient, recipient)
+
+    async def snapshot_batches(self, job):
+        # снимок читается по client_id порциями; каждая порция — отдельный
+        # запрос в потоке ORM, курсор между ними открытым не держим
+        after = 0
+        while True:
+            batch = await sync_to_async(claim_chunk)(job, after, self.batch_size)
+            if not batch:
+                return
+            after = batch[-1].pk
+            yield batch
+
+    async def deliver(self, mailing, batches, on_batch=None):
+        if mailing._meta.get_field('message').is_cached(mailing):
+            message = mailing.message
+        else:
+            message = await Message.objects.aget(pk=mailing.message_id)
+        renderer = MessageRenderer(message, self.from_email, mailing_id=mailing.pk)
+        report = DeliveryReport()
+        pool = AsyncConnectionPool(self.concurrency, self.max_messages_per_connection)
+        # очередь ограничена: письма готовятся не дальше чем на 2 * concurrency
+        # вперёд, а медленное письмо не задерживает остальные, как было бы
+        # при ожидании целой пачки
+        pending = asyncio.Queue(maxsize=self.concurrency * 2)
+        done = []
+
+        async def handle():
+            nonlocal done
+            results, done = done, []
+            sent = sum(1 for result in results if result.status == SUCCESS)
+            report.sent += sent
+            report.failed += len(results) - sent
+            count_messages(sent, len(results) - sent, 'async')
+            if on_batch is not None:
+                await on_batch(results)
+
+        async def produce():
+            async for batch in batches:
+                for client in batch:
+                    await pending.put((client, renderer.render(client)))
+                if len(done) >= self.batch_size:
+                    await handle()
+            for _ in workers:
+                await pending.put(None)
+
+        async def work():
+            while (item := await pending.get()) is not None:
+                client, email = item
+                # результат кладём в done только после await: пока письмо
+                # отправлялось, handle() мог заменить список
+                result = await self.send_one(pool, client, email, mailing.owner_id)
+                done.append(result)
+
+        workers = [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        tasks = [asyncio.create_task(produce()), *workers]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # при ошибке останавливаем остальные задачи, но уже отправленные
+            # письма всё равно записываем
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                if done:
+                    await handle()
+            finally:
+                await pool.close()
+        return report
+
+
+async def deliver_mailing_async(mailing, engine=None, on_result=None, job=None):
+    engine = engine or AsyncDeliveryEngine()
+    own_job = job is None
+    if own_job:
+        job = await sync_to_async(start_run)(mailing)
+    recorder = AttemptRecorder(on_flush=snapshot_marker(job))
+    retries = RetryTracker(mailing)
+
+    def record(results):
+        for result in results:
+            recorder.add(mailing, result.client, result.status, result.response, result.code)
+            retries.add(result)
+            if on_result is not None:
+                on_result(result)
+
+    def flush():
+        recorder.flush()
+        retries.flush()
+
+    try:
+        await sync_to_async(take_snapshot)(job)
+        try:
+            report = await engine.deliver(mailing, engine.snapshot_batches(job), on_batch=sync_to_async(record))
+        finally:
+            await sync_to_async(flush)()
+    except Exception as e:
+        if own_job:
+            await sync_to_async(finish_run)(job, error=str(e))
+        raise
+    report.retried = retries.retried
+    report.suppressed = retries.suppressed
+    if own_job:
+        await sync_to_async(finish_run)(job, report)
+    await sync_to_async(finish_mailing)(mailing)
+    return report
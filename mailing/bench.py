@@ -0,0 +1,108 @@
+import asyncio
+import random
+import smtplib
+import threading
+import time
+
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def inject_failure(failure_rate, permanent_share):
+    # доля failure_rate писем завершается ошибкой; из них permanent_share —
+    # постоянные (550), остальные временные (451), как у настоящего сервера
+    if failure_rate and random.random() < failure_rate:
+        code, text = (550, b'5.1.1 No such user') if random.random() < permanent_share else (451, b'4.7.1 Try later')
+        return code, text
+    return None
+
+
+class SinkEmailBackend(BaseEmailBackend):
+    # почтовый бэкенд для замеров: ничего не отправляет, но изображает
+    # задержку сервера и отказы; параметры задаёт bench_delivery
+    latency = 0
+    failure_rate = 0
+    permanent_share = 0.5
+    sent = 0
+    _lock = threading.Lock()
+
+    def send_messages(self, email_messages):
+        count = 0
+        for message in email_messages:
+            if self.latency:
+                time.sleep(self.latency)
+            recipient = message.recipients()[0]
+            failure = inject_failure(self.failure_rate, self.permanent_share)
+            if failure is not None:
+                raise smtplib.SMTPRecipientsRefused({recipient: failure})
+            count += 1
+        with self._lock:
+            SinkEmailBackend.sent += count
+        return count
+
+
+class SMTPSinkHandler:
+    def __init__(self, latency=0, failure_rate=0, permanent_share=0.5):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.permanent_share = permanent_share
+        self.sent = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        failure = inject_failure(self.failure_rate, self.permanent_share)
+        if failure is not None:
+            return f'{failure[0]} {failure[1].decode()}'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return '250 OK'
+
+
+def start_smtp_sink(handler, port=0):
+    # настоящий SMTP-сервер в этом же процессе (нужен пакет aiosmtpd)
+    from aiosmtpd.controller import Controller
+
+    controller = Controller(handler, hostname='127.0.0.1', port=port or 8025)
+    controller.start()
+    return controller
+
+
+class QueryCounter:
+    # считает запросы во всех соединениях с БД, включая открытые
+    # в потоках отправки после начала замера
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def attach(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        for connection in connections.all(initialized_only=True):
+            connection.execute_wrappers.append(self)
+        connection_created.connect(self.attach)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        connection_created.disconnect(self.attach)
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import cache_requests_total
+
+
+ALL = 'all'
+
+
+def cache_enabled():
+    return getattr(settings, 'CACHE_ENABLED', False)
+
+
+def _version_key(name, scope):
+    return f'{name}_version_{scope}'
+
+
+def get_version(name, scope):
+    key = _version_key(name, scope)
+    version = cache.get(key)
+    if version is None:
+        # после вытеснения версии начинаем с нового значения,
+        # чтобы не попасть на старые записи с тем же номером
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def make_key(name, scope, suffix=''):
+    return f'{name}_{scope}_v{get_version(name, scope)}{suffix}'
+
+
+def get_or_set(name, scope, compute, timeout=None, suffix=''):
+    if not cache_enabled():
+        return compute()
+    key = make_key(name, scope, suffix)
+    value = cache.get(key)
+    if value is None:
+        cache_requests_total.inc(name=name, result='miss')
+        value = compute()
+        cache.set(key, value, timeout or getattr(settings, 'MAILING_CACHE_TIMEOUT', 300))
+    else:
+        cache_requests_total.inc(name=name, result='hit')
+    return value
+
+
+def invalidate(name, *scopes):
+    if not cache_enabled():
+        return
+    for scope in scopes:
+        key = _version_key(name, scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
@@ -0,0 +1,48 @@
+from django.core.cache import cache
+
+from .models import Client, Mailing
+
+
+COUNTERS = ('total_mailings', 'active_mailings', 'unique_recipients')
+
+
+def _key(name):
+    # ключ дополняется KEY_PREFIX и VERSION из CACHES самим бэкендом кеша,
+    # поэтому счётчики разных окружений (и прогонов тестов) не пересекаются
+    return f'dashboard_{name}'
+
+
+def compute_counters():
+    return {
+        'total_mailings': Mailing.objects.count(),
+        'active_mailings': Mailing.objects.filter(status='Запущена').count(),
+        # email клиента уникален, поэтому число клиентов и есть число уникальных получателей
+        'unique_recipients': Client.objects.count(),
+    }
+
+
+def refresh_counters():
+    counters = compute_counters()
+    cache.set_many({_key(name): value for name, value in counters.items()}, None)
+    return counters
+
+
+def get_counters():
+    values = cache.get_many([_key(name) for name in COUNTERS])
+    if len(values) < len(COUNTERS):
+        return refresh_counters()
+    return {name: values[_key(name)] for name in COUNTERS}
+
+
+def adjust(name, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(_key(name), delta)
+    except ValueError:
+        # счётчика ещё нет — он будет посчитан целиком при следующем чтении
+        pass
+
+
+def reset_counters():
+    cache.delete_many([_key(name) for name in COUNTERS])
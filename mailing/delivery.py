@@ -0,0 +1,366 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.utils.timezone import now
+
+from .metrics import messages_total, smtp_connect_seconds, smtp_send_seconds
+from .models import DeliveryRetry, Mailing
+from .ratelimit import RedisRateLimiter, paced
+from .recorder import AttemptRecorder
+from .rendering import MessageRenderer
+from .runs import finish_run, iter_snapshot, snapshot_marker, start_run, take_snapshot
+from .retries import RetryTracker, claim_due_retries
+
+logger = logging.getLogger('mailing.delivery')
+
+SUCCESS = 'Успешно'
+FAILURE = 'Не успешно'
+SMTP_OK = 250
+
+# transient — письмо стоит повторить позже; recipient — отказ относится к самому
+# получателю (ответ на RCPT), только такие отказы ведут в список подавления
+DeliveryResult = namedtuple('DeliveryResult', 'client status response elapsed code transient recipient')
+
+# ошибки сессии и настроек: ни один получатель не виноват, продолжать запуск бессмысленно
+FATAL_SMTP_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPHeloError, smtplib.SMTPNotSupportedError)
+TRANSIENT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class DeliveryAborted(Exception):
+    # запуск прерывается, а неотправленные получатели остаются в снимке;
+    # следующий запуск рассылки продолжает этот снимок (см. runs.adopt_failed_snapshot)
+    # и досылает только их; results — письма пачки,
+    # обработанные до ошибки: их попытки всё равно нужно записать
+    results = ()
+
+
+def smtp_code(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return None
+
+
+def is_temporary(code):
+    return code is not None and 400 <= code < 500
+
+
+def classify_error(error):
+    # возвращает (код, transient, recipient) или прерывает запуск через DeliveryAborted:
+    # 4xx и обрыв соединения повторяем, 5xx на RCPT — отказ получателя,
+    # прочие 5xx (например, на DATA) — неудача только этого письма;
+    # авторизация, отправитель и любые неизвестные ошибки останавливают запуск
+    if isinstance(error, DeliveryAborted):
+        raise error
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        code = smtp_code(error)
+        return code, is_temporary(code), True
+    if isinstance(error, FATAL_SMTP_ERRORS) or (
+        isinstance(error, smtplib.SMTPSenderRefused) and not is_temporary(error.smtp_code)
+    ):
+        raise DeliveryAborted(f'Отправка остановлена: {error}') from error
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code, is_temporary(error.smtp_code), False
+    if isinstance(error, TRANSIENT_ERRORS):
+        return None, True, False
+    raise DeliveryAborted(f'Отправка остановлена из-за непредвиденной ошибки: {error!r}') from error
+
+
+def count_messages(sent, failed, engine):
+    if sent:
+        messages_total.inc(sent, status='sent', engine=engine)
+    if failed:
+        messages_total.inc(failed, status='failed', engine=engine)
+
+
+class PooledConnection:
+    def __init__(self, max_messages):
+        self.backend = get_connection(fail_silently=False)
+        self.max_messages = max_messages
+        self.sent = 0
+        self.is_open = False
+
+    def open(self):
+        # не удалось подключиться или войти — дело в сервере или настройках,
+        # а не в получателе: пробовать остальные письма смысла нет
+        with smtp_connect_seconds.time(engine='threaded'):
+            try:
+                self.backend.open()
+            except Exception as e:
+                raise DeliveryAborted(f'Не удалось подключиться к SMTP-серверу: {e}') from e
+        self.is_open = True
+        self.sent = 0
+
+    def close(self):
+        if self.is_open:
+            try:
+                self.backend.close()
+            except Exception:
+                pass
+            self.is_open = False
+
+    def reconnect(self):
+        self.close()
+        self.open()
+
+    def send(self, message):
+        if not self.is_open:
+            self.open()
+        elif self.sent >= self.max_messages:
+            self.reconnect()
+        with smtp_send_seconds.time(engine='threaded'):
+            try:
+                self.backend.send_messages([message])
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # сервер закрыл соединение — переподключаемся и повторяем один раз
+                self.reconnect()
+                self.backend.send_messages([message])
+        self.sent += 1
+
+
+class ConnectionPool:
+    def __init__(self, size, max_messages):
+        self.size = size
+        self.max_messages = max_messages
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                connection = PooledConnection(self.max_messages)
+                self._all.append(connection)
+                return connection
+        return self._idle.get()
+
+    def release(self, connection):
+        self._idle.put(connection)
+
+    def close(self):
+        for connection in self._all:
+            connection.close()
+
+
+class DeliveryReport:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.suppressed = 0
+
+    @property
+    def total(self):
+        return self.sent + self.failed
+
+
+class BaseDeliveryEngine:
+    # общие настройки потокового и асинхронного движков; способ отправки
+    # (deliver) у каждого свой и сигнатуры у них разные
+    def __init__(self, batch_size=None, max_messages_per_connection=None, pool_size=None, from_email=None,
+                 concurrency=1, rate_limiter=None):
+        self.batch_size = batch_size or getattr(settings, 'MAILING_BATCH_SIZE', 500)
+        self.max_messages_per_connection = (
+            max_messages_per_connection or getattr(settings, 'MAILING_MAX_MESSAGES_PER_CONNECTION', 100)
+        )
+        self.pool_size = pool_size or getattr(settings, 'MAILING_CONNECTION_POOL_SIZE', 1)
+        self.from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = rate_limiter or RedisRateLimiter.from_settings()
+
+    def iter_batches(self, clients):
+        clients = iter(clients)
+        while True:
+            batch = list(islice(clients, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+class DeliveryEngine(BaseDeliveryEngine):
+    def send_batch(self, pool, batch, owner_id=None, stop=None):
+        # stop — событие, по которому параллельные пачки прекращают отправку,
+        # когда одна из них прервала запуск
+        results = []
+        if self.rate_limiter is not None:
+            batch = paced(self.rate_limiter, batch, owner_id)
+        connection = pool.acquire()
+        try:
+            for client, email in batch:
+                if stop is not None and stop.is_set():
+                    break
+                started = time.perf_counter()
+                try:
+                    connection.send(email)
+                except Exception as e:
+                    try:
+                        code, transient, recipient = classify_error(e)
+                    except DeliveryAborted as aborted:
+                        aborted.results = results
+                        if stop is not None:
+                            stop.set()
+                        raise
+                    status, response = FAILURE, str(e)
+                else:
+                    code, transient, recipient = SMTP_OK, False, False
+                    status, response = SUCCESS, f"Письмо успешно отправлено на {client.email}"
+                results.append(DeliveryResult(
+                    client, status, response, time.perf_counter() - started, code, transient, recipient
+                ))
+        finally:
+            pool.release(connection)
+        return results
+
+    def deliver(self, mailing, clients=None, on_result=None):
+        if clients is None:
+            clients = mailing.get_recipients().iterator(chunk_size=self.batch_size)
+        renderer = MessageRenderer(mailing.message, self.from_email, mailing_id=mailing.pk)
+        report = DeliveryReport()
+
+        def handle(results):
+            sent = failed = 0
+            for result in results:
+                if result.status == SUCCESS:
+                    sent += 1
+                else:
+                    failed += 1
+                if on_result is not None:
+                    on_result(result)
+            report.sent += sent
+            report.failed += failed
+            count_messages(sent, failed, 'threaded')
+
+        def build(batch):
+            return [(client, renderer.render(client)) for client in batch]
+
+        aborted = None
+
+        def collect(send):
+            # письма, принятые сервером до ошибки, записываются в любом случае,
+            # иначе следующий запуск отправит их повторно
+            nonlocal aborted
+            try:
+                results = send()
+            except DeliveryAborted as e:
+                results = e.results
+                aborted = aborted or e
+            handle(results)
+
+        pool = ConnectionPool(max(self.pool_size, self.concurrency), self.max_messages_per_connection)
+        try:
+            if self.concurrency == 1:
+                for batch in self.iter_batches(clients):
+                    collect(lambda: self.send_batch(pool, build(batch), mailing.owner_id))
+                    if aborted is not None:
+                        break
+            else:
+                # пачки отправляются параллельно, но в работе держим не больше
+                # 2 * concurrency пачек, чтобы память не росла с размером рассылки;
+                # после ошибки новые пачки не запускаем, а итоги начатых собираем
+                stop = threading.Event()
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    pending = set()
+                    for batch in self.iter_batches(clients):
+                        if aborted is not None:
+                            break
+                        pending.add(executor.submit(self.send_batch, pool, build(batch), mailing.owner_id, stop))
+                        if len(pending) >= self.concurrency * 2:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                collect(future.result)
+                    for future in pending:
+                        collect(future.result)
+        finally:
+            pool.close()
+        if aborted is not None:
+            raise aborted
+        return report
+
+
+def finish_mailing(mailing):
+    if mailing.end_datetime <= now():
+        mailing.status = 'Завершена'
+    else:
+        mailing.status = 'Запущена'
+    mailing.save()
+
+
+def deliver_recorded(mailing, engine, clients=None, on_result=None, on_flush=None):
+    with AttemptRecorder(on_flush=on_flush) as recorder, RetryTracker(mailing) as retries:
+        def record(result):
+            recorder.add(mailing, result.client, result.status, result.response, result.code)
+            retries.add(result)
+            if on_result is not None:
+                on_result(result)
+
+        report = engine.deliver(mailing, clients=clients, on_result=record)
+    report.retried = retries.retried
+    report.suppressed = retries.suppressed
+    return report
+
+
+def deliver_mailing(mailing, engine=None, on_result=None, job=None):
+    # без задачи из очереди заводим свою: отправка всегда идёт по снимку
+    engine = engine or DeliveryEngine()
+    own_job = job is None
+    if own_job:
+        job = start_run(mailing)
+    try:
+        take_snapshot(job)
+        report = deliver_recorded(
+            mailing, engine, clients=iter_snapshot(job, engine.batch_size),
+            on_result=on_result, on_flush=snapshot_marker(job),
+        )
+    except Exception as e:
+        if own_job:
+            finish_run(job, error=str(e))
+        raise
+    if own_job:
+        finish_run(job, report)
+    finish_mailing(mailing)
+    return report
+
+
+def deliver_retries(moment=None, engine=None, on_result=None):
+    engine = engine or DeliveryEngine()
+    claimed = claim_due_retries(moment, limit=engine.batch_size)
+    report = DeliveryReport()
+    if not claimed:
+        return report
+
+    mailings = Mailing.objects.select_related('message').in_bulk(list(claimed))
+    for mailing_id, client_ids in claimed.items():
+        mailing = mailings.get(mailing_id)
+        clients = []
+        if mailing is not None and mailing.status == 'Запущена':
+            clients = list(mailing.get_recipients().filter(pk__in=client_ids))
+        # рассылка завершилась или клиент больше не получатель — повтор не нужен
+        stale = set(client_ids) - {client.pk for client in clients}
+        if stale:
+            DeliveryRetry.objects.filter(mailing_id=mailing_id, client_id__in=stale).delete()
+        if not clients:
+            continue
+        try:
+            result = deliver_recorded(mailing, engine, clients=clients, on_result=on_result)
+        except DeliveryAborted as e:
+            # оставшиеся повторы вернутся в работу, когда истечёт их аренда
+            logger.warning('Повтор писем рассылки #%s остановлен: %s', mailing_id, e)
+            break
+        report.sent += result.sent
+        report.failed += result.failed
+        report.retried += result.retried
+        report.suppressed += result.suppressed
+    return report
@@ -0,0 +1,68 @@
+import csv
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import TextField, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from .models import Attempt, Client
+
+
+FORMATS = ('csv', 'jsonl')
+CLIENT_FIELDS = ('id', 'email', 'full_name', 'comment', 'owner_id')
+ATTEMPT_FIELDS = ('id', 'timestamp', 'status', 'smtp_code', 'response_text', 'mailing_id', 'client_id')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def client_queryset(owner=None):
+    queryset = Client.objects.all()
+    if owner is not None:
+        queryset = queryset.filter(owner=owner)
+    return queryset
+
+
+def attempt_queryset(owner=None, mailing_id=None, date_from=None, date_to=None, status=None):
+    queryset = Attempt.objects.annotate(
+        response_text=Coalesce(NullIf('server_response', Value('', output_field=TextField())), 'response__text'),
+    )
+    if owner is not None:
+        queryset = queryset.filter(mailing__owner=owner)
+    if mailing_id is not None:
+        queryset = queryset.filter(mailing_id=mailing_id)
+    if status:
+        queryset = queryset.filter(mailing__status=status)
+    if date_from is not None:
+        queryset = queryset.filter(timestamp__gte=start_of_day(date_from))
+    if date_to is not None:
+        queryset = queryset.filter(timestamp__lt=start_of_day(date_to + timedelta(days=1)))
+    return queryset
+
+
+def iter_export(queryset, fields, fmt='csv', chunk_size=None):
+    # строки читаются курсором на стороне сервера порциями по chunk_size
+    # и сразу отдаются наружу, поэтому память не зависит от размера выгрузки
+    chunk_size = chunk_size or getattr(settings, 'MAILING_EXPORT_CHUNK_SIZE', 2000)
+    rows = queryset.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+    if fmt == 'jsonl':
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        for row in rows:
+            yield encoder.encode(dict(zip(fields, row))) + '\n'
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
@@ -1,7 +1,31 @@
 from django import forms
+from django.template import TemplateSyntaxError
+from django.urls import reverse_lazy
 from .models import (
-    Client, Message, Mailing
+    Client, ClientGroup, Message, Mailing
     )
+from .rendering import FORBIDDEN_TAG, compile_template
+
+
+class RecipientSearchWidget(forms.SelectMultiple):
+    # выводит только выбранных клиентов; остальных подгружает поиск на странице
+    def optgroups(self, name, value, attrs=None):
+        # значения приходят из POST как есть: нечисловые отбрасываем, иначе filter упадёт
+        selected = [v for v in value if str(v).isdigit()]
+        queryset = self.choices.queryset.filter(pk__in=selected) if selected else []
+        options = [
+            self.create_option(name, client.pk, str(client), True, index, attrs=attrs)
+            for index, client in enumerate(queryset)
+        ]
+        return [(None, options, 0)]
+
+
+def recipient_search_widget():
+    return RecipientSearchWidget(attrs={
+        'size': 10,
+        'class': 'recipient-search',
+        'data-search-url': reverse_lazy('client_search'),
+    })
 
 
 class ClientForm(forms.ModelForm):
@@ -12,14 +36,89 @@ class ClientForm(forms.ModelForm):
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
-        fields = ['subject', 'body']
+        fields = ['subject', 'body', 'html_body']
+        help_texts = {
+            'body': 'Можно использовать {{ full_name }}, {{ email }}, {{ comment }} и {{ unsubscribe_url }}.',
+        }
+
+    def clean_template(self, name):
+        value = self.cleaned_data[name]
+        forbidden = FORBIDDEN_TAG.search(value)
+        if forbidden:
+            raise forms.ValidationError(f'Тег {{% {forbidden.group(1)} %}} в сообщениях недоступен.')
+        try:
+            compile_template(value)
+        except TemplateSyntaxError as e:
+            raise forms.ValidationError(f'Ошибка в шаблоне: {e}')
+        return value
+
+    def clean_subject(self):
+        return self.clean_template('subject')
+
+    def clean_body(self):
+        return self.clean_template('body')
+
+    def clean_html_body(self):
+        return self.clean_template('html_body')
 
 class MailingForm(forms.ModelForm):
     class Meta:
         model = Mailing
-        fields = ['start_datetime', 'end_datetime', 'status', 'message', 'recipients']
+        fields = ['start_datetime', 'end_datetime', 'status', 'message', 'group', 'recipients']
         widgets = {
             'start_datetime': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             'end_datetime': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
-            'recipients': forms.SelectMultiple(attrs={'size': 10}),
+            'recipients': recipient_search_widget(),
         }
+
+    def __init__(self, *args, owner=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if owner is not None:
+            self.fields['recipients'].queryset = Client.objects.filter(owner=owner)
+            self.fields['group'].queryset = ClientGroup.objects.filter(owner=owner)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('recipients') and not cleaned_data.get('group'):
+            raise forms.ValidationError("Выберите получателей или группу клиентов.")
+        return cleaned_data
+
+class ClientGroupForm(forms.ModelForm):
+    class Meta:
+        model = ClientGroup
+        fields = ['name', 'clients']
+        widgets = {
+            'clients': recipient_search_widget(),
+        }
+
+    def __init__(self, *args, owner=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if owner is not None:
+            self.fields['clients'].queryset = Client.objects.filter(owner=owner)
+
+class StatsFilterForm(forms.Form):
+    date_from = forms.DateField(
+        label='С', required=False, widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    date_to = forms.DateField(
+        label='По', required=False, widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    status = forms.ChoiceField(
+        label='Статус', required=False, choices=[('', 'Все')] + Mailing.STATUS_CHOICES
+    )
+
+class ClientImportForm(forms.Form):
+    file = forms.FileField(label='Файл (CSV или JSONL)')
+    format = forms.ChoiceField(
+        label='Формат',
+        required=False,
+        choices=[('', 'Определить по расширению'), ('csv', 'CSV'), ('jsonl', 'JSONL')],
+    )
+
+class ExportFilterForm(forms.Form):
+    format = forms.ChoiceField(required=False, choices=[('csv', 'CSV'), ('jsonl', 'JSONL')])
+    mailing = forms.IntegerField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    # ссылка со страницы статистики передаёт её фильтры, в том числе статус рассылки
+    status = forms.ChoiceField(required=False, choices=[('', 'Все')] + Mailing.STATUS_CHOICES)
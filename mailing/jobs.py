@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.timezone import now
+
+from .aiodelivery import deliver_mailing_async
+from .delivery import deliver_mailing, deliver_retries
+from .models import DeliveryJob
+from .runs import (
+    default_worker_name, finish_run, lock_mailing, release_claimed, running_job, stale_jobs_condition,
+)
+from .tracking import ingest_events
+
+
+def enqueue_mailing(mailing):
+    with transaction.atomic():
+        lock_mailing(mailing.pk)
+        job = DeliveryJob.objects.filter(
+            mailing=mailing,
+            status__in=[DeliveryJob.STATUS_QUEUED, DeliveryJob.STATUS_RUNNING],
+        ).first()
+        if job is not None:
+            return job, False
+        return DeliveryJob.objects.create(mailing=mailing), True
+
+
+def claim_job(worker):
+    # SKIP LOCKED: несколько обработчиков (в том числе на разных узлах)
+    # разбирают очередь, не блокируя друг друга на одной и той же строке;
+    # зависшие задачи упавших обработчиков забираются и продолжаются по снимку
+    # задачу из очереди не берём, пока по этой рассылке идёт другой запуск
+    running = DeliveryJob.objects.filter(mailing=OuterRef('mailing'), status=DeliveryJob.STATUS_RUNNING)
+    with transaction.atomic():
+        job = (
+            DeliveryJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=DeliveryJob.STATUS_QUEUED) & ~Exists(running) | stale_jobs_condition())
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        lock_mailing(job.mailing_id)
+        if job.status == DeliveryJob.STATUS_QUEUED and running_job(job.mailing_id) is not None:
+            # запуск в обход очереди начался, пока мы выбирали задачу
+            return None
+        taken_over = job.status == DeliveryJob.STATUS_RUNNING
+        job.status = DeliveryJob.STATUS_RUNNING
+        job.started_at = job.started_at or now()
+        job.heartbeat_at = now()
+        job.worker = worker
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'worker'])
+        if taken_over:
+            release_claimed(job)
+    return job
+
+
+def run_job(job, use_async=False):
+    try:
+        if use_async:
+            report = asyncio.run(deliver_mailing_async(job.mailing, job=job))
+        else:
+            report = deliver_mailing(job.mailing, job=job)
+    except Exception as e:
+        return finish_run(job, error=str(e))
+    return finish_run(job, report)
+
+
+def run_worker(worker=None, poll_interval=5, burst=False, use_async=False):
+    worker = worker or default_worker_name()
+    processed = 0
+    while True:
+        job = claim_job(worker)
+        if job is not None:
+            run_job(job, use_async)
+            processed += 1
+            continue
+        # очередь пуста — досылаем письма, для которых подошло время повтора
+        if deliver_retries().total:
+            continue
+        # и переносим накопленные открытия и переходы в EmailEvent
+        if ingest_events():
+            continue
+        if burst:
+            return processed
+        time.sleep(poll_interval)
+
+
+def worker_process(worker, poll_interval, burst, use_async=False):
+    # точка входа дочернего процесса: при запуске через spawn Django ещё не настроен
+    import django
+    django.setup()
+    try:
+        run_worker(worker, poll_interval, burst, use_async)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,152 @@
+import asyncio
+import resource
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from accounts.models import CustomUser
+from mailing import dashboard
+from mailing.aiodelivery import SMTP_BACKEND, AsyncDeliveryEngine, deliver_mailing_async
+from mailing.bench import QueryCounter, SMTPSinkHandler, SinkEmailBackend, percentile, start_smtp_sink
+from mailing.delivery import DeliveryEngine, deliver_mailing
+from mailing.models import Client, Mailing, Message
+
+BENCH_OWNER = 'bench-delivery@localhost'
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости отправки рассылки на синтетических клиентах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Количество синтетических клиентов')
+        parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+        parser.add_argument('--concurrency', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument(
+            '--sink', choices=['memory', 'smtp', 'settings'], default='memory',
+            help='memory — бэкенд без сети, smtp — локальный SMTP-сервер на aiosmtpd, '
+                 'settings — EMAIL_BACKEND из настроек проекта',
+        )
+        parser.add_argument(
+            '--allow-real-smtp', action='store_true',
+            help='Разрешить --sink settings, когда в настройках настоящий SMTP-сервер',
+        )
+        parser.add_argument('--port', type=int, default=8025, help='Порт локального SMTP-сервера')
+        parser.add_argument('--latency', type=float, default=0, help='Задержка сервера на письмо, мс')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Доля писем с ошибкой, 0..1')
+        parser.add_argument('--permanent-share', type=float, default=0.5, help='Доля постоянных ошибок среди отказов')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def create_mailing(self, count):
+        # данные замера принадлежат отдельному пользователю: удаление его
+        # каскадом убирает клиентов, рассылку, попытки и статистику
+        owner, _ = CustomUser.objects.get_or_create(email=BENCH_OWNER)
+        message = Message.objects.create(
+            owner=owner,
+            subject='Замер, {{ full_name }}',
+            body='Здравствуйте, {{ full_name }}!\nОтписаться: {{ unsubscribe_url }}',
+        )
+        # рассылка сразу «Завершена» и её окно отправки уже закрыто: ни планировщик,
+        # ни send_mailing --all-due её не возьмут, даже если замер упадёт
+        # или данные оставлены через --keep
+        mailing = Mailing.objects.create(
+            owner=owner,
+            message=message,
+            status='Завершена',
+            start_datetime=timezone.now() - timedelta(days=1),
+            end_datetime=timezone.now(),
+        )
+        stamp = time.time_ns()
+        clients = Client.objects.bulk_create(
+            [
+                Client(email=f'bench{i}.{stamp}@example.com', full_name=f'Клиент {i}', owner=owner)
+                for i in range(count)
+            ],
+            batch_size=5000,
+        )
+        dashboard.adjust('unique_recipients', len(clients))
+        mailing.recipients.through.objects.bulk_create(
+            [mailing.recipients.through(mailing_id=mailing.pk, client_id=client.pk) for client in clients],
+            batch_size=5000,
+        )
+        return owner, Mailing.objects.select_related('message').get(pk=mailing.pk)
+
+    def sink_settings(self, kwargs):
+        latency = kwargs['latency'] / 1000
+        if kwargs['sink'] == 'smtp':
+            try:
+                handler = SMTPSinkHandler(latency, kwargs['failure_rate'], kwargs['permanent_share'])
+                controller = start_smtp_sink(handler, kwargs['port'])
+            except ImportError:
+                raise CommandError('Для --sink smtp установите aiosmtpd.')
+            overrides = {
+                'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+                'EMAIL_HOST': '127.0.0.1',
+                'EMAIL_PORT': kwargs['port'],
+                'EMAIL_HOST_USER': '',
+                'EMAIL_HOST_PASSWORD': '',
+                'EMAIL_USE_TLS': False,
+                'EMAIL_USE_SSL': False,
+            }
+            return overrides, controller.stop
+        if kwargs['sink'] == 'settings':
+            if settings.EMAIL_BACKEND == SMTP_BACKEND and not kwargs['allow_real_smtp']:
+                raise CommandError(
+                    f'В настройках настоящий SMTP-сервер ({settings.EMAIL_HOST}): письма уйдут на адреса '
+                    f'синтетических клиентов. Добавьте --allow-real-smtp, если это и нужно.'
+                )
+            return {}, None
+        SinkEmailBackend.latency = latency
+        SinkEmailBackend.failure_rate = kwargs['failure_rate']
+        SinkEmailBackend.permanent_share = kwargs['permanent_share']
+        return {'EMAIL_BACKEND': 'mailing.bench.SinkEmailBackend'}, None
+
+    def handle(self, *args, **kwargs):
+        count = kwargs['count']
+        overrides, stop_sink = self.sink_settings(kwargs)
+        latencies = []
+
+        def collect(result):
+            latencies.append(result.elapsed)
+
+        owner = None
+        try:
+            setup_started = time.perf_counter()
+            owner, mailing = self.create_mailing(count)
+            self.stdout.write(f'Подготовлено клиентов: {count} за {time.perf_counter() - setup_started:.2f} с.')
+            with override_settings(**overrides), QueryCounter() as queries:
+                if kwargs['engine'] == 'async':
+                    engine = AsyncDeliveryEngine(concurrency=kwargs['concurrency'], batch_size=kwargs['batch_size'])
+                else:
+                    engine = DeliveryEngine(concurrency=kwargs['concurrency'] or 1, batch_size=kwargs['batch_size'])
+                started = time.perf_counter()
+                if kwargs['engine'] == 'async':
+                    report = asyncio.run(deliver_mailing_async(mailing, engine, on_result=collect))
+                else:
+                    report = deliver_mailing(mailing, engine, on_result=collect)
+                elapsed = time.perf_counter() - started
+        finally:
+            if stop_sink is not None:
+                stop_sink()
+            if owner is not None and not kwargs['keep']:
+                owner.delete()
+
+        # ru_maxrss в Linux — в килобайтах
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f'Движок: {kwargs["engine"]}, соединений: {engine.concurrency}, приёмник: {kwargs["sink"]}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено {report.sent}, ошибок {report.failed} за {elapsed:.2f} с '
+            f'({report.total / elapsed:.1f} писем/с).'
+        ))
+        self.stdout.write(
+            f'Задержка на письмо: p50 {percentile(latencies, 50) * 1000:.1f} мс, '
+            f'p95 {percentile(latencies, 95) * 1000:.1f} мс, p99 {percentile(latencies, 99) * 1000:.1f} мс.'
+        )
+        self.stdout.write(
+            f'Запросов к БД: {queries.count} ({queries.count / max(report.total, 1):.3f} на письмо), '
+            f'пиковая память процесса: {peak_rss:.0f} МБ.'
+        )
+        self.stdout.write(f'Отложено для повтора: {report.retried}, в списке подавления: {report.suppressed}.')
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailing.models import Client, Message
+from mailing.rendering import MessageRenderer
+
+SUBJECT = '{{ full_name }}, новости этой недели'
+BODY = '''Здравствуйте, {{ full_name }}!
+
+Это письмо отправлено на {{ email }}.
+Подробности: https://example.com/news?week=42
+{% if comment %}Заметка: {{ comment }}{% endif %}
+
+Отписаться: {{ unsubscribe_url }}
+'''
+HTML_BODY = '''<p>Здравствуйте, <b>{{ full_name }}</b>!</p>
+<p>Это письмо отправлено на {{ email }}.</p>
+<p><a href="https://example.com/news?week=42&amp;from=mail">Подробности</a></p>
+<p><a href="{{ unsubscribe_url }}">Отписаться</a></p>
+'''
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости подготовки персональных писем (без БД и отправки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Количество получателей')
+        parser.add_argument('--message', type=int, default=None, help='ID сообщения вместо встроенного шаблона')
+        parser.add_argument('--track', action='store_true', help='Переписывать ссылки и добавлять пиксель открытия')
+        parser.add_argument('--serialize', action='store_true', help='Также собирать MIME-представление письма')
+
+    def handle(self, *args, **kwargs):
+        count = kwargs['count']
+        if kwargs['message']:
+            message = Message.objects.get(pk=kwargs['message'])
+        else:
+            message = Message(subject=SUBJECT, body=BODY, html_body=HTML_BODY)
+
+        started = time.perf_counter()
+        # для замера достаточно условного id рассылки: токены считаются без БД
+        renderer = MessageRenderer(message, mailing_id=1 if kwargs['track'] else None)
+        compiled = time.perf_counter() - started
+
+        # клиенты создаются в памяти: меряем только шаблоны и сборку письма
+        clients = (
+            Client(pk=i, email=f'client{i}@example.com', full_name=f'Клиент {i}', comment='')
+            for i in range(1, count + 1)
+        )
+        started = time.perf_counter()
+        for client in clients:
+            email = renderer.render(client)
+            if kwargs['serialize']:
+                email.message()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'Компиляция шаблонов: {compiled * 1000:.2f} мс.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Подготовлено писем: {count} за {elapsed:.2f} с '
+            f'({count / elapsed:.0f} писем/с, {elapsed / count * 1e6:.1f} мкс на письмо).'
+        ))
@@ -0,0 +1,56 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from accounts.models import CustomUser
+from mailing.exporters import (
+    ATTEMPT_FIELDS, CLIENT_FIELDS, FORMATS, attempt_queryset, client_queryset, iter_export,
+)
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка клиентов или журнала попыток в CSV/JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['clients', 'attempts'])
+        parser.add_argument('--owner', help='Email владельца')
+        parser.add_argument('--mailing', type=int, help='ID рассылки (только для attempts)')
+        parser.add_argument('--since', help='Начальная дата, ГГГГ-ММ-ДД (только для attempts)')
+        parser.add_argument('--until', help='Конечная дата, ГГГГ-ММ-ДД (только для attempts)')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help='Файл для записи (по умолчанию stdout)')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def parse_date(self, value):
+        if value is None:
+            return None
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f'Неверная дата: {value}')
+        return date
+
+    def handle(self, *args, **kwargs):
+        owner = None
+        if kwargs['owner']:
+            try:
+                owner = CustomUser.objects.get(email=kwargs['owner'])
+            except CustomUser.DoesNotExist:
+                raise CommandError('Пользователь не найден.')
+
+        if kwargs['kind'] == 'clients':
+            queryset, fields = client_queryset(owner), CLIENT_FIELDS
+        else:
+            queryset = attempt_queryset(
+                owner,
+                kwargs['mailing'],
+                self.parse_date(kwargs['since']),
+                self.parse_date(kwargs['until']),
+            )
+            fields = ATTEMPT_FIELDS
+
+        chunks = iter_export(queryset, fields, kwargs['format'], kwargs['chunk_size'])
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from accounts.models import CustomUser
+from mailing.importers import FORMATS, detect_format, import_clients
+
+
+class Command(BaseCommand):
+    help = 'Импорт клиентов из CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help='Email владельца клиентов')
+        parser.add_argument('--format', choices=FORMATS, default=None, help='По умолчанию — по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        try:
+            owner = CustomUser.objects.get(email=kwargs['owner'])
+        except CustomUser.DoesNotExist:
+            raise CommandError('Пользователь не найден.')
+
+        path = kwargs['path']
+        fmt = kwargs['format'] or detect_format(path)
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream, transaction.atomic():
+                report = import_clients(stream, owner, fmt, kwargs['batch_size'])
+        except UnicodeDecodeError:
+            raise CommandError('Файл должен быть в кодировке UTF-8.')
+        except csv.Error as e:
+            raise CommandError(f'Файл не удалось разобрать как CSV: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершён: {report}.'))
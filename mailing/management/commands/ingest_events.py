@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailing.tracking import ingest_events
+
+
+class Command(BaseCommand):
+    help = 'Перенос открытий писем и переходов по ссылкам из буфера Redis в журнал событий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1, help='Пауза, когда буфер пуст, сек.')
+        parser.add_argument('--burst', action='store_true', help='Завершиться, когда буфер опустеет')
+
+    def handle(self, *args, **kwargs):
+        total = 0
+        try:
+            while True:
+                ingested = ingest_events(kwargs['batch_size'])
+                total += ingested
+                if ingested:
+                    continue
+                if kwargs['burst']:
+                    break
+                time.sleep(kwargs['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Перенесено событий: {total}.'))
@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from mailing.models import Attempt, AttemptArchive
+
+
+class Command(BaseCommand):
+    help = 'Перенос в архив (или удаление) попыток рассылок старше срока хранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Срок хранения попыток в днях (по умолчанию MAILING_ATTEMPT_RETENTION_DAYS)',
+        )
+        parser.add_argument('--delete', action='store_true', help='Удалять попытки без переноса в архив')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0, help='Пауза между пачками, сек.')
+
+    def handle(self, *args, **kwargs):
+        days = kwargs['days'] or getattr(settings, 'MAILING_ATTEMPT_RETENTION_DAYS', 180)
+        if days <= 0:
+            raise CommandError('Срок хранения должен быть положительным.')
+        cutoff = timezone.now() - timedelta(days=days)
+        batch_size = kwargs['batch_size']
+        archive = not kwargs['delete']
+
+        # счётчики MailingStats/OwnerStats не трогаем: статистика продолжает
+        # показывать полные итоги, даже когда сами попытки уже удалены
+        old = Attempt.objects.filter(timestamp__lt=cutoff)
+        processed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    old.filter(id__gt=last_id).order_by('id').values(
+                        'id', 'timestamp', 'status', 'server_response', 'response_id',
+                        'smtp_code', 'mailing_id', 'client_id',
+                    )[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                if archive:
+                    AttemptArchive.objects.bulk_create(
+                        [AttemptArchive(**row) for row in rows], ignore_conflicts=True
+                    )
+                Attempt.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            processed += len(rows)
+            self.stdout.write(f'Обработано попыток: {processed}')
+            if kwargs['sleep']:
+                time.sleep(kwargs['sleep'])
+
+        action = 'перенесено в архив' if archive else 'удалено'
+        self.stdout.write(self.style.SUCCESS(f'Попыток старше {days} дн. {action}: {processed}.'))
@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from mailing.models import Attempt, AttemptArchive, EmailEvent, Mailing, MailingStats, OwnerStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков статистики рассылок по журналу попыток, его архиву и событиям писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Количество рассылок за один проход')
+
+    def handle(self, *args, **kwargs):
+        chunk_size = kwargs['chunk_size']
+        last_id = 0
+        rebuilt = 0
+
+        while True:
+            mailing_ids = list(
+                Mailing.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not mailing_ids:
+                break
+            last_id = mailing_ids[-1]
+            self.rebuild_mailings(mailing_ids)
+            rebuilt += len(mailing_ids)
+            self.stdout.write(f'Пересчитано рассылок: {rebuilt}')
+
+        self.rebuild_owners(chunk_size)
+        self.stdout.write(self.style.SUCCESS('Статистика рассылок пересчитана.'))
+
+    def rebuild_mailings(self, mailing_ids):
+        # строки счётчиков не удаляем, а блокируем и обновляем на месте:
+        # запись попыток делает F()-инкременты тех же строк, и после блокировки
+        # пересчёт видит все закоммиченные попытки, а ждущие блокировки
+        # инкременты применятся уже поверх пересчитанных значений
+        MailingStats.objects.bulk_create(
+            [MailingStats(mailing_id=mailing_id) for mailing_id in mailing_ids], ignore_conflicts=True
+        )
+        with transaction.atomic():
+            rows = list(
+                MailingStats.objects.select_for_update().filter(mailing_id__in=mailing_ids).order_by('mailing_id')
+            )
+
+            counts = {}
+            for model in (AttemptArchive, Attempt):
+                for row in model.objects.filter(mailing_id__in=mailing_ids).values('mailing_id').annotate(
+                    success=Count('id', filter=Q(status='Успешно')),
+                    fail=Count('id', filter=Q(status='Не успешно')),
+                    last=Max('timestamp'),
+                ).order_by():
+                    total = counts.setdefault(row['mailing_id'], {'success': 0, 'fail': 0, 'last': None})
+                    total['success'] += row['success']
+                    total['fail'] += row['fail']
+                    total['last'] = max(filter(None, [total['last'], row['last']]), default=None)
+            events = {
+                row['mailing_id']: row
+                for row in EmailEvent.objects.filter(mailing_id__in=mailing_ids).values('mailing_id').annotate(
+                    opens=Count('id', filter=Q(kind=EmailEvent.KIND_OPEN)),
+                    clicks=Count('id', filter=Q(kind=EmailEvent.KIND_CLICK)),
+                ).order_by()
+            }
+
+            for row in rows:
+                row.success_count = counts.get(row.mailing_id, {}).get('success', 0)
+                row.fail_count = counts.get(row.mailing_id, {}).get('fail', 0)
+                row.last_attempt_at = counts.get(row.mailing_id, {}).get('last')
+                row.open_count = events.get(row.mailing_id, {}).get('opens', 0)
+                row.click_count = events.get(row.mailing_id, {}).get('clicks', 0)
+            MailingStats.objects.bulk_update(
+                rows, ['success_count', 'fail_count', 'last_attempt_at', 'open_count', 'click_count']
+            )
+
+    def rebuild_owners(self, chunk_size):
+        owner_ids = list(
+            MailingStats.objects.values_list('mailing__owner_id', flat=True).distinct().order_by('mailing__owner_id')
+        )
+        OwnerStats.objects.bulk_create(
+            [OwnerStats(owner_id=owner_id) for owner_id in owner_ids], batch_size=chunk_size, ignore_conflicts=True
+        )
+        with transaction.atomic():
+            # запись попыток меняет MailingStats раньше OwnerStats в одной транзакции,
+            # поэтому суммы, прочитанные после блокировки, согласованы с владельцами
+            rows = list(OwnerStats.objects.select_for_update().order_by('owner_id'))
+            totals = {
+                row['mailing__owner_id']: row
+                for row in MailingStats.objects.values('mailing__owner_id').annotate(
+                    success=Sum('success_count'),
+                    fail=Sum('fail_count'),
+                    last=Max('last_attempt_at'),
+                ).order_by()
+            }
+            for row in rows:
+                total = totals.get(row.owner_id, {})
+                row.success_count = total.get('success') or 0
+                row.fail_count = total.get('fail') or 0
+                row.last_attempt_at = total.get('last')
+            OwnerStats.objects.bulk_update(
+                rows, ['success_count', 'fail_count', 'last_attempt_at'], batch_size=chunk_size
+            )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from mailing.dashboard import refresh_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков главной страницы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Повторять каждые N секунд (0 — один раз)')
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs['interval']
+        while True:
+            counters = refresh_counters()
+            self.stdout.write(
+                f"Рассылок: {counters['total_mailings']}, активных: {counters['active_mailings']}, "
+                f"уникальных получателей: {counters['unique_recipients']}."
+            )
+            if interval <= 0:
+                break
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
@@ -0,0 +1,56 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from mailing.jobs import default_worker_name, run_worker, worker_process
+
+
+class Command(BaseCommand):
+    help = 'Запуск обработчиков очереди отправки рассылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов-обработчиков')
+        parser.add_argument('--poll-interval', type=float, default=5, help='Пауза между опросами пустой очереди, сек.')
+        parser.add_argument('--burst', action='store_true', help='Завершиться, когда очередь опустеет')
+        parser.add_argument('--async', action='store_true', dest='use_async', help='Асинхронная отправка (asyncio)')
+
+    def handle(self, *args, **kwargs):
+        workers = kwargs['workers']
+        poll_interval = kwargs['poll_interval']
+        burst = kwargs['burst']
+        use_async = kwargs['use_async']
+        name = default_worker_name()
+
+        if workers <= 1:
+            self.stdout.write(f'Обработчик {name} запущен.')
+            try:
+                processed = run_worker(name, poll_interval, burst, use_async)
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(self.style.SUCCESS(f'Обработано задач: {processed}.'))
+            return
+
+        # дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=worker_process,
+                args=(f'{name}/{i}', poll_interval, burst, use_async),
+                name=f'delivery-worker-{i}',
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Запущено обработчиков: {workers}.')
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+        self.stdout.write(self.style.SUCCESS('Обработчики остановлены.'))
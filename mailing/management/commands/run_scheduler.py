@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from mailing.scheduler import run_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Планировщик: запускает и завершает рассылки по расписанию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-sleep', type=float, default=60, help='Максимальная пауза между проверками, сек.')
+        parser.add_argument('--once', action='store_true', help='Выполнить одну проверку и завершиться')
+
+    def handle(self, *args, **kwargs):
+        def report(started, finished):
+            if started or finished:
+                self.stdout.write(f'Запущено рассылок: {started}, завершено: {finished}.')
+
+        self.stdout.write('Планировщик запущен.')
+        try:
+            run_scheduler(max_sleep=kwargs['max_sleep'], once=kwargs['once'], on_tick=report)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('Планировщик остановлен.'))
@@ -1,36 +1,108 @@
-from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from mailing.aiodelivery import AsyncDeliveryEngine, deliver_mailing_async
+from mailing.bench import percentile
+from mailing.delivery import FAILURE, DeliveryAborted, DeliveryEngine, deliver_mailing
 from mailing.models import Mailing
+from mailing.ratelimit import RateLimiter
+from mailing.runs import MailingBusy
 from django.utils import timezone
 
+
 class Command(BaseCommand):
-    help = 'Отправка рассылки по ID'
+    help = 'Отправка рассылок по ID или всех рассылок, время которых наступило'
 
     def add_arguments(self, parser):
-        parser.add_argument('mailing_id', type=int)
+        parser.add_argument('mailing_ids', nargs='*', type=int)
+        parser.add_argument('--all-due', action='store_true', help='Отправить все рассылки, время которых наступило')
+        parser.add_argument(
+            '--engine', choices=['threaded', 'async'], default='threaded',
+            help='Отправка потоками или через asyncio (сравнение: запустите с обоими значениями)',
+        )
+        parser.add_argument('--concurrency', type=int, default=None, help='Количество параллельных SMTP-соединений')
+        parser.add_argument('--rate-limit', type=float, default=0, help='Не больше N писем в секунду (0 — без ограничений)')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--from-email', default=None)
+
+    def get_mailings(self, mailing_ids, all_due):
+        if all_due:
+            moment = timezone.now()
+            return list(
+                Mailing.objects.filter(
+                    status__in=['Создана', 'Запущена'],
+                    start_datetime__lte=moment,
+                    end_datetime__gt=moment,
+                ).select_related('message').order_by('id')
+            )
+
+        mailings = Mailing.objects.select_related('message').in_bulk(mailing_ids)
+        result = []
+        for mailing_id in mailing_ids:
+            mailing = mailings.get(mailing_id)
+            if mailing is None:
+                self.stdout.write(self.style.ERROR(f'Рассылка #{mailing_id} не найдена.'))
+            elif mailing.status == 'Завершена':
+                self.stdout.write(self.style.ERROR(f'Рассылка #{mailing_id} уже завершена.'))
+            else:
+                result.append(mailing)
+        return result
 
     def handle(self, *args, **kwargs):
-        mailing_id = kwargs['mailing_id']
-        try:
-            mailing = Mailing.objects.get(pk=mailing_id)
-        except Mailing.DoesNotExist:
-            self.stdout.write(self.style.ERROR('Рассылка не найдена.'))
-            return
+        if not kwargs['mailing_ids'] and not kwargs['all_due']:
+            raise CommandError('Укажите ID рассылок или --all-due.')
 
-        if mailing.status == 'Завершена':
-            self.stdout.write(self.style.ERROR('Рассылка уже завершена.'))
+        mailings = self.get_mailings(kwargs['mailing_ids'], kwargs['all_due'])
+        if not mailings:
+            self.stdout.write('Нет рассылок для отправки.')
             return
 
-        for client in mailing.recipients.all():
-            send_mail(
-                subject=mailing.message.subject,
-                message=mailing.message.body,
-                from_email='noreply@example.com',
-                recipient_list=[client.email],
-                fail_silently=False,
-            )
+        rate_limiter = RateLimiter(kwargs['rate_limit']) if kwargs['rate_limit'] > 0 else None
+        engine_class = AsyncDeliveryEngine if kwargs['engine'] == 'async' else DeliveryEngine
+        engine = engine_class(
+            batch_size=kwargs['batch_size'],
+            from_email=kwargs['from_email'],
+            concurrency=kwargs['concurrency'] or (None if kwargs['engine'] == 'async' else 1),
+            rate_limiter=rate_limiter,
+        )
+
+        latencies = []
+        failures = 0
 
-        mailing.status = 'Запущена'
-        mailing.save()
+        def collect(result):
+            nonlocal failures
+            latencies.append(result.elapsed)
+            if result.status == FAILURE:
+                failures += 1
+
+        started = time.perf_counter()
+        for mailing in mailings:
+            try:
+                if kwargs['engine'] == 'async':
+                    report = asyncio.run(deliver_mailing_async(mailing, engine, on_result=collect))
+                else:
+                    report = deliver_mailing(mailing, engine, on_result=collect)
+            except (MailingBusy, DeliveryAborted) as e:
+                self.stdout.write(self.style.ERROR(str(e)))
+                continue
+            self.stdout.write(
+                f'Рассылка #{mailing.id}: отправлено {report.sent}, ошибок {report.failed} '
+                f'(отложено для повтора {report.retried}, в списке подавления {report.suppressed}).'
+            )
+        elapsed = time.perf_counter() - started
 
-        self.stdout.write(self.style.SUCCESS('Рассылка отправлена успешно.'))
+        total = len(latencies)
+        throughput = total / elapsed if elapsed else 0
+        self.stdout.write(f'Движок: {kwargs["engine"]}, параллельных соединений: {engine.concurrency}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего писем: {total} за {elapsed:.2f} с ({throughput:.1f} писем/с), ошибок: {failures}.'
+        ))
+        self.stdout.write(
+            f'Задержка на письмо: p50 {percentile(latencies, 50) * 1000:.1f} мс, '
+            f'p99 {percentile(latencies, 99) * 1000:.1f} мс.'
+        )
+        if engine.rate_limiter is not None:
+            stats = engine.rate_limiter.stats
+            throttled = ', '.join(f'{scope}: {count}' for scope, count in stats.throttled.items()) or 'нет'
+            self.stdout.write(f'Ожидание токенов: {stats.waited:.2f} с (ограничения: {throttled}).')
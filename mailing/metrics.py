@@ -0,0 +1,191 @@
+import atexit
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# значения копятся в памяти процесса и раз в MAILING_METRICS_FLUSH_INTERVAL
+# секунд одним запросом добавляются в хеш Redis из CACHES; /metrics читает
+# этот хеш и поэтому видит сумму по веб-процессам, командам и обработчикам
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._client = None
+
+    @property
+    def key(self):
+        return f"{settings.CACHES['default'].get('KEY_PREFIX', '')}:metrics"
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+        return self._client
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def add(self, sample, labels, amount):
+        key = (sample, tuple(sorted(labels.items())))
+        with self._lock:
+            self._pending[key] += amount
+            due = time.monotonic() - self._last_flush >= getattr(settings, 'MAILING_METRICS_FLUSH_INTERVAL', 5)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.monotonic()
+        if not pending or not getattr(settings, 'MAILING_METRICS_ENABLED', True):
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for (sample, labels), amount in pending.items():
+                field = json.dumps([sample, dict(labels)], ensure_ascii=False, sort_keys=True)
+                pipe.hincrbyfloat(self.key, field, amount)
+            pipe.execute()
+        except Exception:
+            # Redis недоступен — вернём значения в буфер и попробуем позже
+            with self._lock:
+                for key, amount in pending.items():
+                    self._pending[key] += amount
+
+    def samples(self):
+        self.flush()
+        values = defaultdict(list)
+        for field, value in self.client.hgetall(self.key).items():
+            sample, labels = json.loads(field)
+            values[sample].append((labels, float(value)))
+        return values
+
+    def render(self, gauges=()):
+        values = self.samples()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render(values))
+        for name, help_text, samples in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(format_sample(name, labels, value) for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def format_sample(name, labels, value):
+    return f'{name}{format_labels(labels)} {format_value(value)}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help_text, registry=None):
+        self.name = name
+        self.help = help_text
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, labels, amount)
+
+    def render(self, values):
+        return [format_sample(self.name, labels, value) for labels, value in values.get(self.name, [])]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, registry=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def observe(self, value, **labels):
+        # в буфере корзины не накопительные: одно значение — одна корзина;
+        # накопительные суммы le считаются только при выдаче /metrics
+        bucket = next(index for index, bound in enumerate(self.buckets) if value <= bound)
+        self.registry.add(f'{self.name}_bucket', dict(labels, le=bucket), 1)
+        self.registry.add(f'{self.name}_sum', labels, value)
+        self.registry.add(f'{self.name}_count', labels, 1)
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def render(self, values):
+        lines = []
+        series = defaultdict(lambda: [0.0] * len(self.buckets))
+        for labels, value in values.get(f'{self.name}_bucket', []):
+            labels = dict(labels)
+            index = labels.pop('le')
+            series[json.dumps(labels, sort_keys=True)][index] += value
+        for key, counts in series.items():
+            labels = json.loads(key)
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                lines.append(format_sample(f'{self.name}_bucket', dict(labels, le=format_value(bound)), total))
+        for suffix in ('_sum', '_count'):
+            lines.extend(
+                format_sample(f'{self.name}{suffix}', labels, value)
+                for labels, value in values.get(f'{self.name}{suffix}', [])
+            )
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+
+messages_total = Counter('mailing_messages_total', 'Письма, обработанные при отправке, по результату.')
+runs_total = Counter('mailing_runs_total', 'Запуски отправки рассылок по результату.')
+tracking_events_total = Counter('mailing_tracking_events_total', 'Открытия писем и переходы по ссылкам.')
+send_requests_total = Counter('mailing_send_requests_total', 'Запросы на отправку рассылки из интерфейса.')
+cache_requests_total = Counter('mailing_cache_requests_total', 'Обращения к кешу страниц по ключу и результату.')
+ratelimit_wait_seconds_total = Counter(
+    'mailing_ratelimit_wait_seconds_total', 'Время ожидания токенов ограничителя скорости, сек.'
+)
+smtp_connect_seconds = Histogram('mailing_smtp_connect_seconds', 'Время установки SMTP-соединения, сек.')
+smtp_send_seconds = Histogram('mailing_smtp_send_seconds', 'Время отправки одного письма, сек.')
+db_batch_seconds = Histogram('mailing_db_batch_seconds', 'Время пакетных операций с БД при отправке, сек.')
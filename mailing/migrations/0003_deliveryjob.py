@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 10:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0002_attempt_client'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('В очереди', 'В очереди'), ('Выполняется', 'Выполняется'), ('Выполнена', 'Выполнена'), ('Ошибка', 'Ошибка')], default='В очереди', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Поставлена в очередь')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало выполнения')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание выполнения')),
+                ('worker', models.CharField(blank=True, max_length=255, verbose_name='Обработчик')),
+                ('sent_count', models.PositiveIntegerField(default=0, verbose_name='Отправлено')),
+                ('failed_count', models.PositiveIntegerField(default=0, verbose_name='Не отправлено')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_jobs', to='mailing.mailing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='deliveryjob_status_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 10:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0003_deliveryjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'start_datetime'], name='mailing_status_start'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'end_datetime'], name='mailing_status_end'),
+        ),
+    ]
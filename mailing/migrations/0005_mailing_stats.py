@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 10:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_customuser_role'),
+        ('mailing', '0004_mailing_schedule_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingStats',
+            fields=[
+                ('mailing', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='mailing.mailing')),
+                ('success_count', models.PositiveBigIntegerField(default=0, verbose_name='Успешные попытки')),
+                ('fail_count', models.PositiveBigIntegerField(default=0, verbose_name='Неуспешные попытки')),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя попытка')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OwnerStats',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='mailing_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('success_count', models.PositiveBigIntegerField(default=0, verbose_name='Успешные попытки')),
+                ('fail_count', models.PositiveBigIntegerField(default=0, verbose_name='Неуспешные попытки')),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя попытка')),
+            ],
+        ),
+    ]
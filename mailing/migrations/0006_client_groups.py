@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 10:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0005_mailing_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailing',
+            name='recipients',
+            field=models.ManyToManyField(blank=True, related_name='mailings', to='mailing.client'),
+        ),
+        migrations.CreateModel(
+            name='ClientGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('clients', models.ManyToManyField(blank=True, related_name='groups', to='mailing.client', verbose_name='Клиенты')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_groups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mailings', to='mailing.clientgroup', verbose_name='Группа получателей'),
+        ),
+        # индексы для поиска по началу email/ФИО без учёта регистра (istartswith):
+        # UPPER(...) LIKE 'ABC%' использует индекс только с классом операторов text_pattern_ops
+        migrations.RunSQL(
+            sql='CREATE INDEX client_email_prefix ON mailing_client (UPPER(email) text_pattern_ops);',
+            reverse_sql='DROP INDEX IF EXISTS client_email_prefix;',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX client_full_name_prefix ON mailing_client (UPPER(full_name) text_pattern_ops);',
+            reverse_sql='DROP INDEX IF EXISTS client_full_name_prefix;',
+        ),
+    ]
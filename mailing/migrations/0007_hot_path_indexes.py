@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 10:09
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицы,
+    # но не может выполняться внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('mailing', '0006_client_groups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='attempt',
+            index=models.Index(fields=['mailing', 'status'], name='attempt_mailing_status'),
+        ),
+        AddIndexConcurrently(
+            model_name='attempt',
+            index=models.Index(fields=['timestamp'], name='attempt_timestamp'),
+        ),
+        AddIndexConcurrently(
+            model_name='attempt',
+            index=models.Index(condition=models.Q(('status', 'Не успешно')), fields=['mailing', 'timestamp'], name='attempt_failed'),
+        ),
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['owner', 'id'], name='client_owner_id'),
+        ),
+        AddIndexConcurrently(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'status'], name='mailing_owner_status'),
+        ),
+        AddIndexConcurrently(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'id'], name='mailing_owner_id'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 10:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttemptResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('text', models.TextField(verbose_name='Ответ почтового сервера')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='smtp_code',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP'),
+        ),
+        migrations.AlterField(
+            model_name='attempt',
+            name='server_response',
+            field=models.TextField(blank=True, verbose_name='Ответ почтового сервера'),
+        ),
+        migrations.CreateModel(
+            name='AttemptArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(verbose_name='Дата и время попытки')),
+                ('status', models.CharField(choices=[('Успешно', 'Успешно'), ('Не успешно', 'Не успешно')], max_length=20, verbose_name='Статус')),
+                ('server_response', models.TextField(blank=True, verbose_name='Ответ почтового сервера')),
+                ('response_id', models.BigIntegerField(blank=True, null=True)),
+                ('smtp_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP')),
+                ('mailing_id', models.BigIntegerField(db_index=True)),
+                ('client_id', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Перенесена в архив')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['timestamp'], name='attemptarchive_timestamp')],
+            },
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='response',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mailing.attemptresponse'),
+        ),
+    ]
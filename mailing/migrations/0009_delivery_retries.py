@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0008_compact_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Suppression',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='suppression', serialize=False, to='mailing.client')),
+                ('reason', models.CharField(choices=[('Постоянная ошибка', 'Постоянная ошибка'), ('Исчерпаны повторы', 'Исчерпаны повторы')], max_length=20, verbose_name='Причина')),
+                ('smtp_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Добавлен')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeliveryRetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='Следующая попытка')),
+                ('smtp_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='mailing.client')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='mailing.mailing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_attempt_at'], name='deliveryretry_next_attempt')],
+                'constraints': [models.UniqueConstraint(fields=('mailing', 'client'), name='deliveryretry_mailing_client')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0009_delivery_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='html_body',
+            field=models.TextField(blank=True, verbose_name='HTML-версия письма'),
+        ),
+        migrations.AlterField(
+            model_name='suppression',
+            name='reason',
+            field=models.CharField(choices=[('Постоянная ошибка', 'Постоянная ошибка'), ('Исчерпаны повторы', 'Исчерпаны повторы'), ('Отписка', 'Отписка')], max_length=20, verbose_name='Причина'),
+        ),
+    ]
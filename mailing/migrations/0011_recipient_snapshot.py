@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 10:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0010_message_html_body'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipientSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='Email')),
+                ('state', models.CharField(choices=[('Ожидает', 'Ожидает'), ('Отправлено', 'Отправлено'), ('Не отправлено', 'Не отправлено')], default='Ожидает', max_length=20, verbose_name='Состояние')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний признак жизни'),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='recipients_total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Получателей в списке'),
+        ),
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='snapshot_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Список получателей зафиксирован'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['status', 'heartbeat_at'], name='deliveryjob_status_heartbeat'),
+        ),
+        migrations.AddField(
+            model_name='recipientsnapshot',
+            name='client',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mailing.client'),
+        ),
+        migrations.AddField(
+            model_name='recipientsnapshot',
+            name='job',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='mailing.deliveryjob'),
+        ),
+        migrations.AddIndex(
+            model_name='recipientsnapshot',
+            index=models.Index(condition=models.Q(('state', 'Ожидает')), fields=['job', 'client'], name='recipientsnapshot_pending'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipientsnapshot',
+            constraint=models.UniqueConstraint(fields=('job', 'client'), name='recipientsnapshot_job_client'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+def drop_duplicate_jobs(apps, schema_editor):
+    # до появления ограничений одна рассылка могла стоять в очереди
+    # несколько раз; оставляем самую раннюю задачу каждого статуса
+    DeliveryJob = apps.get_model('mailing', 'DeliveryJob')
+    for status in ('В очереди', 'Выполняется'):
+        seen = set()
+        duplicates = []
+        for job_id, mailing_id in (
+            DeliveryJob.objects.filter(status=status).order_by('created_at', 'id').values_list('id', 'mailing_id')
+        ):
+            if mailing_id in seen:
+                duplicates.append(job_id)
+            seen.add(mailing_id)
+        DeliveryJob.objects.filter(id__in=duplicates).update(status='Ошибка', error='Дубликат задачи')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0011_recipient_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipientsnapshot',
+            name='state',
+            field=models.CharField(choices=[('Ожидает', 'Ожидает'), ('Отправляется', 'Отправляется'), ('Отправлено', 'Отправлено'), ('Не отправлено', 'Не отправлено')], default='Ожидает', max_length=20, verbose_name='Состояние'),
+        ),
+        migrations.AddConstraint(
+            model_name='deliveryjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'В очереди')), fields=('mailing',), name='deliveryjob_one_queued'),
+        ),
+        migrations.AddConstraint(
+            model_name='deliveryjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'Выполняется')), fields=('mailing',), name='deliveryjob_one_running'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 10:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailing', '0012_delivery_run_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingstats',
+            name='click_count',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Переходы по ссылкам'),
+        ),
+        migrations.AddField(
+            model_name='mailingstats',
+            name='open_count',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Открытия'),
+        ),
+        migrations.CreateModel(
+            name='EmailEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Открытие', 'Открытие'), ('Переход', 'Переход')], max_length=20, verbose_name='Событие')),
+                ('url', models.TextField(blank=True, verbose_name='Ссылка')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время события')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='mailing.client')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='mailing.mailing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mailing', 'kind', 'timestamp'], name='emailevent_mailing_kind')],
+            },
+        ),
+    ]
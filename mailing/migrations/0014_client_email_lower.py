@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 10:49
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индекс строится без блокировки записи в таблицу клиентов
+    atomic = False
+
+    dependencies = [
+        ('mailing', '0013_email_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='client_email_lower'),
+        ),
+    ]
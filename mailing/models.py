@@ -1,9 +1,16 @@
-from django.db import models
+import re
+from collections import defaultdict
+from hashlib import sha256
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest, Lower
 from django.utils import timezone
 from django.conf import settings
-from django.core.cache import cache
 from accounts.models import CustomUser
 
+EMAIL_IN_TEXT_RE = re.compile(r'[^\s<>\'"{}(),:;]+@[^\s<>\'"{}(),:;]+')
+
 
 class Client(models.Model):
     email = models.EmailField(unique=True)
@@ -11,13 +18,30 @@ class Client(models.Model):
     comment = models.TextField(blank=True)
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='client_owner_id'),
+            # импорт сверяет адреса без учёта регистра
+            models.Index(Lower('email'), name='client_email_lower'),
+        ]
+
     def __str__(self):
         return f"{self.full_name} <{self.email}>"
 
 
+class ClientGroup(models.Model):
+    name = models.CharField('Название', max_length=255)
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='client_groups')
+    clients = models.ManyToManyField('Client', related_name='groups', blank=True, verbose_name='Клиенты')
+
+    def __str__(self):
+        return self.name
+
+
 class Message(models.Model):
     subject = models.CharField(max_length=255, verbose_name='Тема письма')
     body = models.TextField(verbose_name='Тело письма')
+    html_body = models.TextField(verbose_name='HTML-версия письма', blank=True)
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='messages')
 
     def __str__(self):
@@ -46,16 +70,76 @@ class Mailing(models.Model):
     end_datetime = models.DateTimeField('Дата и время окончания отправки')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Создана')
     message = models.ForeignKey('Message', on_delete=models.CASCADE)
-    recipients = models.ManyToManyField('Client', related_name='mailings')
+    recipients = models.ManyToManyField('Client', related_name='mailings', blank=True)
+    group = models.ForeignKey(
+        'ClientGroup',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='mailings',
+        verbose_name='Группа получателей',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'start_datetime'], name='mailing_status_start'),
+            models.Index(fields=['status', 'end_datetime'], name='mailing_status_end'),
+            models.Index(fields=['owner', 'status'], name='mailing_owner_status'),
+            models.Index(fields=['owner', 'id'], name='mailing_owner_id'),
+        ]
 
     def __str__(self):
         return f"Рассылка #{self.id} - {self.status}"
 
+    def get_recipients(self):
+        # получатели рассылки — выбранные вручную клиенты и клиенты группы;
+        # подзапросы по id вместо JOIN по двум M2M, чтобы не плодить дубликаты
+        client_ids = Mailing.recipients.through.objects.filter(mailing_id=self.pk).values('client_id')
+        condition = Q(pk__in=client_ids)
+        if self.group_id:
+            group_ids = ClientGroup.clients.through.objects.filter(clientgroup_id=self.group_id).values('client_id')
+            condition |= Q(pk__in=group_ids)
+        # клиенты из списка подавления не получают никаких рассылок
+        return Client.objects.filter(condition, suppression__isnull=True)
+
     def save(self, *args, **kwargs):
         if self.end_datetime < timezone.now():
             self.status = 'Завершена'
         super().save(*args, **kwargs)
 
+
+class AttemptResponse(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    text = models.TextField('Ответ почтового сервера')
+
+    def __str__(self):
+        return self.text
+
+    @staticmethod
+    def normalize(text):
+        # адрес получателя в ответе (например, в SMTPRecipientsRefused) делает
+        # каждый текст уникальным; без него одинаковые отказы хранятся один раз
+        return EMAIL_IN_TEXT_RE.sub('<адрес>', text)
+
+    @staticmethod
+    def digest_of(text):
+        return sha256(text.encode()).hexdigest()
+
+    @classmethod
+    def intern_many(cls, texts):
+        # id для набора уже нормализованных текстов: один SELECT,
+        # а недостающие — одним INSERT ... ON CONFLICT DO NOTHING и повторным SELECT
+        digests = {cls.digest_of(text): text for text in texts}
+        found = dict(cls.objects.filter(digest__in=digests).values_list('digest', 'pk'))
+        missing = [cls(digest=digest, text=text) for digest, text in digests.items() if digest not in found]
+        if missing:
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+            found.update(
+                cls.objects.filter(digest__in=[row.digest for row in missing]).values_list('digest', 'pk')
+            )
+        return {text: found[digest] for digest, text in digests.items()}
+
+
 class Attempt(models.Model):
     STATUS_CHOICES = [
         ('Успешно', 'Успешно'),
@@ -64,19 +148,283 @@ class Attempt(models.Model):
 
     timestamp = models.DateTimeField('Дата и время попытки', default=timezone.now)
     status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES)
-    server_response = models.TextField('Ответ почтового сервера')
+    server_response = models.TextField('Ответ почтового сервера', blank=True)
+    response = models.ForeignKey(
+        'AttemptResponse', on_delete=models.PROTECT, null=True, blank=True, related_name='+'
+    )
+    smtp_code = models.PositiveSmallIntegerField('Код ответа SMTP', null=True, blank=True)
     mailing = models.ForeignKey('Mailing', on_delete=models.CASCADE, related_name='attempts')
     client = models.ForeignKey('Client', on_delete=models.CASCADE, related_name='attempts')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['mailing', 'status'], name='attempt_mailing_status'),
+            models.Index(fields=['timestamp'], name='attempt_timestamp'),
+            models.Index(
+                fields=['mailing', 'timestamp'],
+                condition=Q(status='Не успешно'),
+                name='attempt_failed',
+            ),
+        ]
+
     def __str__(self):
         return f"Попытка #{self.id} — {self.status} ({self.timestamp:%d.%m.%Y %H:%M})"
 
+    @property
+    def response_text(self):
+        if self.server_response or not self.response_id:
+            return self.server_response
+        return self.response.text
+
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        cache_key = f'mailing_stats_{self.mailing.owner.id}'
-        cache.delete(cache_key)
+        if adding:
+            MailingStats.record([self])
+
+
+class AttemptArchive(models.Model):
+    # журнал попыток старше срока хранения; без внешних ключей,
+    # чтобы удаление рассылок и клиентов не трогало архив
+    id = models.BigIntegerField(primary_key=True)
+    timestamp = models.DateTimeField('Дата и время попытки')
+    status = models.CharField('Статус', max_length=20, choices=Attempt.STATUS_CHOICES)
+    server_response = models.TextField('Ответ почтового сервера', blank=True)
+    response_id = models.BigIntegerField(null=True, blank=True)
+    smtp_code = models.PositiveSmallIntegerField('Код ответа SMTP', null=True, blank=True)
+    mailing_id = models.BigIntegerField(db_index=True)
+    client_id = models.BigIntegerField()
+    archived_at = models.DateTimeField('Перенесена в архив', default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='attemptarchive_timestamp'),
+        ]
+
+    def __str__(self):
+        return f"Архивная попытка #{self.id} — {self.status}"
+
+
+class EmailEvent(models.Model):
+    # открытия и переходы по ссылкам из писем; пишутся пачками
+    # из буфера в Redis (см. mailing.tracking), а не из самих запросов
+    KIND_OPEN = 'Открытие'
+    KIND_CLICK = 'Переход'
+    KIND_CHOICES = [
+        (KIND_OPEN, KIND_OPEN),
+        (KIND_CLICK, KIND_CLICK),
+    ]
+
+    mailing = models.ForeignKey('Mailing', on_delete=models.CASCADE, related_name='events')
+    client = models.ForeignKey('Client', on_delete=models.CASCADE, related_name='events')
+    kind = models.CharField('Событие', max_length=20, choices=KIND_CHOICES)
+    url = models.TextField('Ссылка', blank=True)
+    timestamp = models.DateTimeField('Дата и время события', default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['mailing', 'kind', 'timestamp'], name='emailevent_mailing_kind'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} — {self.client_id} в рассылке #{self.mailing_id}"
+
+
+class DeliveryRetry(models.Model):
+    mailing = models.ForeignKey('Mailing', on_delete=models.CASCADE, related_name='retries')
+    client = models.ForeignKey('Client', on_delete=models.CASCADE, related_name='retries')
+    attempts = models.PositiveSmallIntegerField('Неудачных попыток', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка')
+    smtp_code = models.PositiveSmallIntegerField('Код ответа SMTP', null=True, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
 
-    def delete(self, *args, **kwargs):
-        cache_key = f'mailing_stats_{self.mailing.owner.id}'
-        cache.delete(cache_key)
-        super().delete(*args, **kwargs)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mailing', 'client'], name='deliveryretry_mailing_client'),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='deliveryretry_next_attempt'),
+        ]
+
+    def __str__(self):
+        return f"Повтор для {self.client_id} в рассылке #{self.mailing_id} ({self.attempts})"
+
+
+class Suppression(models.Model):
+    REASON_PERMANENT = 'Постоянная ошибка'
+    REASON_EXHAUSTED = 'Исчерпаны повторы'
+    REASON_UNSUBSCRIBED = 'Отписка'
+    REASON_CHOICES = [
+        (REASON_PERMANENT, REASON_PERMANENT),
+        (REASON_EXHAUSTED, REASON_EXHAUSTED),
+        (REASON_UNSUBSCRIBED, REASON_UNSUBSCRIBED),
+    ]
+
+    client = models.OneToOneField(
+        'Client', on_delete=models.CASCADE, primary_key=True, related_name='suppression'
+    )
+    reason = models.CharField('Причина', max_length=20, choices=REASON_CHOICES)
+    smtp_code = models.PositiveSmallIntegerField('Код ответа SMTP', null=True, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Добавлен', auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.client_id}: {self.reason}"
+
+
+class MailingStats(models.Model):
+    mailing = models.OneToOneField('Mailing', on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    success_count = models.PositiveBigIntegerField('Успешные попытки', default=0)
+    fail_count = models.PositiveBigIntegerField('Неуспешные попытки', default=0)
+    last_attempt_at = models.DateTimeField('Последняя попытка', null=True, blank=True)
+    open_count = models.PositiveBigIntegerField('Открытия', default=0)
+    click_count = models.PositiveBigIntegerField('Переходы по ссылкам', default=0)
+
+    def __str__(self):
+        return f"Статистика рассылки #{self.mailing_id}"
+
+    @staticmethod
+    def bump(model, lookup, success, fail, last_attempt_at):
+        changes = {
+            'success_count': F('success_count') + success,
+            'fail_count': F('fail_count') + fail,
+            'last_attempt_at': Greatest('last_attempt_at', models.Value(last_attempt_at)),
+        }
+        if model.objects.filter(**lookup).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                model.objects.create(
+                    success_count=success, fail_count=fail, last_attempt_at=last_attempt_at, **lookup
+                )
+        except IntegrityError:
+            # строку успел создать параллельный процесс
+            model.objects.filter(**lookup).update(**changes)
+
+    @classmethod
+    def record(cls, attempts):
+        per_mailing = defaultdict(lambda: [0, 0, None])
+        per_owner = defaultdict(lambda: [0, 0, None])
+        for attempt in attempts:
+            for key, totals in (
+                (attempt.mailing_id, per_mailing),
+                (attempt.mailing.owner_id, per_owner),
+            ):
+                row = totals[key]
+                row[0 if attempt.status == 'Успешно' else 1] += 1
+                if row[2] is None or attempt.timestamp > row[2]:
+                    row[2] = attempt.timestamp
+
+        # строки обновляются в порядке ключей, как и в rebuild_mailing_stats,
+        # чтобы параллельные транзакции не блокировали друг друга крест-накрест
+        with transaction.atomic():
+            for mailing_id, (success, fail, last) in sorted(per_mailing.items()):
+                cls.bump(cls, {'mailing_id': mailing_id}, success, fail, last)
+            for owner_id, (success, fail, last) in sorted(per_owner.items()):
+                cls.bump(OwnerStats, {'owner_id': owner_id}, success, fail, last)
+
+    @classmethod
+    def record_events(cls, events):
+        per_mailing = defaultdict(lambda: [0, 0])
+        for event in events:
+            per_mailing[event.mailing_id][0 if event.kind == EmailEvent.KIND_OPEN else 1] += 1
+
+        with transaction.atomic():
+            for mailing_id, (opens, clicks) in sorted(per_mailing.items()):
+                changes = {'open_count': F('open_count') + opens, 'click_count': F('click_count') + clicks}
+                if cls.objects.filter(mailing_id=mailing_id).update(**changes):
+                    continue
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(mailing_id=mailing_id, open_count=opens, click_count=clicks)
+                except IntegrityError:
+                    cls.objects.filter(mailing_id=mailing_id).update(**changes)
+
+
+class OwnerStats(models.Model):
+    owner = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='mailing_stats')
+    success_count = models.PositiveBigIntegerField('Успешные попытки', default=0)
+    fail_count = models.PositiveBigIntegerField('Неуспешные попытки', default=0)
+    last_attempt_at = models.DateTimeField('Последняя попытка', null=True, blank=True)
+
+    def __str__(self):
+        return f"Статистика пользователя {self.owner_id}"
+
+class DeliveryJob(models.Model):
+    STATUS_QUEUED = 'В очереди'
+    STATUS_RUNNING = 'Выполняется'
+    STATUS_DONE = 'Выполнена'
+    STATUS_FAILED = 'Ошибка'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    mailing = models.ForeignKey('Mailing', on_delete=models.CASCADE, related_name='delivery_jobs')
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    created_at = models.DateTimeField('Поставлена в очередь', default=timezone.now)
+    started_at = models.DateTimeField('Начало выполнения', null=True, blank=True)
+    finished_at = models.DateTimeField('Окончание выполнения', null=True, blank=True)
+    worker = models.CharField('Обработчик', max_length=255, blank=True)
+    sent_count = models.PositiveIntegerField('Отправлено', default=0)
+    failed_count = models.PositiveIntegerField('Не отправлено', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    snapshot_at = models.DateTimeField('Список получателей зафиксирован', null=True, blank=True)
+    recipients_total = models.PositiveIntegerField('Получателей в списке', default=0)
+    heartbeat_at = models.DateTimeField('Последний признак жизни', null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # не больше одной задачи в очереди и одной выполняющейся на рассылку
+            models.UniqueConstraint(
+                fields=['mailing'], condition=Q(status='В очереди'), name='deliveryjob_one_queued',
+            ),
+            models.UniqueConstraint(
+                fields=['mailing'], condition=Q(status='Выполняется'), name='deliveryjob_one_running',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='deliveryjob_status_created'),
+            models.Index(fields=['status', 'heartbeat_at'], name='deliveryjob_status_heartbeat'),
+        ]
+
+    def __str__(self):
+        return f"Задача #{self.id} — рассылка #{self.mailing_id} ({self.status})"
+
+
+class RecipientSnapshot(models.Model):
+    # список получателей, зафиксированный при запуске задачи: правка
+    # получателей во время отправки на него не влияет, а прерванная
+    # задача продолжает с первой строки в состоянии «Ожидает»
+    STATE_PENDING = 'Ожидает'
+    STATE_SENDING = 'Отправляется'
+    STATE_SENT = 'Отправлено'
+    STATE_FAILED = 'Не отправлено'
+    STATE_CHOICES = [
+        (STATE_PENDING, STATE_PENDING),
+        (STATE_SENDING, STATE_SENDING),
+        (STATE_SENT, STATE_SENT),
+        (STATE_FAILED, STATE_FAILED),
+    ]
+
+    job = models.ForeignKey('DeliveryJob', on_delete=models.CASCADE, related_name='snapshot')
+    client = models.ForeignKey('Client', on_delete=models.CASCADE, related_name='+')
+    email = models.EmailField('Email')
+    state = models.CharField('Состояние', max_length=20, choices=STATE_CHOICES, default=STATE_PENDING)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'client'], name='recipientsnapshot_job_client'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['job', 'client'],
+                condition=Q(state='Ожидает'),
+                name='recipientsnapshot_pending',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.email} — задача #{self.job_id} ({self.state})"
@@ -0,0 +1,57 @@
+from django.conf import settings
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor, size):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.size = size
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_other_pages(self):
+        return self.next_cursor is not None or self.prev_cursor is not None
+
+
+def _int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_page_size(request):
+    default = getattr(settings, 'MAILING_PAGE_SIZE', 50)
+    size = _int_param(request, 'size') or default
+    return max(1, min(size, getattr(settings, 'MAILING_MAX_PAGE_SIZE', 500)))
+
+
+def get_cursor(request):
+    return _int_param(request, 'after'), _int_param(request, 'before')
+
+
+def keyset_page(queryset, size, after=None, before=None):
+    # страница выбирается по индексу первичного ключа: WHERE id > курсор ORDER BY id LIMIT n,
+    # поэтому её стоимость не зависит от номера страницы и размера таблицы
+    if before is not None:
+        rows = list(queryset.filter(pk__lt=before).order_by('-pk')[:size + 1])
+        has_more = len(rows) > size
+        items = rows[:size][::-1]
+        prev_cursor = items[0].pk if has_more and items else None
+        next_cursor = items[-1].pk if items else None
+        return KeysetPage(items, next_cursor, prev_cursor, size)
+
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset.order_by('pk')[:size + 1])
+    has_more = len(rows) > size
+    items = rows[:size]
+    next_cursor = items[-1].pk if has_more else None
+    prev_cursor = items[0].pk if after is not None and items else None
+    return KeysetPage(items, next_cursor, prev_cursor, size)
@@ -0,0 +1,177 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+logger = logging.getLogger('mailing.profiling')
+
+_current = ContextVar('mailing_request_profile', default=None)
+
+CACHE_METHODS = (
+    'get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'incr', 'decr', 'has_key', 'touch',
+)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_calls = 0
+        self.cache_time = 0.0
+        self.template_time = 0.0
+        self._template_depth = 0
+
+
+def profiled_execute(execute, sql, params, many, context):
+    # обёртка ставится на каждое соединение, а профиль берётся из contextvar:
+    # при ASGI запросы делят поток ORM, но у каждого свой контекст, и
+    # sync_to_async переносит его в поток вместе с вызовом
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.db_time += time.perf_counter() - started
+        profile.queries += 1
+
+
+def add_execute_wrapper(connection, **kwargs):
+    if profiled_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profiled_execute)
+
+
+def _profiled_cache_method(method):
+    def wrapper(self, *args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profile.cache_time += time.perf_counter() - started
+            profile.cache_calls += 1
+    wrapper.profiled = True
+    return wrapper
+
+
+def _profiled_render(render):
+    def wrapper(self, context):
+        profile = _current.get()
+        # {% include %} рендерит вложенные шаблоны тем же методом —
+        # считаем только внешний вызов, иначе время сложится дважды
+        if profile is None or profile._template_depth:
+            return render(self, context)
+        profile._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            profile.template_time += time.perf_counter() - started
+            profile._template_depth -= 1
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_hooks():
+    # время SQL считается через execute_wrappers соединений — это штатный
+    # механизм Django, он не меняет классы и работает и в потоках, и в asyncio
+    for connection in connections.all(initialized_only=True):
+        add_execute_wrapper(connection)
+    connection_created.connect(add_execute_wrapper, dispatch_uid='mailing.profiling')
+    if not settings.DEBUG:
+        return
+    # шаблоны и кеш своих хуков не имеют, поэтому только при DEBUG их методы
+    # подменяются на уровне классов для всего процесса; обёртки ничего не
+    # делают вне профилируемого запроса, но в продакшене такую подмену не держим
+    if not getattr(Template.render, 'profiled', False):
+        Template.render = _profiled_render(Template.render)
+    backend = type(caches['default'])
+    for name in CACHE_METHODS:
+        method = getattr(backend, name, None)
+        if method is not None and not getattr(method, 'profiled', False):
+            setattr(backend, name, _profiled_cache_method(method))
+
+
+class ProfilingMiddleware:
+    # включается MAILING_PROFILING: число и время SQL-запросов в заголовке
+    # Server-Timing (при DEBUG — ещё обращения к кешу и время шаблонов),
+    # а запросы дольше порогов MAILING_PROFILING_THRESHOLDS пишутся в лог;
+    # работает и с обычными, и с асинхронными представлениями
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MAILING_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.thresholds = getattr(settings, 'MAILING_PROFILING_THRESHOLDS', {})
+        self.detailed = settings.DEBUG
+        install_hooks()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile, time.perf_counter() - started)
+
+    def finish(self, request, response, profile, total):
+        timing = [f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"']
+        if self.detailed:
+            timing += [
+                f'cache;dur={profile.cache_time * 1000:.1f};desc="{profile.cache_calls} calls"',
+                f'tpl;dur={profile.template_time * 1000:.1f}',
+            ]
+        timing.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timing)
+        self.check_thresholds(request, profile, total)
+        return response
+
+    def check_thresholds(self, request, profile, total):
+        exceeded = [
+            name
+            for name, value in (
+                ('queries', profile.queries),
+                ('db_ms', profile.db_time * 1000),
+                ('cache_calls', profile.cache_calls),
+                ('total_ms', total * 1000),
+            )
+            if name in self.thresholds and value > self.thresholds[name]
+        ]
+        if exceeded:
+            match = request.resolver_match
+            logger.warning(
+                'Медленный запрос %s %s (%s): %d запросов к БД за %.1f мс, %d обращений к кешу, '
+                'шаблоны %.1f мс, всего %.1f мс; превышено: %s',
+                request.method, request.path, match.view_name if match else '-',
+                profile.queries, profile.db_time * 1000, profile.cache_calls,
+                profile.template_time * 1000, total * 1000, ', '.join(exceeded),
+            )
@@ -0,0 +1,190 @@
+import heapq
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+from .metrics import ratelimit_wait_seconds_total
+
+
+class RateLimitStats:
+    # сколько времени отправка простояла в ожидании токенов и из-за каких лимитов
+    def __init__(self):
+        self.waited = 0.0
+        self.throttled = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, scope, seconds):
+        with self._lock:
+            self.waited += seconds
+            self.throttled[scope] += 1
+        ratelimit_wait_seconds_total.inc(seconds, scope=scope)
+
+
+class RateLimiter:
+    # простой «ведро токенов» в пределах процесса: rate сообщений в секунду
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self.stats = RateLimitStats()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        current = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (current - self._updated) * self.rate)
+        self._updated = current
+
+    def try_acquire(self, owner_id=None, domain=None):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0, None
+            return (1 - self._tokens) / self.rate, 'global'
+
+    def acquire(self, owner_id=None, domain=None):
+        while True:
+            delay, scope = self.try_acquire(owner_id, domain)
+            if not delay:
+                return
+            time.sleep(delay)
+            self.stats.record(scope, delay)
+
+
+# берёт токен сразу из всех вёдер или не берёт ни одного; время — по часам
+# Redis, чтобы обработчики на разных узлах считали пополнение одинаково
+TOKEN_BUCKET_SCRIPT = '''
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = {}
+local wait = 0
+local blocked = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local capacity = tonumber(ARGV[i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - updated) * rate)
+    tokens[i] = available
+    if available < 1 and (1 - available) / rate > wait then
+        wait = (1 - available) / rate
+        blocked = i
+    end
+end
+if blocked == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[i * 2 - 1])
+        local capacity = tonumber(ARGV[i * 2])
+        redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+    end
+end
+return {blocked, tostring(wait)}
+'''
+
+
+class RedisRateLimiter:
+    # общее для всех обработчиков ведро токенов в Redis из CACHES:
+    # глобальный лимит, лимит на владельца рассылки и на домен получателя
+    def __init__(self, global_rate=0, per_owner=0, per_domain=0, domains=None, client=None, prefix=None):
+        self.global_rate = float(global_rate or 0)
+        self.per_owner = float(per_owner or 0)
+        self.per_domain = float(per_domain or 0)
+        self.domains = {domain.lower(): float(rate) for domain, rate in (domains or {}).items()}
+        self.prefix = prefix or f"{settings.CACHES['default'].get('KEY_PREFIX', '')}:ratelimit"
+        self.stats = RateLimitStats()
+        self._client = client
+        self._script = None
+
+    @classmethod
+    def from_settings(cls):
+        limits = getattr(settings, 'MAILING_RATE_LIMITS', {})
+        limiter = cls(
+            global_rate=limits.get('GLOBAL'),
+            per_owner=limits.get('PER_OWNER'),
+            per_domain=limits.get('PER_DOMAIN'),
+            domains=limits.get('DOMAINS'),
+        )
+        return limiter if limiter.enabled else None
+
+    @property
+    def enabled(self):
+        return bool(self.global_rate or self.per_owner or self.per_domain or self.domains)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+        return self._client
+
+    def buckets(self, owner_id=None, domain=None):
+        buckets = []
+        if self.global_rate:
+            buckets.append(('global', f'{self.prefix}:global', self.global_rate))
+        if self.per_owner and owner_id is not None:
+            buckets.append(('owner', f'{self.prefix}:owner:{owner_id}', self.per_owner))
+        if domain:
+            rate = self.domains.get(domain, self.per_domain)
+            if rate:
+                buckets.append(('domain', f'{self.prefix}:domain:{domain}', rate))
+        return buckets
+
+    def try_acquire(self, owner_id=None, domain=None):
+        buckets = self.buckets(owner_id, domain)
+        if not buckets:
+            return 0, None
+        if self._script is None:
+            self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        args = []
+        for _, _, rate in buckets:
+            args += [rate, max(rate, 1)]
+        blocked, wait = self._script(keys=[key for _, key, _ in buckets], args=args)
+        if not blocked:
+            return 0, None
+        return float(wait), buckets[int(blocked) - 1][0]
+
+    def acquire(self, owner_id=None, domain=None):
+        while True:
+            delay, scope = self.try_acquire(owner_id, domain)
+            if not delay:
+                return
+            time.sleep(delay)
+            self.stats.record(scope, delay)
+
+
+def recipient_domain(email):
+    return email.rpartition('@')[2].lower()
+
+
+def paced(limiter, items, owner_id=None):
+    # письма на домен, упёршийся в лимит, откладываются до появления токена,
+    # а остальные уходят без очереди; при глобальном лимите или лимите
+    # владельца ждать приходится всем, поэтому просто спим
+    ready = deque(items)
+    deferred = []
+    order = 0
+    while ready or deferred:
+        current = time.monotonic()
+        while deferred and deferred[0][0] <= current:
+            ready.append(heapq.heappop(deferred)[2])
+        if not ready:
+            delay = deferred[0][0] - current
+            time.sleep(delay)
+            limiter.stats.record('domain', delay)
+            continue
+        item = ready.popleft()
+        delay, scope = limiter.try_acquire(owner_id, recipient_domain(item[0].email))
+        if not delay:
+            yield item
+        elif scope == 'domain':
+            order += 1
+            heapq.heappush(deferred, (current + delay, order, item))
+        else:
+            ready.appendleft(item)
+            time.sleep(delay)
+            limiter.stats.record(scope, delay)
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import invalidate
+from .metrics import db_batch_seconds
+from .models import Attempt, AttemptResponse, MailingStats
+
+
+class AttemptRecorder:
+    def __init__(self, flush_size=None, flush_interval=None, on_flush=None):
+        self.flush_size = flush_size or getattr(settings, 'MAILING_ATTEMPT_FLUSH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'MAILING_ATTEMPT_FLUSH_INTERVAL', 5)
+        self.compact = getattr(settings, 'MAILING_COMPACT_ATTEMPTS', True)
+        self.on_flush = on_flush
+        self._buffer = []
+        # id текстов ответов, уже записанных этим регистратором; кеш живёт не
+        # дольше регистратора и пополняется только после коммита сброса
+        self._responses = {}
+        self._owner_ids = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def build(self, mailing, client, status, response, code):
+        attempt = Attempt(mailing=mailing, client=client, status=status, smtp_code=code)
+        if self.compact:
+            # одинаковые ответы сервера хранятся один раз в AttemptResponse,
+            # а адрес получателя и так известен по client; id ответов
+            # выясняются пачкой при сбросе, а не запросом на каждую попытку
+            if status == 'Успешно':
+                response = 'Письмо успешно отправлено'
+            attempt._response_text = AttemptResponse.normalize(response)
+        else:
+            attempt.server_response = response
+        return attempt
+
+    def resolve_responses(self, attempts):
+        if not self.compact:
+            return {}
+        texts = {attempt._response_text for attempt in attempts} - self._responses.keys()
+        resolved = AttemptResponse.intern_many(texts) if texts else {}
+        for attempt in attempts:
+            text = attempt._response_text
+            attempt.response_id = resolved[text] if text in resolved else self._responses[text]
+        return resolved
+
+    def add(self, mailing, client, status, response, code=None):
+        attempt = self.build(mailing, client, status, response, code)
+        with self._lock:
+            self._buffer.append(attempt)
+            self._owner_ids.add(mailing.owner_id)
+            due = (
+                len(self._buffer) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            attempts, self._buffer = self._buffer, []
+            owner_ids, self._owner_ids = self._owner_ids, set()
+            self._last_flush = time.monotonic()
+        if not attempts:
+            return 0
+        # bulk_create не отправляет post_save, поэтому кеш статистики
+        # сбрасываем сами — один раз на владельца за весь сброс буфера
+        with db_batch_seconds.time(operation='attempts'), transaction.atomic():
+            resolved = self.resolve_responses(attempts)
+            Attempt.objects.bulk_create(attempts, batch_size=self.flush_size)
+            MailingStats.record(attempts)
+            if self.on_flush is not None:
+                self.on_flush(attempts)
+        if len(self._responses) < 10000:
+            self._responses.update(resolved)
+        invalidate('mailing_stats', *owner_ids)
+        return len(attempts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
@@ -0,0 +1,119 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import signing
+from django.core.mail import EmailMultiAlternatives
+from django.template import Context, Engine, Library, defaultfilters, defaulttags
+from django.urls import reverse
+
+from .tracking import LinkTracker
+
+UNSUBSCRIBE_SALT = 'mailing.unsubscribe'
+
+# теги, которые автор сообщения может использовать в шаблоне письма;
+# load, include, extends, ssi и debug дают доступ к файлам, библиотекам тегов
+# и внутреннему состоянию, поэтому в письмах недоступны
+ALLOWED_TAGS = (
+    'autoescape', 'comment', 'cycle', 'filter', 'firstof', 'for', 'if', 'ifchanged',
+    'now', 'resetcycle', 'spaceless', 'templatetag', 'verbatim', 'widthratio', 'with',
+)
+FORBIDDEN_TAG = re.compile(r'{%\s*(debug|include|load|extends|ssi)\b')
+
+register = Library()
+register.filters.update(defaultfilters.register.filters)
+register.tags.update({name: defaulttags.register.tags[name] for name in ALLOWED_TAGS})
+
+
+class MessageEngine(Engine):
+    # встроенные библиотеки Django не подключаются: только register из этого модуля
+    default_builtins = []
+
+
+engine = MessageEngine(loaders=[], builtins=['mailing.rendering'])
+
+
+@lru_cache(maxsize=256)
+def compile_template(source):
+    # шаблон компилируется один раз на текст, а не на каждого получателя;
+    # ключ — сам текст, поэтому правка сообщения сразу даёт новый шаблон
+    if '{' not in source:
+        return None
+    return engine.from_string(source)
+
+
+def read_unsubscribe_token(token):
+    return int(signing.Signer(salt=UNSUBSCRIBE_SALT).unsign(token))
+
+
+class MessageRenderer:
+    # готовит персональное письмо для каждого клиента рассылки:
+    # тема и текст — без экранирования, HTML-версия — с экранированием
+    def __init__(self, message, from_email=None, mailing_id=None):
+        self.from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        self.subject = message.subject
+        self.body = message.body
+        self.html_body = message.html_body
+        self.subject_template = compile_template(self.subject)
+        self.body_template = compile_template(self.body)
+        self.html_template = compile_template(self.html_body) if self.html_body else None
+        self.needs_context = any(
+            template is not None
+            for template in (self.subject_template, self.body_template, self.html_template)
+        )
+        self.text_context = Context(autoescape=False)
+        self.html_context = Context()
+        # подпись и reverse() дороже самого шаблона: делаем их, только если
+        # ссылка отписки используется, а reverse — один раз на рассылку
+        self.uses_unsubscribe = 'unsubscribe_url' in self.subject + self.body + self.html_body
+        self.signer = signing.Signer(salt=UNSUBSCRIBE_SALT)
+        site = getattr(settings, 'MAILING_SITE_URL', '').rstrip('/')
+        self.unsubscribe_prefix, _, self.unsubscribe_suffix = (
+            site + reverse('unsubscribe', args=['token'])
+        ).rpartition('token')
+        # ссылки переписываются уже после шаблона, на готовом тексте письма
+        self.tracker = None
+        if mailing_id is not None and getattr(settings, 'MAILING_TRACKING_ENABLED', True):
+            self.tracker = LinkTracker(mailing_id, skip_prefixes=(self.unsubscribe_prefix,))
+
+    def client_context(self, client):
+        # в шаблон попадают только готовые строки: объект модели дал бы
+        # автору сообщения доступ к связанным записям и методам клиента
+        context = {
+            'full_name': client.full_name,
+            'email': client.email,
+            'comment': client.comment,
+            'unsubscribe_url': '',
+        }
+        if self.uses_unsubscribe and client.pk:
+            token = self.signer.sign(str(client.pk))
+            context['unsubscribe_url'] = f'{self.unsubscribe_prefix}{token}{self.unsubscribe_suffix}'
+        return context
+
+    def render_one(self, template, source, context, values):
+        if template is None:
+            return source
+        # один Context на всю рассылку: push/pop дешевле, чем новый Context
+        with context.push(values):
+            return template.render(context)
+
+    def render(self, client):
+        values = self.client_context(client) if self.needs_context else None
+        subject = self.render_one(self.subject_template, self.subject, self.text_context, values)
+        body = self.render_one(self.body_template, self.body, self.text_context, values)
+        if self.tracker is not None:
+            body = self.tracker.rewrite_text(body, client.pk)
+        email = EmailMultiAlternatives(
+            # перевод строки в теме письма недопустим
+            subject=' '.join(subject.splitlines()),
+            body=body,
+            from_email=self.from_email,
+            to=[client.email],
+        )
+        if self.html_body:
+            html_body = self.render_one(self.html_template, self.html_body, self.html_context, values)
+            if self.tracker is not None:
+                # пиксель открытия возможен только в HTML-версии письма
+                html_body = self.tracker.rewrite_html(html_body, client.pk)
+            email.attach_alternative(html_body, 'text/html')
+        return email
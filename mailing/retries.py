@@ -0,0 +1,116 @@
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+from .metrics import db_batch_seconds
+from .models import DeliveryRetry, Suppression
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    base = base or getattr(settings, 'MAILING_RETRY_BASE_DELAY', 60)
+    cap = cap or getattr(settings, 'MAILING_RETRY_MAX_DELAY', 6 * 3600)
+    delay = min(cap, base * 2 ** (attempt - 1))
+    # половина задержки случайная, чтобы повторы, отложенные одновременно,
+    # не возвращались на почтовый сервер одной волной
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryTracker:
+    def __init__(self, mailing, max_attempts=None, flush_size=None):
+        self.mailing = mailing
+        self.max_attempts = max_attempts or getattr(settings, 'MAILING_RETRY_MAX_ATTEMPTS', 5)
+        self.flush_size = flush_size or getattr(settings, 'MAILING_ATTEMPT_FLUSH_SIZE', 500)
+        self.retried = 0
+        self.suppressed = 0
+        self._delivered = []
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            if result.status == 'Успешно':
+                self._delivered.append(result.client.pk)
+            else:
+                self._failed[result.client.pk] = result
+            due = len(self._delivered) + len(self._failed) >= self.flush_size
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            delivered, self._delivered = self._delivered, []
+            failed, self._failed = self._failed, {}
+        if not delivered and not failed:
+            return
+        moment = now()
+        with db_batch_seconds.time(operation='retries'), transaction.atomic():
+            if delivered:
+                DeliveryRetry.objects.filter(mailing=self.mailing, client_id__in=delivered).delete()
+            if not failed:
+                return
+            existing = {
+                retry.client_id: retry
+                for retry in DeliveryRetry.objects.select_for_update().filter(
+                    mailing=self.mailing, client_id__in=list(failed)
+                )
+            }
+            to_create, to_update, suppressions, dropped = [], [], [], []
+            for client_id, result in failed.items():
+                retry = existing.get(client_id) or DeliveryRetry(mailing=self.mailing, client_id=client_id)
+                retry.attempts += 1
+                retry.smtp_code = result.code
+                retry.last_error = result.response
+                if not result.transient or retry.attempts >= self.max_attempts:
+                    # в список подавления попадает только адрес, который отверг сам
+                    # сервер получателя; прочие неудачи просто больше не повторяем
+                    if result.recipient:
+                        suppressions.append(Suppression(
+                            client_id=client_id,
+                            reason=Suppression.REASON_EXHAUSTED if result.transient else Suppression.REASON_PERMANENT,
+                            smtp_code=result.code,
+                            last_error=result.response,
+                        ))
+                    dropped.append(client_id)
+                    continue
+                retry.next_attempt_at = moment + timedelta(seconds=backoff_delay(retry.attempts))
+                (to_update if retry.pk else to_create).append(retry)
+
+            DeliveryRetry.objects.bulk_create(to_create, ignore_conflicts=True)
+            DeliveryRetry.objects.bulk_update(to_update, ['attempts', 'smtp_code', 'last_error', 'next_attempt_at'])
+            if suppressions:
+                Suppression.objects.bulk_create(suppressions, ignore_conflicts=True)
+            if dropped:
+                DeliveryRetry.objects.filter(mailing=self.mailing, client_id__in=dropped).delete()
+        self.retried += len(to_create) + len(to_update)
+        self.suppressed += len(suppressions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+def claim_due_retries(moment=None, limit=500):
+    # SKIP LOCKED и «аренда» на время отправки: один и тот же повтор
+    # не достанется двум обработчикам одновременно
+    moment = moment or now()
+    lease = getattr(settings, 'MAILING_RETRY_LEASE', 600)
+    with transaction.atomic():
+        due = list(
+            DeliveryRetry.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=moment)
+            .order_by('next_attempt_at')
+            .values_list('id', 'mailing_id', 'client_id')[:limit]
+        )
+        DeliveryRetry.objects.filter(id__in=[row[0] for row in due]).update(
+            next_attempt_at=moment + timedelta(seconds=lease)
+        )
+    claimed = {}
+    for _, mailing_id, client_id in due:
+        claimed.setdefault(mailing_id, []).append(client_id)
+    return claimed
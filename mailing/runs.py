@@ -0,0 +1,222 @@
+import os
+import socket
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils.timezone import now
+
+from .metrics import db_batch_seconds, runs_total
+from .models import Attempt, DeliveryJob, Mailing, RecipientSnapshot
+
+
+class MailingBusy(Exception):
+    def __init__(self, job):
+        self.job = job
+        super().__init__(f'Рассылка #{job.mailing_id} уже отправляется (задача #{job.pk}, {job.worker}).')
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def lock_mailing(mailing_id):
+    # блокировка строки рассылки до конца транзакции: запуски одной
+    # рассылки из разных мест проверяют и меняют её задачи по очереди
+    Mailing.objects.select_for_update().filter(pk=mailing_id).values_list('pk').first()
+
+
+def running_job(mailing_id):
+    return DeliveryJob.objects.filter(mailing_id=mailing_id, status=DeliveryJob.STATUS_RUNNING).first()
+
+
+def is_stale(job, moment=None):
+    stale_after = getattr(settings, 'MAILING_JOB_STALE_AFTER', 300)
+    return job.heartbeat_at is None or job.heartbeat_at < (moment or now()) - timedelta(seconds=stale_after)
+
+
+def start_run(mailing, worker=None):
+    # отправка в обход очереди (команда, замеры) тоже оформляется задачей,
+    # чтобы у неё был свой зафиксированный список получателей
+    worker = worker or default_worker_name()
+    with transaction.atomic():
+        lock_mailing(mailing.pk)
+        job = running_job(mailing.pk)
+        if job is None:
+            return DeliveryJob.objects.create(
+                mailing=mailing,
+                status=DeliveryJob.STATUS_RUNNING,
+                started_at=now(),
+                heartbeat_at=now(),
+                worker=worker,
+            )
+        if not is_stale(job):
+            runs_total.inc(result='busy')
+            raise MailingBusy(job)
+        # обработчик прошлого запуска упал — продолжаем его задачу по снимку
+        job.worker = worker
+        job.heartbeat_at = now()
+        job.save(update_fields=['worker', 'heartbeat_at'])
+        release_claimed(job)
+        return job
+
+
+def release_claimed(job):
+    # порции, которые упавший обработчик успел забрать, но не записал:
+    # письма с записанной попыткой отмечаем по ней, остальные возвращаем
+    # в «Ожидает», чтобы продолжение их отправило
+    attempts = Attempt.objects.filter(
+        mailing_id=job.mailing_id, client_id=OuterRef('client_id'), timestamp__gte=job.started_at
+    )
+    sending = RecipientSnapshot.objects.filter(job=job, state=RecipientSnapshot.STATE_SENDING)
+    sending.filter(~Exists(attempts)).update(state=RecipientSnapshot.STATE_PENDING)
+    sending.filter(Exists(attempts.filter(status='Успешно'))).update(state=RecipientSnapshot.STATE_SENT)
+    sending.update(state=RecipientSnapshot.STATE_FAILED)
+
+
+def heartbeat(job):
+    # отметка «задача жива» от её текущего обработчика; если задачу забрал
+    # другой обработчик, этот должен остановиться, а не слать письма дальше
+    if not DeliveryJob.objects.filter(pk=job.pk, worker=job.worker).update(heartbeat_at=now()):
+        raise MailingBusy(DeliveryJob.objects.get(pk=job.pk))
+
+
+def finish_run(job, report=None, error=None):
+    if error is not None:
+        job.status = DeliveryJob.STATUS_FAILED
+        job.error = error
+    else:
+        # после продолжения по снимку report видит только вторую часть
+        # отправки, поэтому итоги берём из самого снимка
+        states = dict(
+            RecipientSnapshot.objects.filter(job=job).values_list('state').annotate(total=Count('pk')).order_by()
+        )
+        job.status = DeliveryJob.STATUS_DONE
+        job.sent_count = states.get(RecipientSnapshot.STATE_SENT, report.sent)
+        job.failed_count = states.get(RecipientSnapshot.STATE_FAILED, report.failed)
+    job.finished_at = now()
+    # задачу мог забрать другой обработчик, пока этот считался зависшим, —
+    # тогда её итоги запишет он
+    fields = ['status', 'error', 'sent_count', 'failed_count', 'finished_at']
+    if not DeliveryJob.objects.filter(pk=job.pk, worker=job.worker).update(
+        **{field: getattr(job, field) for field in fields}
+    ):
+        return job
+    runs_total.inc(result='done' if job.status == DeliveryJob.STATUS_DONE else 'failed')
+    if job.status == DeliveryJob.STATUS_DONE:
+        # для продолжения после сбоя список больше не нужен
+        RecipientSnapshot.objects.filter(job=job).delete()
+    return job
+
+
+def adopt_failed_snapshot(job):
+    # прерванный запуск (ошибка сессии SMTP, падение задачи) оставляет снимок
+    # с недосланными получателями: следующий запуск рассылки продолжает его,
+    # а не снимает список заново, иначе получившие письмо получат его ещё раз
+    failed = list(
+        DeliveryJob.objects.filter(
+            mailing_id=job.mailing_id, status=DeliveryJob.STATUS_FAILED, snapshot_at__isnull=False
+        )
+        .exclude(pk=job.pk)
+        .filter(Exists(RecipientSnapshot.objects.filter(job=OuterRef('pk'))))
+        .order_by('-id')
+    )
+    if not failed:
+        return False
+    latest, older = failed[0], failed[1:]
+    # снимки более ранних прерванных запусков уже не продолжить — убираем их
+    RecipientSnapshot.objects.filter(job__in=older).delete()
+    release_claimed(latest)
+    rows = RecipientSnapshot.objects.filter(job=latest)
+    if not rows.filter(state=RecipientSnapshot.STATE_PENDING).exists():
+        # прерванный запуск успел обойти всех — этот начинается заново
+        rows.delete()
+        return False
+    job.recipients_total = rows.update(job=job)
+    job.snapshot_at = now()
+    job.save(update_fields=['recipients_total', 'snapshot_at'])
+    return True
+
+
+def take_snapshot(job):
+    if job.snapshot_at is not None:
+        return job.recipients_total
+    # одна команда INSERT ... SELECT: получатели не проходят через Python,
+    # а повторный вызов после сбоя ничего не дублирует
+    recipients = job.mailing.get_recipients().values('id', 'email')
+    select_sql, params = recipients.query.sql_with_params()
+    table = RecipientSnapshot._meta.db_table
+    with db_batch_seconds.time(operation='snapshot'), transaction.atomic():
+        if adopt_failed_snapshot(job):
+            return job.recipients_total
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (job_id, client_id, email, state) '
+                f'SELECT %s, recipients.id, recipients.email, %s FROM ({select_sql}) AS recipients '
+                f'ON CONFLICT DO NOTHING',
+                (job.pk, RecipientSnapshot.STATE_PENDING, *params),
+            )
+        job.recipients_total = RecipientSnapshot.objects.filter(job=job).count()
+        job.snapshot_at = now()
+        job.save(update_fields=['recipients_total', 'snapshot_at'])
+    return job.recipients_total
+
+
+def claim_chunk(job, after, size):
+    # строки снимка — ключи (рассылка, клиент, запуск): порция переводится
+    # в «Отправляется» до отправки, поэтому при двух обработчиках одной
+    # задачи каждое письмо уходит не больше одного раза; каждая порция
+    # заодно продлевает жизнь задачи, даже если сброс попыток ещё не наступил
+    with db_batch_seconds.time(operation='claim'), transaction.atomic():
+        heartbeat(job)
+        rows = list(
+            RecipientSnapshot.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(job=job, state=RecipientSnapshot.STATE_PENDING, client_id__gt=after)
+            .select_related('client')
+            .order_by('client_id')[:size]
+        )
+        RecipientSnapshot.objects.filter(pk__in=[row.pk for row in rows]).update(
+            state=RecipientSnapshot.STATE_SENDING
+        )
+    clients = []
+    for row in rows:
+        # письмо уходит на адрес из снимка, даже если клиента успели отредактировать
+        row.client.email = row.email
+        clients.append(row.client)
+    return clients
+
+
+def iter_snapshot(job, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'MAILING_BATCH_SIZE', 500)
+    after = 0
+    while True:
+        clients = claim_chunk(job, after, chunk_size)
+        if not clients:
+            return
+        after = clients[-1].pk
+        yield from clients
+
+
+def snapshot_marker(job):
+    # вызывается в транзакции сброса попыток: отметка в снимке и запись
+    # попытки фиксируются вместе, поэтому после сбоя продолжение не теряет
+    # и не повторяет уже записанные отправки
+    def mark(attempts):
+        by_state = defaultdict(list)
+        for attempt in attempts:
+            state = RecipientSnapshot.STATE_SENT if attempt.status == 'Успешно' else RecipientSnapshot.STATE_FAILED
+            by_state[state].append(attempt.client_id)
+        for state, client_ids in by_state.items():
+            RecipientSnapshot.objects.filter(job=job, client_id__in=client_ids).update(state=state)
+        DeliveryJob.objects.filter(pk=job.pk, worker=job.worker).update(heartbeat_at=now())
+    return mark
+
+
+def stale_jobs_condition(moment=None):
+    # задача «Выполняется», от которой давно нет признаков жизни, —
+    # обработчик упал; её можно забрать и продолжить по снимку
+    moment = moment or now()
+    stale_after = getattr(settings, 'MAILING_JOB_STALE_AFTER', 300)
+    return Q(status=DeliveryJob.STATUS_RUNNING, heartbeat_at__lt=moment - timedelta(seconds=stale_after))
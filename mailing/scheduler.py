@@ -0,0 +1,86 @@
+import time
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from . import dashboard
+from .cache import ALL, invalidate
+from .models import DeliveryJob, Mailing
+
+
+def next_due_at():
+    # каждая выборка — один проход по индексу (status, start/end_datetime)
+    next_start = (
+        Mailing.objects.filter(status='Создана')
+        .order_by('start_datetime')
+        .values_list('start_datetime', flat=True)
+        .first()
+    )
+    next_end = (
+        Mailing.objects.filter(status='Запущена')
+        .order_by('end_datetime')
+        .values_list('end_datetime', flat=True)
+        .first()
+    )
+    due = [moment for moment in (next_start, next_end) if moment is not None]
+    return min(due) if due else None
+
+
+def run_due_mailings(moment=None):
+    moment = moment or now()
+    with transaction.atomic():
+        # SKIP LOCKED: строки, которые уже забрал другой планировщик, пропускаем
+        due_ids = list(
+            Mailing.objects.select_for_update(skip_locked=True)
+            .filter(status='Создана', start_datetime__lte=moment, end_datetime__gt=moment)
+            .values_list('id', flat=True)
+        )
+        started = 0
+        owner_ids = set()
+        if due_ids:
+            owner_ids.update(
+                Mailing.objects.filter(id__in=due_ids).values_list('owner_id', flat=True).distinct()
+            )
+            started = Mailing.objects.filter(id__in=due_ids, status='Создана').update(status='Запущена')
+            already_queued = set(
+                DeliveryJob.objects.filter(
+                    mailing_id__in=due_ids,
+                    status__in=[DeliveryJob.STATUS_QUEUED, DeliveryJob.STATUS_RUNNING],
+                ).values_list('mailing_id', flat=True)
+            )
+            DeliveryJob.objects.bulk_create(
+                [
+                    DeliveryJob(mailing_id=mailing_id)
+                    for mailing_id in due_ids
+                    if mailing_id not in already_queued
+                ],
+                ignore_conflicts=True,
+            )
+
+        expired = Mailing.objects.filter(status__in=['Создана', 'Запущена'], end_datetime__lte=moment)
+        owner_ids.update(expired.values_list('owner_id', flat=True).distinct())
+        finished_active = expired.filter(status='Запущена').update(status='Завершена')
+        finished = finished_active + expired.update(status='Завершена')
+
+    # массовый UPDATE не отправляет post_save, поэтому кеш и счётчики обновляем сами
+    if started or finished:
+        invalidate('mailing_list', ALL, *owner_ids)
+        dashboard.adjust('active_mailings', started - finished_active)
+    return started, finished
+
+
+def run_scheduler(max_sleep=60, once=False, on_tick=None):
+    while True:
+        started, finished = run_due_mailings()
+        if on_tick is not None:
+            on_tick(started, finished)
+        if once:
+            return
+
+        due = next_due_at()
+        if due is None:
+            delay = max_sleep
+        else:
+            delay = min(max((due - now()).total_seconds(), 0), max_sleep)
+        # новые рассылки могли появиться, пока мы спали, поэтому сон ограничен max_sleep
+        time.sleep(max(delay, 0.5))
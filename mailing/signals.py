@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import dashboard
+from .cache import ALL, invalidate
+from .models import Attempt, Client, Mailing, Message
+
+
+@receiver(post_save, sender=Client)
+def invalidate_client_cache(sender, instance, **kwargs):
+    invalidate('client_list', instance.owner_id, ALL)
+
+
+@receiver(post_save, sender=Client)
+def count_created_client(sender, instance, created, **kwargs):
+    if created:
+        dashboard.adjust('unique_recipients', 1)
+
+
+# на post_delete клиента не подписываемся: обработчик на каждую строку отключил бы
+# быстрое удаление клиентов владельца одним запросом; вместо этого счётчик и кеш
+# поправляются один раз на всё удаление
+def forget_clients(owner_id, count):
+    dashboard.adjust('unique_recipients', -count)
+    invalidate('client_list', owner_id, ALL)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def count_owner_clients(sender, instance, **kwargs):
+    forget_clients(instance.pk, Client.objects.filter(owner=instance).count())
+
+
+@receiver([post_save, post_delete], sender=Message)
+def invalidate_message_cache(sender, instance, **kwargs):
+    invalidate('message_list', ALL)
+    # в списке рассылок показывается тема сообщения
+    owner_ids = Mailing.objects.filter(message=instance).values_list('owner_id', flat=True).distinct()
+    invalidate('mailing_list', ALL, *owner_ids)
+
+
+@receiver([post_save, post_delete], sender=Mailing)
+def invalidate_mailing_cache(sender, instance, **kwargs):
+    invalidate('mailing_list', instance.owner_id, ALL)
+    invalidate('mailing_stats', instance.owner_id)
+
+
+@receiver(post_init, sender=Mailing)
+def remember_mailing_status(sender, instance, **kwargs):
+    instance._saved_status = instance.status if instance.pk else None
+
+
+@receiver(post_save, sender=Mailing)
+def count_saved_mailing(sender, instance, created, **kwargs):
+    if created:
+        dashboard.adjust('total_mailings', 1)
+    was_active = instance._saved_status == 'Запущена'
+    is_active = instance.status == 'Запущена'
+    dashboard.adjust('active_mailings', int(is_active) - int(was_active))
+    instance._saved_status = instance.status
+
+
+@receiver(post_delete, sender=Mailing)
+def count_deleted_mailing(sender, instance, **kwargs):
+    dashboard.adjust('total_mailings', -1)
+    if instance._saved_status == 'Запущена':
+        dashboard.adjust('active_mailings', -1)
+
+
+# на post_delete не подписываемся: иначе prune_attempts не сможет удалять
+# попытки одним запросом, а счётчики MailingStats при очистке журнала не меняются
+@receiver(post_save, sender=Attempt)
+def invalidate_attempt_cache(sender, instance, **kwargs):
+    invalidate('mailing_stats', instance.mailing.owner_id)
@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import smtplib
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection, connections, transaction
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from mailing import dashboard
+from mailing.aiodelivery import AsyncDeliveryEngine, async_classify_error, deliver_mailing_async
+from mailing.bench import SinkEmailBackend
+from mailing.cache import get_or_set, get_version, invalidate
+from mailing.delivery import DeliveryAborted, DeliveryEngine, deliver_mailing
+from mailing.exporters import attempt_queryset
+from mailing.forms import MessageForm
+from mailing.importers import import_clients
+from mailing.management.commands.bench_delivery import BENCH_OWNER
+from mailing.jobs import claim_job, enqueue_mailing, run_worker
+from mailing.models import (
+    Attempt, AttemptArchive, AttemptResponse, Client, ClientGroup, DeliveryJob, DeliveryRetry, EmailEvent, Mailing, MailingStats,
+    Message, OwnerStats, RecipientSnapshot, Suppression,
+)
+from mailing.profiling import ProfilingMiddleware
+from mailing.ratelimit import RateLimitStats, RedisRateLimiter, paced
+from mailing.recorder import AttemptRecorder
+from mailing.rendering import MessageRenderer
+from mailing.runs import MailingBusy, claim_chunk, finish_run, start_run, take_snapshot
+from mailing.scheduler import next_due_at, run_due_mailings
+from mailing.tracking import EVENTS, ingest_events
+
+
+def open_stream(content):
+    return io.TextIOWrapper(io.BytesIO(content), encoding='utf-8-sig', newline='')
+
+
+def create_owner(email='owner@example.com'):
+    owner = CustomUser.objects.create_user(email=email, password='x')
+    owner.is_active = True
+    owner.save(update_fields=['is_active'])
+    return owner
+
+
+def create_mailing(owner, recipients=0, subject='Тема', body='Текст', **kwargs):
+    message = Message.objects.create(subject=subject, body=body, owner=owner)
+    kwargs.setdefault('start_datetime', timezone.now())
+    kwargs.setdefault('end_datetime', timezone.now() + timedelta(days=1))
+    mailing = Mailing.objects.create(owner=owner, message=message, **kwargs)
+    if recipients:
+        clients = Client.objects.bulk_create([
+            Client(email=f'm{mailing.pk}-client{i}@example.com', full_name=f'Клиент {i}', owner=owner)
+            for i in range(recipients)
+        ])
+        mailing.recipients.set(clients)
+    return mailing
+
+
+@skipUnless(connection.vendor.startswith('postgresql'), 'EXPLAIN проверяется только на PostgreSQL')
+class HotQueryIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', password='x')
+        message = Message.objects.create(subject='Тема', body='Текст', owner=cls.owner)
+        cls.mailing = Mailing.objects.create(
+            owner=cls.owner,
+            message=message,
+            start_datetime=timezone.now(),
+            end_datetime=timezone.now() + timedelta(days=1),
+        )
+        client = Client.objects.create(email='client@example.com', full_name='Клиент', owner=cls.owner)
+        Attempt.objects.create(mailing=cls.mailing, client=client, status='Успешно', server_response='ok')
+
+    def setUp(self):
+        # на пустых таблицах планировщик всегда выбирает Seq Scan;
+        # запрещаем его, чтобы проверить, что подходящий индекс вообще есть
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_client_list_page(self):
+        queryset = Client.objects.filter(owner=self.owner, pk__gt=0).order_by('pk')[:51]
+        self.assertUsesIndex(queryset, 'client_owner_id')
+
+    def test_mailing_list_page(self):
+        queryset = Mailing.objects.filter(owner=self.owner, pk__gt=0).order_by('pk')[:51]
+        self.assertUsesIndex(queryset, 'mailing_owner_id')
+
+    def test_stats_status_filter(self):
+        queryset = Mailing.objects.filter(owner=self.owner, status='Запущена')
+        self.assertUsesIndex(queryset, 'mailing_owner_status')
+
+    def test_active_mailings_count(self):
+        self.assertUsesIndex(Mailing.objects.filter(status='Запущена'), 'mailing_status_')
+
+    def test_attempts_by_mailing_and_status(self):
+        queryset = Attempt.objects.filter(mailing=self.mailing, status='Успешно')
+        self.assertUsesIndex(queryset, 'attempt_mailing_status')
+
+    def test_failed_attempts(self):
+        queryset = Attempt.objects.filter(mailing=self.mailing, status='Не успешно').order_by('timestamp')
+        self.assertUsesIndex(queryset, 'attempt_failed')
+
+    def test_attempts_by_date_range(self):
+        queryset = attempt_queryset(date_from=date(2026, 1, 1), date_to=date(2026, 1, 31))
+        self.assertUsesIndex(queryset, 'attempt_timestamp')
+
+
+@override_settings(EMAIL_BACKEND='mailing.bench.SinkEmailBackend')
+class ConcurrentDeliveryTests(TransactionTestCase):
+    triggers = 5
+    recipients = 20
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', password='x')
+        message = Message.objects.create(subject='Тема', body='Текст', owner=owner)
+        self.mailing = Mailing.objects.create(
+            owner=owner,
+            message=message,
+            start_datetime=timezone.now(),
+            end_datetime=timezone.now() + timedelta(days=1),
+        )
+        clients = Client.objects.bulk_create([
+            Client(email=f'client{i}@example.com', full_name=f'Клиент {i}', owner=owner)
+            for i in range(self.recipients)
+        ])
+        self.mailing.recipients.set(clients)
+        # задержка «сервера» растягивает отправку, чтобы запуски пересеклись
+        SinkEmailBackend.latency = 0.01
+        SinkEmailBackend.sent = 0
+
+    def tearDown(self):
+        SinkEmailBackend.latency = 0
+
+    def run_in_parallel(self, target):
+        barrier = threading.Barrier(self.triggers)
+        outcomes = []
+
+        def trigger():
+            barrier.wait()
+            try:
+                outcomes.append(target())
+            except Exception as e:
+                outcomes.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=trigger) for _ in range(self.triggers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_parallel_sends_deliver_once(self):
+        def send():
+            mailing = Mailing.objects.select_related('message').get(pk=self.mailing.pk)
+            return deliver_mailing(mailing)
+
+        outcomes = self.run_in_parallel(send)
+
+        finished = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+        busy = [outcome for outcome in outcomes if isinstance(outcome, MailingBusy)]
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(len(busy), self.triggers - 1)
+        self.assertEqual(SinkEmailBackend.sent, self.recipients)
+        self.assertEqual(Attempt.objects.filter(mailing=self.mailing).count(), self.recipients)
+
+    def test_parallel_enqueue_creates_one_job(self):
+        outcomes = self.run_in_parallel(lambda: enqueue_mailing(self.mailing))
+
+        self.assertEqual(sum(created for _, created in outcomes), 1)
+        self.assertEqual(len({job.pk for job, _ in outcomes}), 1)
+        self.assertEqual(DeliveryJob.objects.filter(mailing=self.mailing).count(), 1)
+
+
+class QueryBudgetMixin:
+    # бюджет — верхняя граница числа SQL-запросов на одну страницу;
+    # если представление начнёт делать запрос на каждую строку, тест упадёт
+    def assertQueryBudget(self, url, budget, status_code=200):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status_code)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f'{url}: {len(context)} запросов при бюджете {budget}:\n{queries}',
+        )
+        return response
+
+
+@override_settings(CACHE_ENABLED=False)
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    rows = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(email='owner@example.com', password='x')
+        cls.owner.is_active = True
+        cls.owner.save(update_fields=['is_active'])
+        clients = Client.objects.bulk_create([
+            Client(email=f'client{i}@example.com', full_name=f'Клиент {i}', owner=cls.owner)
+            for i in range(cls.rows)
+        ])
+        ClientGroup.objects.bulk_create([ClientGroup(name=f'Группа {i}', owner=cls.owner) for i in range(cls.rows)])
+        for i in range(cls.rows):
+            message = Message.objects.create(subject=f'Тема {i}', body='Текст', owner=cls.owner)
+            mailing = Mailing.objects.create(
+                owner=cls.owner,
+                message=message,
+                start_datetime=timezone.now(),
+                end_datetime=timezone.now() + timedelta(days=1),
+            )
+            Attempt.objects.create(mailing=mailing, client=clients[i], status='Успешно', server_response='ok')
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_home(self):
+        self.assertQueryBudget(reverse('home'), 2)
+
+    def test_client_list(self):
+        self.assertQueryBudget(reverse('client_list'), 3)
+
+    def test_client_search(self):
+        self.assertQueryBudget(reverse('client_search') + '?q=client1', 3)
+
+    def test_group_list(self):
+        self.assertQueryBudget(reverse('group_list'), 3)
+
+    def test_message_list(self):
+        self.assertQueryBudget(reverse('message_list'), 3)
+
+    def test_mailing_list(self):
+        self.assertQueryBudget(reverse('mailing_list'), 3)
+
+    def test_stats(self):
+        self.assertQueryBudget(reverse('stats'), 5)
+
+    def test_stats_by_period(self):
+        today = timezone.localdate()
+        self.assertQueryBudget(reverse('stats') + f'?date_from={today}&date_to={today}', 5)
+
+
+@override_settings(MAILING_PROFILING=True, MAILING_PROFILING_THRESHOLDS={'queries': 0})
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client.force_login(create_owner())
+
+    def test_server_timing_header(self):
+        with self.assertLogs('mailing.profiling', 'WARNING') as logs:
+            response = self.client.get(reverse('client_list'))
+
+        timing = response['Server-Timing']
+        self.assertIn('db;', timing)
+        self.assertIn('total;', timing)
+        # без DEBUG методы кеша и шаблонов не подменяются
+        self.assertNotIn('tpl;', timing)
+        self.assertIn('client_list', logs.output[0])
+
+    @override_settings(DEBUG=True)
+    def test_debug_adds_cache_and_templates(self):
+        with self.assertLogs('mailing.profiling', 'WARNING'):
+            response = self.client.get(reverse('client_list'))
+        for metric in ('db;', 'cache;', 'tpl;', 'total;'):
+            self.assertIn(metric, response['Server-Timing'])
+
+    def test_async_requests_are_profiled(self):
+        async def view(request):
+            await sync_to_async(Client.objects.count)()
+            # ORM работал в отдельном потоке со своим соединением
+            await sync_to_async(connections.close_all)()
+            return HttpResponse()
+
+        with self.assertLogs('mailing.profiling', 'WARNING'):
+            response = asyncio.run(ProfilingMiddleware(view)(RequestFactory().get('/')))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+@override_settings(
+    MAILING_SITE_URL='',
+    CACHES={'default': dict(settings.CACHES['default'], KEY_PREFIX='MailingTrackingTests')},
+)
+class TrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = CustomUser.objects.create_user(email='owner@example.com', password='x')
+        message = Message.objects.create(
+            subject='Тема',
+            body='Подробности: https://example.com/news?week=42.',
+            html_body='<html><body><a href="https://example.com/news?week=42&amp;from=mail">Подробности</a></body></html>',
+            owner=owner,
+        )
+        cls.mailing = Mailing.objects.create(
+            owner=owner,
+            message=message,
+            start_datetime=timezone.now(),
+            end_datetime=timezone.now() + timedelta(days=1),
+        )
+        cls.recipient = Client.objects.create(email='client@example.com', full_name='Клиент', owner=owner)
+
+    def setUp(self):
+        EVENTS.client.delete(EVENTS.key)
+        self.email = MessageRenderer(self.mailing.message, mailing_id=self.mailing.pk).render(self.recipient)
+
+    def tearDown(self):
+        EVENTS.client.delete(EVENTS.key)
+
+    def test_links_are_rewritten(self):
+        self.assertNotIn('https://example.com', self.email.body.split('?u=')[0])
+        self.assertTrue(self.email.body.endswith('.'))
+        html_body = self.email.alternatives[0][0]
+        self.assertIn('/t/o/', html_body)
+        self.assertLess(html_body.index('/t/o/'), html_body.index('</body>'))
+
+    def test_events_are_ingested_into_counters(self):
+        click_url = self.email.body.split()[-1].rstrip('.')
+        response = self.client.get(click_url)
+        self.assertRedirects(response, 'https://example.com/news?week=42', fetch_redirect_response=False)
+
+        html_body = self.email.alternatives[0][0]
+        open_url = html_body.split('<img src="')[1].split('"')[0]
+        for _ in range(2):
+            response = self.client.get(open_url)
+            self.assertEqual(response['Content-Type'], 'image/gif')
+
+        self.assertEqual(ingest_events(), 3)
+        self.assertEqual(EmailEvent.objects.filter(mailing=self.mailing).count(), 3)
+        stats = MailingStats.objects.get(mailing=self.mailing)
+        self.assertEqual((stats.open_count, stats.click_count), (2, 1))
+
+    def entry(self, kind=EmailEvent.KIND_OPEN):
+        return f'{time.time():.3f}|{kind}|{self.mailing.pk}|{self.recipient.pk}|'
+
+    def test_malformed_entries_are_dropped(self):
+        EVENTS.client.rpush(
+            EVENTS.key, 'мусор', self.entry(kind='Взлом'), f'1|{EmailEvent.KIND_OPEN}|x|1|', self.entry()
+        )
+
+        with self.assertLogs('mailing.tracking', 'WARNING') as logs:
+            self.assertEqual(ingest_events(), 4)
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(EmailEvent.objects.filter(mailing=self.mailing).count(), 1)
+        self.assertEqual(EVENTS.client.llen(EVENTS.key), 0)
+
+    def test_valid_entries_return_to_queue_when_db_is_down(self):
+        valid = self.entry()
+        EVENTS.client.rpush(EVENTS.key, 'мусор', valid)
+
+        down = mock.patch.object(MailingStats, 'record_events', side_effect=OperationalError('нет связи'))
+        with down, self.assertLogs('mailing.tracking', 'WARNING'):
+            self.assertEqual(ingest_events(), 0)
+        self.assertEqual(EVENTS.client.lrange(EVENTS.key, 0, -1), [valid.encode()])
+
+        self.assertEqual(ingest_events(), 1)
+        self.assertEqual(EmailEvent.objects.filter(mailing=self.mailing).count(), 1)
+
+    def test_redis_failure_while_keeping_events_is_logged(self):
+        EVENTS.client.rpush(EVENTS.key, self.entry(), self.entry())
+        redis_down = ConnectionError('Redis недоступен')
+
+        with mock.patch.object(EVENTS, 'push_back', side_effect=redis_down), \
+                mock.patch.object(MailingStats, 'record_events', side_effect=OperationalError('нет связи')), \
+                self.assertLogs('mailing.tracking', 'ERROR') as logs:
+            self.assertEqual(ingest_events(), 0)
+        self.assertIn('Не удалось вернуть в Redis 2 событий', logs.output[0])
+
+        EVENTS.client.rpush(EVENTS.key, self.entry())
+        with mock.patch.object(EVENTS, 'dead_letter', side_effect=redis_down), \
+                mock.patch.object(MailingStats, 'record_events', side_effect=DatabaseError('сбой')), \
+                self.assertLogs('mailing.tracking', 'ERROR') as logs:
+            self.assertEqual(ingest_events(), 1)
+        self.assertEqual(len(logs.output), 2)
+
+    def test_tampered_redirect_is_rejected(self):
+        click_url = self.email.body.split()[-1].rstrip('.')
+        tampered = click_url.split('?u=')[0] + '?u=https%3A%2F%2Fevil.example'
+        self.assertEqual(self.client.get(tampered).status_code, 404)
+        self.assertEqual(ingest_events(), 0)
+
+
+class MailingStatsTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=3)
+        self.clients = list(self.mailing.recipients.order_by('pk'))
+
+    def record(self):
+        with AttemptRecorder() as recorder:
+            recorder.add(self.mailing, self.clients[0], 'Успешно', 'ok', 250)
+            recorder.add(self.mailing, self.clients[1], 'Успешно', 'ok', 250)
+            recorder.add(self.mailing, self.clients[2], 'Не успешно', 'mailbox full', 452)
+
+    def test_recorder_updates_counters(self):
+        self.record()
+        stats = MailingStats.objects.get(mailing=self.mailing)
+        owner_stats = OwnerStats.objects.get(owner=self.owner)
+        self.assertEqual((stats.success_count, stats.fail_count), (2, 1))
+        self.assertEqual((owner_stats.success_count, owner_stats.fail_count), (2, 1))
+        self.assertIsNotNone(stats.last_attempt_at)
+
+    def test_rebuild_restores_counters_in_place(self):
+        self.record()
+        MailingStats.objects.update(success_count=100, fail_count=100)
+        OwnerStats.objects.update(success_count=100, fail_count=100)
+        idle = create_mailing(self.owner)
+
+        call_command('rebuild_mailing_stats', stdout=io.StringIO())
+
+        stats = MailingStats.objects.get(mailing=self.mailing)
+        owner_stats = OwnerStats.objects.get(owner=self.owner)
+        self.assertEqual((stats.success_count, stats.fail_count), (2, 1))
+        self.assertEqual((owner_stats.success_count, owner_stats.fail_count), (2, 1))
+        self.assertEqual(MailingStats.objects.get(mailing=idle).success_count, 0)
+
+    def test_period_includes_archived_attempts(self):
+        self.record()
+        old = timezone.now() - timedelta(days=400)
+        Attempt.objects.filter(client__in=self.clients[1:]).update(timestamp=old)
+        call_command('prune_attempts', days=180, stdout=io.StringIO())
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('stats'), {'date_from': (old - timedelta(days=1)).date()})
+
+        self.assertEqual((response.context['total_messages_sent'], response.context['total_fail']), (2, 1))
+        row = response.context['stats'][0]
+        self.assertEqual((row['success_count'], row['fail_count']), (2, 1))
+        old_period = {'date_from': old.date(), 'date_to': old.date()}
+        self.assertEqual(self.client.get(reverse('stats'), old_period).context['total_fail'], 1)
+
+
+class AttemptLogTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=4)
+        self.clients = list(self.mailing.recipients.order_by('pk'))
+
+    def refuse(self, recorder, client):
+        error = {client.email: (550, b'5.1.1 <' + client.email.encode() + b'>: user unknown')}
+        recorder.add(self.mailing, client, 'Не успешно', str(error), 550)
+
+    def test_failures_share_one_response_without_addresses(self):
+        with CaptureQueriesContext(connection) as context:
+            with AttemptRecorder() as recorder:
+                for client in self.clients:
+                    self.refuse(recorder, client)
+
+        self.assertEqual(AttemptResponse.objects.count(), 1)
+        self.assertNotIn('@', AttemptResponse.objects.get().text)
+        self.assertEqual(len({attempt.response_id for attempt in Attempt.objects.all()}), 1)
+        # ответы выясняются пачкой на весь сброс, а не запросом на каждую попытку
+        response_queries = [query for query in context.captured_queries if 'mailing_attemptresponse' in query['sql']]
+        self.assertEqual(len(response_queries), 3)
+
+    def test_rolled_back_response_is_not_reused(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            with AttemptRecorder() as recorder:
+                self.refuse(recorder, self.clients[0])
+            raise RuntimeError
+        self.assertFalse(AttemptResponse.objects.exists())
+
+        with AttemptRecorder() as recorder:
+            self.refuse(recorder, self.clients[1])
+        attempt = Attempt.objects.get()
+        self.assertEqual(attempt.response.text, AttemptResponse.objects.get().text)
+
+    def test_prune_moves_old_attempts_to_archive(self):
+        with AttemptRecorder() as recorder:
+            for client in self.clients:
+                recorder.add(self.mailing, client, 'Успешно', 'ok', 250)
+        Attempt.objects.filter(client=self.clients[0]).update(timestamp=timezone.now() - timedelta(days=400))
+
+        call_command('prune_attempts', days=180, stdout=io.StringIO())
+
+        self.assertEqual(Attempt.objects.count(), 3)
+        self.assertEqual(AttemptArchive.objects.get().client_id, self.clients[0].pk)
+        # счётчики остаются полными после очистки журнала
+        self.assertEqual(MailingStats.objects.get(mailing=self.mailing).success_count, 4)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        dashboard.reset_counters()
+        self.owner = create_owner()
+        create_mailing(self.owner, recipients=3)
+        create_mailing(self.owner, recipients=2, status='Запущена')
+
+    def test_counters_follow_changes(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(
+            (response.context['total_mailings'], response.context['active_mailings'],
+             response.context['unique_recipients']),
+            (2, 1, 5),
+        )
+
+        # дальше счётчики меняются сигналами, без пересчёта по таблицам
+        mailing = create_mailing(self.owner)
+        mailing.status = 'Запущена'
+        mailing.save()
+        Client.objects.create(email='new@example.com', full_name='Новый', owner=self.owner)
+        self.client.force_login(self.owner)
+        self.client.post(reverse('client_delete', args=[Client.objects.filter(owner=self.owner).first().pk]))
+        with self.assertNumQueries(0):
+            counters = dashboard.get_counters()
+        self.assertEqual(counters, {'total_mailings': 3, 'active_mailings': 2, 'unique_recipients': 5})
+
+    def test_owner_deletion_adjusts_recipients_once(self):
+        other = create_owner('other@example.com')
+        create_mailing(other, recipients=4)
+        dashboard.get_counters()
+
+        # без обработчиков на строку клиенты владельца удаляются одним запросом
+        self.assertFalse(post_delete.has_listeners(Client))
+        other.delete()
+
+        with self.assertNumQueries(0):
+            counters = dashboard.get_counters()
+        self.assertEqual(counters['unique_recipients'], 5)
+        self.assertEqual(counters, dashboard.compute_counters())
+
+
+@override_settings(CACHE_ENABLED=True)
+class ListCacheTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, subject='Старая тема')
+        self.client.force_login(self.owner)
+
+    def test_mailing_list_shows_renamed_message(self):
+        self.assertContains(self.client.get(reverse('mailing_list')), 'Старая тема')
+        # второй запрос берёт страницу из кеша
+        with self.assertNumQueries(2):
+            self.client.get(reverse('mailing_list'))
+
+        message = self.mailing.message
+        message.subject = 'Новая тема'
+        message.save()
+
+        response = self.client.get(reverse('mailing_list'))
+        self.assertContains(response, 'Новая тема')
+        self.assertNotContains(response, 'Старая тема')
+
+    def test_mailing_list_pages_by_cursor(self):
+        for i in range(3):
+            create_mailing(self.owner, subject=f'Тема {i}')
+        first = self.client.get(reverse('mailing_list') + '?size=2').context['page']
+        second = self.client.get(reverse('mailing_list') + f'?size=2&after={first.next_cursor}').context['page']
+        self.assertEqual(len(first) + len(second), 4)
+        self.assertLess(first.items[-1].pk, second.items[0].pk)
+        self.assertIsNone(second.next_cursor)
+
+
+class ClientImportTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        Client.objects.create(email='Known@example.com', full_name='Уже есть', owner=self.owner)
+        self.client.force_login(self.owner)
+
+    def upload(self, content, name='clients.csv'):
+        return self.client.post(reverse('client_import'), {'file': SimpleUploadedFile(name, content)})
+
+    def test_dedupes_case_insensitively_and_counts_bad_rows(self):
+        content = (
+            'email,full_name\n'
+            'A@example.com,Первый\n'
+            'a@EXAMPLE.com,Дубль в файле\n'
+            'known@example.com,Дубль в базе\n'
+            'not-an-email,Ошибка\n'
+            ',Без адреса\n'
+        ).encode()
+        with open_stream(content) as stream:
+            report = import_clients(stream, self.owner, batch_size=2)
+
+        self.assertEqual((report.inserted, report.skipped, report.invalid), (1, 2, 2))
+        self.assertEqual(
+            sorted(Client.objects.values_list('email', flat=True)), ['A@example.com', 'Known@example.com']
+        )
+
+    def test_clients_added_concurrently_are_not_counted(self):
+        Client.objects.create(email='race@example.com', full_name='Параллельно', owner=self.owner)
+        annotate = Client.objects.annotate
+        checks = []
+
+        def stale(*args, **kwargs):
+            # первая проверка не видит адрес: его добавили между проверкой и вставкой
+            checks.append(1)
+            queryset = annotate(*args, **kwargs)
+            return queryset.none() if len(checks) == 1 else queryset
+
+        content = 'email,full_name\nrace@example.com,Гонка\nfree@example.com,Свободный\n'.encode()
+        with open_stream(content) as stream, mock.patch.object(Client.objects, 'annotate', side_effect=stale):
+            report = import_clients(stream, self.owner)
+
+        self.assertEqual((report.inserted, report.skipped), (1, 1))
+        self.assertEqual(Client.objects.count(), 3)
+
+    def test_jsonl_skips_malformed_lines(self):
+        content = '{"email": "j@example.com", "full_name": "J"}\n[1, 2]\n{broken\n'.encode()
+        with open_stream(content) as stream:
+            report = import_clients(stream, self.owner, fmt='jsonl')
+        self.assertEqual((report.inserted, report.invalid), (1, 2))
+
+    def test_non_utf8_upload_is_a_form_error(self):
+        content = 'email,full_name\nw@example.com,Клиент\n'.encode('cp1251')
+        response = self.upload(content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'file', 'Файл должен быть в кодировке UTF-8.')
+        self.assertEqual(Client.objects.count(), 1)
+
+    def test_upload_imports_clients(self):
+        response = self.upload('email,full_name\nnew@example.com,Новый\n'.encode())
+        self.assertRedirects(response, reverse('client_list'))
+        self.assertTrue(Client.objects.filter(email='new@example.com', owner=self.owner).exists())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    # первые accept писем принимаются, остальные завершаются заданной ошибкой
+    error = None
+    accept = 0
+    accepted = 0
+    _lock = threading.Lock()
+
+    def send_messages(self, email_messages):
+        with self._lock:
+            if FailingEmailBackend.accepted >= self.accept:
+                raise self.error
+            FailingEmailBackend.accepted += len(email_messages)
+        return len(email_messages)
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.FailingEmailBackend')
+class DeliveryErrorTests(TestCase):
+    def setUp(self):
+        self.mailing = create_mailing(create_owner(), recipients=2)
+
+    def tearDown(self):
+        FailingEmailBackend.error = None
+        FailingEmailBackend.accept = FailingEmailBackend.accepted = 0
+
+    def deliver(self, error, engine=None):
+        FailingEmailBackend.error = error
+        return deliver_mailing(Mailing.objects.select_related('message').get(pk=self.mailing.pk), engine)
+
+    def test_recipient_refused_is_suppressed(self):
+        report = self.deliver(smtplib.SMTPRecipientsRefused({'x@example.com': (550, b'5.1.1 No such user')}))
+        self.assertEqual(report.suppressed, 2)
+        self.assertEqual(
+            set(Suppression.objects.values_list('reason', 'smtp_code')), {(Suppression.REASON_PERMANENT, 550)}
+        )
+
+    def test_temporary_recipient_refusal_is_retried(self):
+        report = self.deliver(smtplib.SMTPRecipientsRefused({'x@example.com': (451, b'4.7.1 Try later')}))
+        self.assertEqual((report.retried, report.suppressed), (2, 0))
+        self.assertEqual(DeliveryRetry.objects.filter(mailing=self.mailing).count(), 2)
+
+    def test_rejected_message_is_not_suppressed(self):
+        report = self.deliver(smtplib.SMTPDataError(554, b'5.6.0 Message rejected'))
+        self.assertEqual((report.failed, report.retried, report.suppressed), (2, 0, 0))
+        self.assertFalse(Suppression.objects.exists())
+        self.assertFalse(DeliveryRetry.objects.exists())
+
+    def test_session_errors_abort_the_run(self):
+        errors = [
+            smtplib.SMTPAuthenticationError(535, b'5.7.8 Bad credentials'),
+            smtplib.SMTPSenderRefused(553, b'5.7.1 Sender rejected', 'noreply@example.com'),
+            ValueError('непредвиденная ошибка'),
+        ]
+        for error in errors:
+            with self.subTest(error=type(error).__name__):
+                with self.assertRaises(DeliveryAborted):
+                    self.deliver(error)
+                self.assertFalse(Suppression.objects.exists())
+                self.assertFalse(Attempt.objects.exists())
+                job = DeliveryJob.objects.filter(mailing=self.mailing).latest('id')
+                self.assertEqual(job.status, DeliveryJob.STATUS_FAILED)
+
+    def test_messages_sent_before_abort_are_recorded(self):
+        self.mailing.recipients.add(*create_mailing(self.mailing.owner, recipients=4).recipients.all())
+        error = smtplib.SMTPAuthenticationError(535, b'5.7.8 Bad credentials')
+        for concurrency in (1, 3):
+            with self.subTest(concurrency=concurrency):
+                Attempt.objects.all().delete()
+                FailingEmailBackend.accepted = 0
+                # ошибка приходит на втором письме второй пачки
+                FailingEmailBackend.accept = 3
+                with self.assertRaises(DeliveryAborted):
+                    self.deliver(error, DeliveryEngine(batch_size=2, concurrency=concurrency))
+                # письма, принятые сервером до ошибки, есть в журнале
+                self.assertEqual(FailingEmailBackend.accepted, 3)
+                self.assertEqual(Attempt.objects.filter(mailing=self.mailing, status='Успешно').count(), 3)
+                DeliveryJob.objects.all().delete()
+
+    def test_async_errors_are_classified_the_same_way(self):
+        import aiosmtplib
+
+        refused = aiosmtplib.SMTPRecipientsRefused([
+            aiosmtplib.SMTPRecipientRefused(550, 'No such user', 'x@example.com'),
+        ])
+        self.assertEqual(async_classify_error(refused), (550, False, True))
+        self.assertEqual(async_classify_error(aiosmtplib.SMTPDataError(451, 'Try later')), (451, True, False))
+        self.assertEqual(async_classify_error(aiosmtplib.SMTPServerDisconnected('closed')), (None, True, False))
+        for error in (
+            aiosmtplib.SMTPAuthenticationError(535, 'Bad credentials'),
+            aiosmtplib.SMTPSenderRefused(553, 'Sender rejected', 'noreply@example.com'),
+        ):
+            with self.subTest(error=type(error).__name__), self.assertRaises(DeliveryAborted):
+                async_classify_error(error)
+
+
+@override_settings(EMAIL_BACKEND='mailing.bench.SinkEmailBackend')
+class SnapshotResumeTests(TestCase):
+    def setUp(self):
+        self.mailing = create_mailing(create_owner(), recipients=4)
+        SinkEmailBackend.sent = 0
+
+    def start_crashed_run(self, claimed):
+        # обработчик забрал порцию снимка и упал, не записав попытки
+        job = start_run(self.mailing, worker='crashed')
+        take_snapshot(job)
+        clients = claim_chunk(job, 0, claimed)
+        DeliveryJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        return job, clients
+
+    def test_takeover_resends_claimed_rows_without_attempts(self):
+        job, clients = self.start_crashed_run(claimed=3)
+        # одну попытку упавший обработчик всё же успел записать
+        Attempt.objects.create(mailing=self.mailing, client=clients[0], status='Успешно', server_response='ok')
+
+        report = deliver_mailing(Mailing.objects.select_related('message').get(pk=self.mailing.pk))
+
+        job.refresh_from_db()
+        self.assertEqual(report.sent, 3)
+        self.assertEqual(SinkEmailBackend.sent, 3)
+        self.assertEqual((job.status, job.sent_count), (DeliveryJob.STATUS_DONE, 4))
+        self.assertEqual(Attempt.objects.filter(mailing=self.mailing).count(), 4)
+
+    def test_run_after_abort_sends_only_the_rest(self):
+        FailingEmailBackend.error = smtplib.SMTPAuthenticationError(535, b'5.7.8 Bad credentials')
+        FailingEmailBackend.accept, FailingEmailBackend.accepted = 2, 0
+        try:
+            with override_settings(EMAIL_BACKEND='mailing.tests.FailingEmailBackend'), \
+                    self.assertRaises(DeliveryAborted):
+                deliver_mailing(self.mailing, DeliveryEngine(batch_size=3))
+        finally:
+            FailingEmailBackend.error = None
+            FailingEmailBackend.accept = FailingEmailBackend.accepted = 0
+
+        report = deliver_mailing(Mailing.objects.select_related('message').get(pk=self.mailing.pk))
+
+        self.assertEqual((report.sent, SinkEmailBackend.sent), (2, 2))
+        successes = Attempt.objects.filter(mailing=self.mailing, status='Успешно')
+        self.assertEqual(successes.count(), 4)
+        self.assertEqual(successes.values('client').distinct().count(), 4)
+        job = DeliveryJob.objects.filter(mailing=self.mailing).latest('id')
+        self.assertEqual((job.status, job.sent_count), (DeliveryJob.STATUS_DONE, 4))
+        self.assertFalse(RecipientSnapshot.objects.exists())
+
+    def test_claim_refreshes_heartbeat_of_own_job_only(self):
+        job = start_run(self.mailing, worker='first')
+        take_snapshot(job)
+        DeliveryJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=10))
+        claim_chunk(job, 0, 1)
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, timezone.now() - timedelta(minutes=1))
+
+        # задачу забрал другой обработчик: прежний останавливается и не трогает её итоги
+        DeliveryJob.objects.filter(pk=job.pk).update(worker='second')
+        with self.assertRaises(MailingBusy):
+            claim_chunk(job, 0, 1)
+        finish_run(job, error='остановлен')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.error), (DeliveryJob.STATUS_RUNNING, 'second', ''))
+
+
+class MessageRendererTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.recipient = Client.objects.create(
+            email='r@example.com', full_name='<Иван & Ко>', comment='VIP', owner=self.owner
+        )
+
+    def render(self, **fields):
+        message = Message(owner=self.owner, **fields)
+        return MessageRenderer(message).render(self.recipient)
+
+    def test_text_is_not_escaped_and_html_is(self):
+        email = self.render(
+            subject='{{ full_name }}', body='{{ full_name }}, {{ comment }}', html_body='<p>{{ full_name }}</p>'
+        )
+        self.assertEqual(email.subject, '<Иван & Ко>')
+        self.assertEqual(email.body, '<Иван & Ко>, VIP')
+        self.assertEqual(email.alternatives[0][0], '<p>&lt;Иван &amp; Ко&gt;</p>')
+
+    def test_context_holds_plain_values_only(self):
+        email = self.render(subject='Тема', body='[{{ client.owner.email }}][{{ client.pk }}]{{ unsubscribe_url }}')
+        self.assertTrue(email.body.startswith('[][]http'))
+        self.assertNotIn(self.owner.email, email.body)
+
+    def test_file_and_debug_tags_are_rejected(self):
+        for body in ('{% debug %}', '{% include "base.html" %}', '{% load static %}', '{% extends "base.html" %}'):
+            with self.subTest(body=body):
+                form = MessageForm(data={'subject': 'Тема', 'body': body})
+                self.assertFalse(form.is_valid())
+                self.assertIn('body', form.errors)
+        self.assertEqual(self.render(subject='Тема', body='{% if comment %}{{ comment|lower }}{% endif %}').body, 'vip')
+
+
+class BenchDeliveryTests(TestCase):
+    def bench(self, **options):
+        return call_command('bench_delivery', count=3, stdout=io.StringIO(), **options)
+
+    def test_bench_data_is_removed(self):
+        self.bench()
+        self.assertFalse(CustomUser.objects.filter(email=BENCH_OWNER).exists())
+        self.assertFalse(Mailing.objects.exists())
+
+    def test_kept_bench_mailing_is_ignored_by_scheduler(self):
+        self.bench(keep=True)
+        self.assertEqual(run_due_mailings(), (0, 0))
+        self.assertEqual(list(Mailing.objects.values_list('status', flat=True)), ['Завершена'])
+        self.assertFalse(DeliveryJob.objects.filter(status=DeliveryJob.STATUS_QUEUED).exists())
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend')
+    def test_real_smtp_requires_flag(self):
+        with self.assertRaisesMessage(CommandError, '--allow-real-smtp'):
+            self.bench(sink='settings')
+        self.assertFalse(Mailing.objects.exists())
+
+
+@override_settings(EMAIL_BACKEND='mailing.bench.SinkEmailBackend')
+class AsyncDeliveryTests(TransactionTestCase):
+    def setUp(self):
+        self.mailing = create_mailing(create_owner(), recipients=25)
+        SinkEmailBackend.sent = 0
+
+    def tearDown(self):
+        # ORM из sync_to_async работает в отдельном потоке со своим соединением
+        asyncio.run(sync_to_async(connections.close_all)())
+
+    def deliver(self, **options):
+        mailing = Mailing.objects.select_related('message').get(pk=self.mailing.pk)
+        engine = AsyncDeliveryEngine(**options)
+        return asyncio.run(deliver_mailing_async(mailing, engine))
+
+    def test_sends_every_recipient_once(self):
+        report = self.deliver(concurrency=4, batch_size=10)
+
+        self.assertEqual((report.sent, report.failed), (25, 0))
+        self.assertEqual(SinkEmailBackend.sent, 25)
+        self.assertEqual(
+            Attempt.objects.filter(mailing=self.mailing).values('client').distinct().count(), 25
+        )
+        self.assertEqual(DeliveryJob.objects.get(mailing=self.mailing).status, DeliveryJob.STATUS_DONE)
+
+    @override_settings(EMAIL_BACKEND='mailing.tests.FailingEmailBackend')
+    def test_session_error_stops_all_workers(self):
+        FailingEmailBackend.error = smtplib.SMTPAuthenticationError(535, b'5.7.8 Bad credentials')
+        try:
+            with self.assertRaises(DeliveryAborted):
+                self.deliver(concurrency=4, batch_size=10)
+        finally:
+            FailingEmailBackend.error = None
+        self.assertEqual(DeliveryJob.objects.get(mailing=self.mailing).status, DeliveryJob.STATUS_FAILED)
+        self.assertFalse(Suppression.objects.exists())
+
+
+class MetricsViewTests(TestCase):
+    def get(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    @override_settings(MAILING_METRICS_TOKEN='', DEBUG=False)
+    def test_closed_without_token(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    @override_settings(MAILING_METRICS_TOKEN='secret')
+    def test_requires_bearer_token(self):
+        self.assertEqual(self.get(Authorization='Bearer wrong').status_code, 403)
+
+        DeliveryJob.objects.create(mailing=create_mailing(create_owner()))
+        response = self.get(Authorization='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('mailing_queue_depth{status="queued"} 1', response.content.decode())
+
+
+class CountingEmailBackend(SinkEmailBackend):
+    # считает открытые SMTP-сессии
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+@override_settings(EMAIL_BACKEND='mailing.tests.CountingEmailBackend')
+class DeliveryEngineTests(TestCase):
+    def setUp(self):
+        self.mailing = create_mailing(create_owner(), recipients=10)
+        CountingEmailBackend.opened = 0
+        SinkEmailBackend.sent = 0
+
+    def test_connection_is_reused_across_batches(self):
+        engine = DeliveryEngine(batch_size=3, max_messages_per_connection=4)
+        report = deliver_mailing(Mailing.objects.select_related('message').get(pk=self.mailing.pk), engine)
+
+        self.assertEqual((report.sent, report.failed), (10, 0))
+        self.assertEqual(SinkEmailBackend.sent, 10)
+        # одна сессия на каждые max_messages_per_connection писем, а не на письмо или пачку
+        self.assertEqual(CountingEmailBackend.opened, 3)
+        self.assertEqual(Attempt.objects.filter(mailing=self.mailing, status='Успешно').count(), 10)
+
+
+@override_settings(EMAIL_BACKEND='mailing.bench.SinkEmailBackend')
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=3)
+        SinkEmailBackend.sent = 0
+
+    def test_send_view_only_enqueues(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('send_mailing', args=[self.mailing.pk]))
+
+        self.assertRedirects(response, reverse('mailing_list'), fetch_redirect_response=False)
+        self.assertEqual(DeliveryJob.objects.get(mailing=self.mailing).status, DeliveryJob.STATUS_QUEUED)
+        self.assertEqual(SinkEmailBackend.sent, 0)
+
+    def test_worker_delivers_queued_job(self):
+        job, created = enqueue_mailing(self.mailing)
+        self.assertTrue(created)
+        self.assertEqual(enqueue_mailing(self.mailing), (job, False))
+
+        self.assertEqual(run_worker('test-worker', burst=True), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent_count, job.worker), (DeliveryJob.STATUS_DONE, 3, 'test-worker'))
+        self.assertEqual(SinkEmailBackend.sent, 3)
+        self.assertIsNone(claim_job('test-worker'))
+
+
+@override_settings(CACHE_ENABLED=True)
+class AttemptRecorderTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=3)
+        self.clients = list(self.mailing.recipients.order_by('pk'))
+
+    def test_attempts_are_buffered_and_written_in_bulk(self):
+        version = get_version('mailing_stats', self.owner.pk)
+        recorder = AttemptRecorder(flush_size=3, flush_interval=3600)
+        for client in self.clients[:2]:
+            recorder.add(self.mailing, client, 'Успешно', 'ok', 250)
+        self.assertFalse(Attempt.objects.exists())
+
+        with CaptureQueriesContext(connection) as context:
+            recorder.add(self.mailing, self.clients[2], 'Не успешно', 'mailbox full', 452)
+
+        inserts = [
+            query for query in context.captured_queries if query['sql'].startswith('INSERT INTO "mailing_attempt"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Attempt.objects.filter(mailing=self.mailing).count(), 3)
+        # кеш статистики владельца сброшен один раз на весь сброс буфера
+        self.assertNotEqual(get_version('mailing_stats', self.owner.pk), version)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.moment = timezone.now()
+
+    def mailing(self, status, start, end):
+        mailing = create_mailing(
+            self.owner,
+            start_datetime=self.moment + timedelta(hours=start), end_datetime=self.moment + timedelta(hours=end),
+        )
+        # save() сам завершает рассылки с прошедшим окончанием, поэтому статус — через update
+        Mailing.objects.filter(pk=mailing.pk).update(status=status)
+        return mailing
+
+    def test_due_mailings_start_and_expired_ones_finish(self):
+        due = self.mailing('Создана', -1, 1)
+        future = self.mailing('Создана', 2, 3)
+        running = self.mailing('Запущена', -2, 4)
+        expired = self.mailing('Запущена', -3, -1)
+
+        self.assertEqual(run_due_mailings(self.moment), (1, 1))
+
+        statuses = dict(Mailing.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[due.pk], 'Запущена')
+        self.assertEqual(statuses[future.pk], 'Создана')
+        self.assertEqual(statuses[running.pk], 'Запущена')
+        self.assertEqual(statuses[expired.pk], 'Завершена')
+        self.assertEqual(
+            list(DeliveryJob.objects.values_list('mailing_id', 'status')), [(due.pk, DeliveryJob.STATUS_QUEUED)]
+        )
+        # повторный проход ничего не меняет и задач не дублирует
+        self.assertEqual(run_due_mailings(self.moment), (0, 0))
+        self.assertEqual(DeliveryJob.objects.count(), 1)
+        # ближайшее событие — окончание только что запущенной рассылки, раньше старта будущей
+        self.assertEqual(next_due_at(), due.end_datetime)
+
+
+@override_settings(EMAIL_BACKEND='mailing.bench.SinkEmailBackend')
+class SendMailingCommandTests(TestCase):
+    def setUp(self):
+        owner = create_owner()
+        self.mailings = [create_mailing(owner, recipients=5) for _ in range(2)]
+        SinkEmailBackend.sent = 0
+
+    def test_sends_several_mailings_over_a_thread_pool(self):
+        out = io.StringIO()
+        call_command(
+            'send_mailing', *[mailing.pk for mailing in self.mailings], '--concurrency', '3', '--batch-size', '2',
+            stdout=out,
+        )
+
+        self.assertEqual(SinkEmailBackend.sent, 10)
+        self.assertIn('Всего писем: 10', out.getvalue())
+        for mailing in self.mailings:
+            self.assertEqual(Attempt.objects.filter(mailing=mailing, status='Успешно').count(), 5)
+            self.assertEqual(DeliveryJob.objects.get(mailing=mailing).status, DeliveryJob.STATUS_DONE)
+
+    def test_requires_ids_or_all_due(self):
+        with self.assertRaises(CommandError):
+            call_command('send_mailing', stdout=io.StringIO())
+
+
+@override_settings(CACHE_ENABLED=True)
+class VersionedCacheTests(TestCase):
+    def test_invalidate_switches_only_its_scope_to_a_new_version(self):
+        calls = []
+
+        def compute(value):
+            def inner():
+                calls.append(value)
+                return value
+            return inner
+
+        self.assertEqual(get_or_set('test_list', 'first', compute('a')), 'a')
+        self.assertEqual(get_or_set('test_list', 'first', compute('b')), 'a')
+        self.assertEqual(get_or_set('test_list', 'second', compute('c')), 'c')
+
+        invalidate('test_list', 'first')
+
+        self.assertEqual(get_or_set('test_list', 'first', compute('d')), 'd')
+        self.assertEqual(get_or_set('test_list', 'second', compute('e')), 'c')
+        self.assertEqual(calls, ['a', 'c', 'd'])
+
+    def test_client_list_is_refreshed_after_save(self):
+        owner = create_owner()
+        self.client.force_login(owner)
+        self.client.get(reverse('client_list'))
+
+        Client.objects.create(email='fresh@example.com', full_name='Новый', owner=owner)
+
+        self.assertContains(self.client.get(reverse('client_list')), 'fresh@example.com')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=2)
+        create_mailing(create_owner('other@example.com'), recipients=1)
+        self.client.force_login(self.owner)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_clients_csv_contains_only_own_clients(self):
+        rows = list(csv.reader(io.StringIO(self.export('export_clients'))))
+
+        self.assertEqual(rows[0], ['id', 'email', 'full_name', 'comment', 'owner_id'])
+        self.assertEqual(
+            sorted(row[1] for row in rows[1:]),
+            sorted(self.mailing.recipients.values_list('email', flat=True)),
+        )
+
+    def test_attempts_jsonl_resolves_compacted_responses(self):
+        clients = list(self.mailing.recipients.order_by('pk'))
+        with AttemptRecorder() as recorder:
+            recorder.add(self.mailing, clients[0], 'Успешно', 'ok', 250)
+            recorder.add(self.mailing, clients[1], 'Не успешно', 'mailbox full', 452)
+
+        rows = [json.loads(line) for line in self.export('export_attempts', format='jsonl').splitlines()]
+
+        self.assertEqual(
+            sorted((row['client_id'], row['smtp_code'], row['response_text']) for row in rows),
+            [(clients[0].pk, 250, 'Письмо успешно отправлено'), (clients[1].pk, 452, 'mailbox full')],
+        )
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('export_attempts'), {'date_from': 'вчера'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_from', response.json()['errors'])
+        self.assertEqual(self.client.get(reverse('export_clients'), {'format': 'xml'}).status_code, 400)
+
+    def test_attempts_follow_stats_status_filter(self):
+        running = create_mailing(self.owner, recipients=1, status='Запущена')
+        with AttemptRecorder() as recorder:
+            recorder.add(self.mailing, self.mailing.recipients.first(), 'Успешно', 'ok', 250)
+            recorder.add(running, running.recipients.first(), 'Успешно', 'ok', 250)
+
+        export = self.export('export_attempts', format='jsonl', status='Запущена')
+        rows = [json.loads(line) for line in export.splitlines()]
+
+        self.assertEqual([row['mailing_id'] for row in rows], [running.pk])
+
+
+class RecipientSelectionTests(TestCase):
+    def setUp(self):
+        self.owner = create_owner()
+        self.mailing = create_mailing(self.owner, recipients=2)
+        self.picked = list(self.mailing.recipients.order_by('pk'))
+
+    def test_recipients_combine_picked_clients_and_group(self):
+        extra = Client.objects.create(email='group@example.com', full_name='Из группы', owner=self.owner)
+        suppressed = Client.objects.create(email='gone@example.com', full_name='Отписан', owner=self.owner)
+        Suppression.objects.create(client=suppressed, reason=Suppression.REASON_UNSUBSCRIBED)
+        group = ClientGroup.objects.create(name='Группа', owner=self.owner)
+        group.clients.set([self.picked[0], extra, suppressed])
+        self.mailing.group = group
+        self.mailing.save()
+
+        self.assertEqual(
+            sorted(self.mailing.get_recipients().values_list('pk', flat=True)),
+            sorted([self.picked[0].pk, self.picked[1].pk, extra.pk]),
+        )
+
+    def test_search_matches_own_clients_by_prefix(self):
+        Client.objects.create(email='Anna@example.com', full_name='Анна', owner=self.owner)
+        Client.objects.create(email='anton@example.com', full_name='Антон', owner=create_owner('other@example.com'))
+        self.client.force_login(self.owner)
+
+        results = self.client.get(reverse('client_search'), {'q': 'an'}).json()['results']
+
+        self.assertEqual([row['text'] for row in results], [str(Client.objects.get(email='Anna@example.com'))])
+        self.assertEqual(self.client.get(reverse('client_search'), {'q': 'a'}).json()['results'], [])
+
+    def test_non_numeric_recipient_is_a_form_error(self):
+        self.client.force_login(self.owner)
+
+        response = self.client.post(reverse('mailing_create'), {'recipients': ['abc', str(self.picked[0].pk)]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('recipients', response.context['form'].errors)
+        self.assertContains(response, f'<option value="{self.picked[0].pk}" selected>')
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.prefix = f"{settings.CACHES['default'].get('KEY_PREFIX', '')}:test:{self.id()}"
+
+    def tearDown(self):
+        limiter = RedisRateLimiter(prefix=self.prefix)
+        keys = list(limiter.client.scan_iter(f'{self.prefix}:*'))
+        if keys:
+            limiter.client.delete(*keys)
+
+    def test_domain_bucket_limits_only_its_domain(self):
+        limiter = RedisRateLimiter(global_rate=1000, domains={'slow.example': 0.5}, prefix=self.prefix)
+
+        self.assertEqual(limiter.try_acquire(1, 'slow.example'), (0, None))
+        delay, scope = limiter.try_acquire(1, 'slow.example')
+        self.assertEqual(scope, 'domain')
+        self.assertGreater(delay, 1)
+        self.assertEqual(limiter.try_acquire(1, 'fast.example'), (0, None))
+
+    def test_reports_the_bucket_with_the_longest_wait(self):
+        # если исчерпано несколько вёдер, называется то, которое ждать дольше
+        limiter = RedisRateLimiter(global_rate=1, per_owner=0.5, prefix=self.prefix)
+        self.assertEqual(limiter.try_acquire(1), (0, None))
+        self.assertEqual(limiter.try_acquire(2)[1], 'global')
+        self.assertEqual(limiter.try_acquire(1)[1], 'owner')
+
+    def test_paced_sends_other_domains_while_one_waits(self):
+        class DomainLimiter:
+            # первый токен домена выдаётся сразу, следующий — через 10 мс
+            stats = RateLimitStats()
+
+            def __init__(self):
+                self.ready_at = {}
+
+            def try_acquire(self, owner_id=None, domain=None):
+                current = time.monotonic()
+                ready_at = self.ready_at.get(domain, current)
+                if ready_at > current:
+                    return ready_at - current, 'domain'
+                self.ready_at[domain] = current + 0.01
+                return 0, None
+
+        items = [
+            (Client(email=email), None)
+            for email in ('a@slow.example', 'b@slow.example', 'c@fast.example', 'd@other.example')
+        ]
+        order = [client.email for client, _ in paced(DomainLimiter(), items)]
+
+        self.assertEqual(order, ['a@slow.example', 'c@fast.example', 'd@other.example', 'b@slow.example'])
@@ -0,0 +1,256 @@
+import atexit
+import base64
+import hashlib
+import hmac
+import html
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.db import DatabaseError, InterfaceError, OperationalError, transaction
+from django.urls import reverse
+
+from .models import Client, EmailEvent, Mailing, MailingStats
+
+logger = logging.getLogger('mailing.tracking')
+
+TRACKING_SALT = 'mailing.tracking'
+
+# прозрачный GIF 1×1 для пикселя открытия
+PIXEL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+TEXT_LINK_RE = re.compile(r'https?://[^\s<>"\']+')
+HTML_LINK_RE = re.compile(r'''(\bhref\s*=\s*)(["'])(https?://[^"']+)\2''', re.IGNORECASE)
+BODY_END_RE = re.compile(r'</body\s*>', re.IGNORECASE)
+TRAILING_PUNCTUATION = '.,;:!?)'
+
+_mac = None
+
+
+def sign(value):
+    # как signing.Signer, но ключ HMAC выводится один раз на процесс, а не на
+    # каждую подпись: письмо подписывает все свои ссылки, а пиксель и редирект
+    # проверяют подпись на каждом запросе
+    global _mac
+    if _mac is None:
+        key = hashlib.sha256(f'{TRACKING_SALT}{settings.SECRET_KEY}'.encode()).digest()
+        _mac = hmac.new(key, digestmod=hashlib.sha256)
+    mac = _mac.copy()
+    mac.update(value.encode())
+    return base64.urlsafe_b64encode(mac.digest()[:20]).decode().rstrip('=')
+
+
+def make_token(mailing_id, client_id, url=''):
+    # токен открытия подписывает пару рассылка/клиент, токен перехода —
+    # ещё и адрес ссылки, чтобы редирект нельзя было направить на чужой сайт
+    value = f'{mailing_id}.{client_id}'
+    return f'{value}:{sign(f"{value}:{url}" if url else value)}'
+
+
+def read_token(token, url=''):
+    value, _, signature = token.rpartition(':')
+    if not hmac.compare_digest(signature.encode(), sign(f'{value}:{url}' if url else value).encode()):
+        raise signing.BadSignature('Неверная подпись ссылки отслеживания')
+    mailing_id, _, client_id = value.partition('.')
+    return int(mailing_id), int(client_id)
+
+
+class LinkTracker:
+    # переписывает ссылки письма на редирект через сайт и добавляет пиксель
+    # открытия в HTML-версию; адреса reverse() считаются один раз на рассылку
+    def __init__(self, mailing_id, skip_prefixes=()):
+        self.mailing_id = mailing_id
+        site = getattr(settings, 'MAILING_SITE_URL', '').rstrip('/')
+        self.open_prefix, _, self.open_suffix = (site + reverse('track_open', args=['token'])).rpartition('token')
+        self.click_prefix, _, self.click_suffix = (site + reverse('track_click', args=['token'])).rpartition('token')
+        self.skip_prefixes = (self.open_prefix, self.click_prefix, *skip_prefixes)
+        # ссылки у получателей обычно одни и те же — экранируем каждую один раз
+        # (персональные ссылки из шаблона кешируются только до предела)
+        self._quoted = {}
+
+    def click_url(self, client_id, url):
+        if url.startswith(self.skip_prefixes):
+            return url
+        quoted = self._quoted.get(url)
+        if quoted is None:
+            quoted = quote(url, safe='')
+            if len(self._quoted) < 1000:
+                self._quoted[url] = quoted
+        token = make_token(self.mailing_id, client_id, url)
+        return f'{self.click_prefix}{token}{self.click_suffix}?u={quoted}'
+
+    def rewrite_text(self, text, client_id):
+        if 'http' not in text:
+            return text
+
+        def replace(match):
+            url = match.group(0)
+            stripped = url.rstrip(TRAILING_PUNCTUATION)
+            return self.click_url(client_id, stripped) + url[len(stripped):]
+
+        return TEXT_LINK_RE.sub(replace, text)
+
+    def rewrite_html(self, text, client_id):
+        def replace(match):
+            prefix, quote_char, url = match.groups()
+            return f'{prefix}{quote_char}{self.click_url(client_id, html.unescape(url))}{quote_char}'
+
+        if 'http' in text:
+            text = HTML_LINK_RE.sub(replace, text)
+        pixel = (
+            f'<img src="{self.open_prefix}{make_token(self.mailing_id, client_id)}{self.open_suffix}" '
+            f'width="1" height="1" alt="" style="display:none">'
+        )
+        matches = list(BODY_END_RE.finditer(text))
+        if not matches:
+            return text + pixel
+        position = matches[-1].start()
+        return text[:position] + pixel + text[position:]
+
+
+class EventBuffer:
+    # события копятся в памяти процесса и раз в MAILING_TRACKING_FLUSH_INTERVAL
+    # секунд (или по MAILING_TRACKING_FLUSH_SIZE штук) одним RPUSH уходят в список
+    # Redis из CACHES; в таблицу EmailEvent их переносит ingest_events()
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._client = None
+
+    @property
+    def key(self):
+        return f"{settings.CACHES['default'].get('KEY_PREFIX', '')}:events"
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+        return self._client
+
+    def add(self, kind, mailing_id, client_id, url=''):
+        # запись — строка «время|вид|рассылка|клиент|ссылка», без JSON и обращений к БД
+        entry = f'{time.time():.3f}|{kind}|{mailing_id}|{client_id}|{url}'
+        with self._lock:
+            self._pending.append(entry)
+            due = (
+                len(self._pending) >= getattr(settings, 'MAILING_TRACKING_FLUSH_SIZE', 500)
+                or time.monotonic() - self._last_flush >= getattr(settings, 'MAILING_TRACKING_FLUSH_INTERVAL', 1)
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self.client.rpush(self.key, *pending)
+        except Exception:
+            # Redis недоступен — вернём события в буфер, но не дадим ему расти без предела
+            limit = getattr(settings, 'MAILING_TRACKING_BUFFER_LIMIT', 100000)
+            with self._lock:
+                self._pending[:0] = pending
+                del self._pending[:-limit]
+
+    def pop(self, count):
+        return [entry.decode() for entry in self.client.lpop(self.key, count) or []]
+
+    def push_back(self, entries):
+        self.client.lpush(self.key, *reversed(entries))
+
+    def dead_letter(self, entries):
+        # записи, которые нельзя перенести в БД, откладываются для разбора вручную
+        self.client.rpush(f'{self.key}:dead', *entries)
+
+
+EVENTS = EventBuffer()
+atexit.register(EVENTS.flush)
+
+
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_event(entry):
+    # ValueError, если запись повреждена: такую нельзя ни сохранить, ни повторить
+    timestamp, kind, mailing_id, client_id, url = entry.split('|', 4)
+    if kind not in (EmailEvent.KIND_OPEN, EmailEvent.KIND_CLICK):
+        raise ValueError(f'неизвестный вид события {kind!r}')
+    mailing_id, client_id = int(mailing_id), int(client_id)
+    if not (0 < mailing_id <= MAX_ID and 0 < client_id <= MAX_ID):
+        raise ValueError('идентификатор вне допустимого диапазона')
+    try:
+        moment = datetime.fromtimestamp(float(timestamp), dt_timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError(f'неверное время события: {e}')
+    return EmailEvent(kind=kind, mailing_id=mailing_id, client_id=client_id, url=url, timestamp=moment)
+
+
+def keep_events(store, entries):
+    # события уже сняты с очереди: если и Redis недоступен, они пишутся в журнал,
+    # чтобы их можно было вернуть вручную, а обработчик продолжает работу
+    try:
+        store(entries)
+    except Exception:
+        logger.error('Не удалось вернуть в Redis %d событий: %r', len(entries), entries, exc_info=True)
+
+
+def ingest_events(batch_size=None):
+    # переносит пачку событий из Redis в EmailEvent одним bulk_create
+    # и добавляет их к счётчикам MailingStats; возвращает число событий,
+    # снятых с очереди (вместе с отброшенными), чтобы вызывающий знал, что она не пуста.
+    # Ошибки не выходят наружу: обработчик очереди не должен падать из-за событий
+    batch_size = batch_size or getattr(settings, 'MAILING_TRACKING_INGEST_BATCH', 5000)
+    EVENTS.flush()
+    try:
+        entries = EVENTS.pop(batch_size)
+    except Exception:
+        logger.warning('Очередь событий отслеживания недоступна', exc_info=True)
+        return 0
+    if not entries:
+        return 0
+
+    events, valid = [], []
+    for entry in entries:
+        try:
+            events.append(parse_event(entry))
+        except ValueError as e:
+            logger.warning('Отброшено повреждённое событие отслеживания %r: %s', entry, e)
+        else:
+            valid.append(entry)
+    if not events:
+        return len(entries)
+
+    try:
+        # рассылку или клиента могли удалить, пока событие ждало в очереди
+        mailing_ids = set(
+            Mailing.objects.filter(pk__in={event.mailing_id for event in events}).values_list('pk', flat=True)
+        )
+        client_ids = set(
+            Client.objects.filter(pk__in={event.client_id for event in events}).values_list('pk', flat=True)
+        )
+        events = [event for event in events if event.mailing_id in mailing_ids and event.client_id in client_ids]
+        with transaction.atomic():
+            EmailEvent.objects.bulk_create(events, batch_size=batch_size)
+            MailingStats.record_events(events)
+    except (OperationalError, InterfaceError):
+        # БД временно недоступна — возвращаем в очередь только корректные записи;
+        # 0, чтобы обработчик подождал, а не повторял сразу же
+        logger.warning('БД недоступна, %d событий возвращено в очередь', len(valid), exc_info=True)
+        keep_events(EVENTS.push_back, valid)
+        return 0
+    except DatabaseError:
+        logger.exception('Не удалось сохранить %d событий, они отложены в %s:dead', len(valid), EVENTS.key)
+        keep_events(EVENTS.dead_letter, valid)
+    return len(entries)
@@ -6,9 +6,16 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('clients/', views.client_list, name='client_list'),
     path('clients/create/', views.client_create, name='client_create'),
+    path('clients/import/', views.client_import, name='client_import'),
+    path('clients/export/', views.export_clients, name='export_clients'),
+    path('clients/search/', views.client_search, name='client_search'),
     path('clients/<int:pk>/detail/', views.client_detail, name='client_detail'),
     path('clients/<int:pk>/edit/', views.client_update, name='client_update'),
     path('clients/<int:pk>/delete/', views.client_delete, name='client_delete'),
+    path('groups/', views.group_list, name='group_list'),
+    path('groups/create/', views.group_create, name='group_create'),
+    path('groups/<int:pk>/edit/', views.group_update, name='group_update'),
+    path('groups/<int:pk>/delete/', views.group_delete, name='group_delete'),
     path('messages/', views.message_list, name='message_list'),
     path('messages/create/', views.message_create, name='message_create'),
     path('messages/<int:pk>/detail/', views.message_detail, name='message_detail'),
@@ -19,5 +26,10 @@ urlpatterns = [
     path('mailings/<int:pk>/edit/', views.mailing_update, name='mailing_update'),
     path('mailings/<int:pk>/delete/', views.mailing_delete, name='mailing_delete'),
     path('mailings/<int:pk>/send/', views.send_mailing, name='send_mailing'),
+    path('unsubscribe/<str:token>/', views.unsubscribe, name='unsubscribe'),
+    path('t/o/<str:token>/', views.track_open, name='track_open'),
+    path('t/c/<str:token>/', views.track_click, name='track_click'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('stats/', views.mailing_stats_view, name='stats'),
+    path('stats/export/', views.export_attempts, name='export_attempts'),
 ]
@@ -1,16 +1,43 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import csv
+import hmac
+import io
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 
 from django.conf import settings
-from .models import Client, Message, Mailing, Attempt
-from .forms import ClientForm, MessageForm, MailingForm
-from django.core.mail import send_mail
+from .models import (
+    Attempt, AttemptArchive, Client, ClientGroup, DeliveryJob, DeliveryRetry, EmailEvent, Mailing, MailingStats,
+    Message, OwnerStats, Suppression,
+)
+from .forms import (
+    ClientForm, ClientGroupForm, ClientImportForm, ExportFilterForm, MessageForm, MailingForm, StatsFilterForm,
+)
+from .jobs import enqueue_mailing
+from .dashboard import get_counters
+from .exporters import (
+    ATTEMPT_FIELDS, CLIENT_FIELDS, CONTENT_TYPES, attempt_queryset, client_queryset, iter_export, start_of_day,
+)
+from .importers import detect_format, import_clients
+from .pagination import get_cursor, get_page_size, keyset_page
+from .rendering import read_unsubscribe_token
+from .signals import forget_clients
+from .tracking import EVENTS, PIXEL, read_token
 from django.contrib import messages
 from django.utils import timezone
 from django.utils.timezone import now
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core import signing
 from django.core.exceptions import PermissionDenied
-from django.core.cache import cache
+from . import cache as cache_utils
+from . import metrics
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Count, Func, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_cookie
 from django.views.decorators.cache import never_cache
@@ -19,17 +46,16 @@ from django.views.decorators.http import require_POST
 
 @never_cache
 def home(request):
-    cache.delete('home')
-    total_mailings = Mailing.objects.count()
-    active_mailings = Mailing.objects.filter(status='Запущена').count()
-    unique_recipients = Client.objects.values('email').distinct().count()
-
-    context = {
-        'total_mailings': total_mailings,
-        'active_mailings': active_mailings,
-        'unique_recipients': unique_recipients,
-    }
-    return render(request, 'home.html', context)
+    return render(request, 'home.html', get_counters())
+
+def cached_keyset_page(name, scope, queryset, request):
+    size = get_page_size(request)
+    after, before = get_cursor(request)
+    return cache_utils.get_or_set(
+        name, scope,
+        lambda: keyset_page(queryset, size, after, before),
+        suffix=f'_{after}_{before}_{size}',
+    )
 
 def check_edit_permission(request, obj, list_view_name: str, object_type: str = 'объект'):
     user = request.user
@@ -46,16 +72,14 @@ def check_edit_permission(request, obj, list_view_name: str, object_type: str =
 
 @login_required(login_url='accounts:login')
 def client_list(request):
-    cache_key = f'client_list_{request.user.id}'
-    cache.delete(cache_key)
-    clients = cache.get(cache_key)
-    if clients is None:
-        if request.user.role == 'manager':
-            clients = list(Client.objects.all())
-        else:
-            clients = list(Client.objects.filter(owner=request.user))
-        cache.set(cache_key, clients, 300)
-    return render(request, 'mailing/client_list.html', {'clients': clients})
+    clients = Client.objects.only('id', 'email', 'full_name', 'comment')
+    if request.user.role == 'manager':
+        scope = cache_utils.ALL
+    else:
+        scope = request.user.id
+        clients = clients.filter(owner=request.user)
+    page = cached_keyset_page('client_list', scope, clients, request)
+    return render(request, 'mailing/client_list.html', {'clients': page, 'page': page})
 
 @login_required(login_url='accounts:login')
 def client_create(request):
@@ -64,10 +88,42 @@ def client_create(request):
         client = form.save(commit=False)
         client.owner = request.user
         client.save()
-        cache.delete(f'client_list_{request.user.id}')
         return redirect('client_list')
     return render(request, 'mailing/client_form.html', {'form': form})
 
+@login_required(login_url='accounts:login')
+def client_import(request):
+    form = ClientImportForm(request.POST or None, request.FILES or None)
+    if form.is_valid():
+        upload = form.cleaned_data['file']
+        fmt = form.cleaned_data['format'] or detect_format(upload.name)
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            with transaction.atomic():
+                report = import_clients(stream, request.user, fmt)
+        except UnicodeDecodeError:
+            form.add_error('file', "Файл должен быть в кодировке UTF-8.")
+        except csv.Error as e:
+            form.add_error('file', f"Файл не удалось разобрать как CSV: {e}")
+        else:
+            messages.success(request, f"Импорт завершён: {report}.")
+            return redirect('client_list')
+    return render(request, 'mailing/client_import.html', {'form': form})
+
+@login_required(login_url='accounts:login')
+def client_search(request):
+    query = request.GET.get('q', '').strip()
+    if len(query) < 2:
+        return JsonResponse({'results': []})
+
+    clients = Client.objects.all() if request.user.role == 'manager' else Client.objects.filter(owner=request.user)
+    limit = getattr(settings, 'MAILING_CLIENT_SEARCH_LIMIT', 20)
+    found = clients.filter(
+        Q(email__istartswith=query) | Q(full_name__istartswith=query)
+    ).only('id', 'email', 'full_name')[:limit]
+    results = sorted(({'id': client.pk, 'text': str(client)} for client in found), key=lambda row: row['text'])
+    return JsonResponse({'results': results})
+
 @login_required(login_url='accounts:login')
 def client_detail(request, pk):
     client = get_object_or_404(Client, pk=pk)
@@ -83,7 +139,6 @@ def client_update(request, pk):
     form = ClientForm(request.POST or None, instance=client)
     if form.is_valid():
         form.save()
-        cache.delete(f'client_list_{request.user.id}')
         return redirect('client_list')
     return render(request, 'mailing/client_form.html', {'form': form})
 
@@ -96,17 +151,58 @@ def client_delete(request, pk):
 
     if request.method == 'POST':
         client.delete()
-        cache.delete(f'client_list_{request.user.id}')
+        forget_clients(client.owner_id, 1)
         return redirect('client_list')
     return render(request, 'mailing/client_confirm_delete.html', {'client': client})
 
+@login_required(login_url='accounts:login')
+def group_list(request):
+    groups = ClientGroup.objects.filter(owner=request.user).only('id', 'name')
+    page = keyset_page(groups, get_page_size(request), *get_cursor(request))
+    return render(request, 'mailing/group_list.html', {'groups': page, 'page': page})
+
+@login_required(login_url='accounts:login')
+def group_create(request):
+    form = ClientGroupForm(request.POST or None, owner=request.user)
+    if form.is_valid():
+        group = form.save(commit=False)
+        group.owner = request.user
+        group.save()
+        form.save_m2m()
+        return redirect('group_list')
+    return render(request, 'mailing/group_form.html', {'form': form})
+
+@login_required(login_url='accounts:login')
+def group_update(request, pk):
+    group = get_object_or_404(ClientGroup, pk=pk)
+    permission_redirect = check_edit_permission(request, group, 'group_list', 'группа')
+    if permission_redirect:
+        return permission_redirect
+
+    form = ClientGroupForm(request.POST or None, instance=group, owner=request.user)
+    if form.is_valid():
+        form.save()
+        return redirect('group_list')
+    return render(request, 'mailing/group_form.html', {'form': form})
+
+@login_required(login_url='accounts:login')
+def group_delete(request, pk):
+    group = get_object_or_404(ClientGroup, pk=pk)
+    permission_redirect = check_edit_permission(request, group, 'group_list', 'группа')
+    if permission_redirect:
+        return permission_redirect
+
+    if request.method == 'POST':
+        group.delete()
+        return redirect('group_list')
+    return render(request, 'mailing/group_confirm_delete.html', {'group': group})
+
 @never_cache
 @vary_on_cookie
 @login_required(login_url='accounts:login')
 def message_list(request):
-    cache.delete(f'message_list_{request.user.id}')
-    all_messages = Message.objects.all()
-    return render(request, 'mailing/message_list.html', {'messages': all_messages})
+    page = cached_keyset_page('message_list', cache_utils.ALL, Message.objects.only('id', 'subject'), request)
+    return render(request, 'mailing/message_list.html', {'messages': page, 'page': page})
 
 @login_required(login_url='accounts:login')
 def message_create(request):
@@ -115,7 +211,6 @@ def message_create(request):
         message = form.save(commit=False)
         message.owner = request.user
         message.save()
-        cache.delete(f'message_list_{request.user.id}')
         return redirect('message_list')
     return render(request, 'mailing/message_form.html', {'form': form})
 
@@ -129,7 +224,6 @@ def message_update(request, pk):
     form = MessageForm(request.POST or None, instance=message)
     if form.is_valid():
         form.save()
-        cache.delete(f'message_list_{request.user.id}')
         return redirect('message_list')
     return render(request, 'mailing/message_form.html', {'form': form})
 
@@ -142,7 +236,6 @@ def message_delete(request, pk):
 
     if request.method == 'POST':
         message.delete()
-        cache.delete(f'message_list_{request.user.id}')
         return redirect('message_list')
     return render(request, 'mailing/message_confirm_delete.html', {'message': message})
 
@@ -156,21 +249,25 @@ def message_detail(request, pk):
 @login_required(login_url='accounts:login')
 def mailing_list(request):
     user = request.user
+    mailings = Mailing.objects.select_related('message').only(
+        'id', 'status', 'start_datetime', 'end_datetime', 'message__subject'
+    )
     if user.role == 'manager':
-        mailings = Mailing.objects.all()
+        scope = cache_utils.ALL
     else:
-        mailings = Mailing.objects.filter(owner=user)
-    return render(request, 'mailing/mailing_list.html', {'mailings': mailings})
+        scope = user.id
+        mailings = mailings.filter(owner=user)
+    page = cached_keyset_page('mailing_list', scope, mailings, request)
+    return render(request, 'mailing/mailing_list.html', {'mailings': page, 'page': page})
 
 @login_required(login_url='accounts:login')
 def mailing_create(request):
-    form = MailingForm(request.POST or None)
+    form = MailingForm(request.POST or None, owner=request.user)
     if form.is_valid():
         mailing = form.save(commit=False)
         mailing.owner = request.user
         mailing.save()
-        cache.delete(f'mailing_list_{request.user.id}')
-        cache.delete('home')
+        form.save_m2m()
         return redirect('mailing_list')
     return render(request, 'mailing/mailing_form.html', {'form': form})
 
@@ -181,11 +278,9 @@ def mailing_update(request, pk):
     if permission_redirect:
         return permission_redirect
 
-    form = MailingForm(request.POST or None, instance=mailing)
+    form = MailingForm(request.POST or None, instance=mailing, owner=request.user)
     if form.is_valid():
         form.save()
-        cache.delete(f'mailing_list_{request.user.id}')
-        cache.delete('home')
         return redirect('mailing_list')
     return render(request, 'mailing/mailing_form.html', {'form': form})
 
@@ -198,107 +293,252 @@ def mailing_delete(request, pk):
 
     if request.method == 'POST':
         mailing.delete()
-        cache.delete(f'mailing_list_{request.user.id}')
-        cache.delete('home')
         return redirect('mailing_list')
     return render(request, 'mailing/mailing_confirm_delete.html', {'mailing': mailing})
 
 @login_required(login_url='accounts:login')
-def send_mailing(request, pk):
-    mailing = get_object_or_404(Mailing, pk=pk)
+async def send_mailing(request, pk):
+    # асинхронное представление: под ASGI не занимает поток, пока ждёт БД
+    mailing = await aget_object_or_404(Mailing, pk=pk)
+    user = await request.auser()
 
-    if mailing.owner != request.user and request.user.role != 'manager':
+    if mailing.owner_id != user.pk and user.role != 'manager':
+        metrics.send_requests_total.inc(result='forbidden')
         raise PermissionDenied("Вы не можете отправить чужую рассылку.")
 
     if mailing.status == 'Завершена':
+        metrics.send_requests_total.inc(result='finished')
         messages.error(request, "Эта рассылка уже завершена.")
         return redirect('mailing_list')
 
     if mailing.start_datetime > now():
+        metrics.send_requests_total.inc(result='not_started')
         messages.warning(request, "Рассылка ещё не началась.")
         return redirect('mailing_list')
 
-    for client in mailing.recipients.all():
-        try:
-            send_mail(
-                subject=mailing.message.subject,
-                message=mailing.message.body,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[client.email],
-                fail_silently=False,
-            )
-            Attempt.objects.create(
-                mailing=mailing,
-                status='Успешно',
-                server_response=f"Письмо успешно отправлено на {client.email}"
-            )
-        except Exception as e:
-            Attempt.objects.create(
-                mailing=mailing,
-                status='Не успешно',
-                server_response=str(e)
-            )
+    job, created = await sync_to_async(enqueue_mailing)(mailing)
 
-    if mailing.end_datetime <= now():
-        mailing.status = 'Завершена'
+    metrics.send_requests_total.inc(result='queued' if created else 'duplicate')
+    if created:
+        messages.success(request, "Рассылка поставлена в очередь на отправку.")
     else:
-        mailing.status = 'Запущена'
-    mailing.save()
-
-    cache.delete(f'mailing_list_{request.user.id}')
-    cache.delete('home')
-    cache.delete(f'mailing_stats_{request.user.id}')
-
-    messages.success(request, "Попытки отправки рассылки завершены.")
+        messages.info(request, "Рассылка уже находится в очереди на отправку.")
     return redirect('mailing_list')
 
+@never_cache
+def metrics_view(request):
+    # формат Prometheus text exposition; сборщик передаёт MAILING_METRICS_TOKEN
+    # в заголовке Authorization: Bearer, без токена метрики открыты только при DEBUG
+    token = getattr(settings, 'MAILING_METRICS_TOKEN', '')
+    if not token:
+        if not settings.DEBUG:
+            raise PermissionDenied("Доступ к метрикам закрыт: не задан MAILING_METRICS_TOKEN.")
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        raise PermissionDenied("Неверный токен доступа к метрикам.")
+
+    jobs = dict(
+        DeliveryJob.objects.filter(status__in=[DeliveryJob.STATUS_QUEUED, DeliveryJob.STATUS_RUNNING])
+        .values_list('status').annotate(total=Count('id')).order_by()
+    )
+    gauges = [
+        (
+            'mailing_queue_depth',
+            'Задачи отправки в очереди и в работе.',
+            [
+                ({'status': 'queued'}, jobs.get(DeliveryJob.STATUS_QUEUED, 0)),
+                ({'status': 'running'}, jobs.get(DeliveryJob.STATUS_RUNNING, 0)),
+            ],
+        ),
+        (
+            'mailing_retries_pending',
+            'Письма, ожидающие повторной отправки.',
+            [({}, DeliveryRetry.objects.count())],
+        ),
+    ]
+    return HttpResponse(metrics.REGISTRY.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def unsubscribe(request, token):
+    # ссылка из письма: подписанный id клиента, вход в систему не нужен
+    try:
+        client = get_object_or_404(Client, pk=read_unsubscribe_token(token))
+    except signing.BadSignature:
+        raise Http404("Ссылка отписки недействительна.")
+    if request.method == 'POST':
+        Suppression.objects.get_or_create(client=client, defaults={'reason': Suppression.REASON_UNSUBSCRIBED})
+        return render(request, 'mailing/unsubscribe.html', {'client': client, 'done': True})
+    return render(request, 'mailing/unsubscribe.html', {'client': client, 'done': False})
+
+# пиксель и редирект вызываются из писем тысячами в секунду: только проверка
+# подписи и запись в буфер EVENTS, без обращений к БД и шаблонов
+def track_open(request, token):
+    try:
+        mailing_id, client_id = read_token(token)
+    except (signing.BadSignature, ValueError):
+        pass
+    else:
+        EVENTS.add(EmailEvent.KIND_OPEN, mailing_id, client_id)
+        metrics.tracking_events_total.inc(kind='open')
+    # картинку отдаём и на испорченный токен, чтобы письмо не показывало ошибку;
+    # заголовок ставим сами: never_cache заметно дороже всего остального представления
+    response = HttpResponse(PIXEL, content_type='image/gif')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+def track_click(request, token):
+    url = request.GET.get('u', '')
+    try:
+        mailing_id, client_id = read_token(token, url)
+    except (signing.BadSignature, ValueError):
+        raise Http404("Ссылка недействительна.")
+    EVENTS.add(EmailEvent.KIND_CLICK, mailing_id, client_id, url)
+    metrics.tracking_events_total.inc(kind='click')
+    return HttpResponseRedirect(url)
+
+def count_events(events, kind):
+    counts = events.filter(kind=kind).order_by().values('mailing').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+def count_archived(archived, status):
+    counts = (
+        archived.filter(mailing_id=OuterRef('pk'), status=status)
+        .order_by().values('mailing_id').annotate(total=Count('id')).values('total')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+def total_archived(archived, status):
+    # итог по архиву — подзапросом в том же запросе, что и итог по журналу
+    counts = archived.filter(status=status).order_by().annotate(
+        total=Func('id', function='COUNT', output_field=IntegerField())
+    ).values('total')
+    return Subquery(counts)
+
 @login_required(login_url='accounts:login')
 def mailing_stats_view(request):
     user = request.user
     if user.role == 'manager':
         raise PermissionDenied("Менеджеры не могут просматривать статистику.")
 
-    cache_key = f'mailing_stats_{request.user.id}'
-    stats = cache.get(cache_key)
-
-    if stats is None:
-        mailings = Mailing.objects.filter(owner=user)
-        stats_list = []
-        total_success = 0
-        total_fail = 0
-
-        for mailing in mailings:
-            success_count = Attempt.objects.filter(mailing=mailing, status='Успешно').count()
-            fail_count = Attempt.objects.filter(mailing=mailing, status='Не успешно').count()
-
-            stats_list.append({
-                'id': mailing.id,
-                'status': mailing.status,
-                'start_datetime': mailing.start_datetime,
-                'end_datetime': mailing.end_datetime,
-                'success_count': success_count,
-                'fail_count': fail_count,
-            })
-
-            total_success += success_count
-            total_fail += fail_count
+    form = StatsFilterForm(request.GET or None)
+    filters = form.cleaned_data if form.is_valid() else {}
+    date_from = filters.get('date_from')
+    date_to = filters.get('date_to')
+    status = filters.get('status')
+
+    mailings = Mailing.objects.filter(owner=user)
+    if status:
+        mailings = mailings.filter(status=status)
+    columns = ('id', 'status', 'start_datetime', 'end_datetime')
+
+    if date_from or date_to:
+        # счётчики хранятся за всё время, поэтому период считаем по журналу попыток и его архиву
+        attempts = Attempt.objects.filter(mailing__owner=user)
+        attempt_filter = Q()
+        if status:
+            attempts = attempts.filter(mailing__status=status)
+        # сравниваем с границами суток, а не timestamp::date, чтобы работал индекс по timestamp
+        if date_from:
+            attempt_filter &= Q(attempts__timestamp__gte=start_of_day(date_from))
+            attempts = attempts.filter(timestamp__gte=start_of_day(date_from))
+        if date_to:
+            attempt_filter &= Q(attempts__timestamp__lt=start_of_day(date_to + timedelta(days=1)))
+            attempts = attempts.filter(timestamp__lt=start_of_day(date_to + timedelta(days=1)))
+        # события и архив считаем подзапросами: второй JOIN размножил бы строки попыток
+        events = EmailEvent.objects.filter(mailing=OuterRef('pk'))
+        # попытки старше срока хранения перенесены в архив, без него старые периоды были бы пустыми
+        archived = AttemptArchive.objects.all()
+        if date_from:
+            events = events.filter(timestamp__gte=start_of_day(date_from))
+            archived = archived.filter(timestamp__gte=start_of_day(date_from))
+        if date_to:
+            events = events.filter(timestamp__lt=start_of_day(date_to + timedelta(days=1)))
+            archived = archived.filter(timestamp__lt=start_of_day(date_to + timedelta(days=1)))
+        rows = mailings.values(*columns).annotate(
+            success_count=Count('attempts', filter=attempt_filter & Q(attempts__status='Успешно'))
+            + count_archived(archived, 'Успешно'),
+            fail_count=Count('attempts', filter=attempt_filter & Q(attempts__status='Не успешно'))
+            + count_archived(archived, 'Не успешно'),
+            open_count=count_events(events, EmailEvent.KIND_OPEN),
+            click_count=count_events(events, EmailEvent.KIND_CLICK),
+        )
+        archived = archived.filter(mailing_id__in=mailings.values('pk'))
+        totals = attempts.aggregate(
+            total_messages_sent=Count('id', filter=Q(status='Успешно')) + total_archived(archived, 'Успешно'),
+            total_fail=Count('id', filter=Q(status='Не успешно')) + total_archived(archived, 'Не успешно'),
+        )
+    else:
+        rows = mailings.values(*columns).annotate(
+            success_count=Coalesce('stats__success_count', 0),
+            fail_count=Coalesce('stats__fail_count', 0),
+            open_count=Coalesce('stats__open_count', 0),
+            click_count=Coalesce('stats__click_count', 0),
+        )
+        if status:
+            totals = MailingStats.objects.filter(mailing__in=mailings).aggregate(
+                total_messages_sent=Coalesce(Sum('success_count'), 0),
+                total_fail=Coalesce(Sum('fail_count'), 0),
+            )
+        else:
+            # итоги без фильтров кешируются: их сбрасывает запись новых попыток
+            def compute():
+                owner_stats = OwnerStats.objects.filter(owner=user).first()
+                return {
+                    'total_messages_sent': owner_stats.success_count if owner_stats else 0,
+                    'total_fail': owner_stats.fail_count if owner_stats else 0,
+                }
+
+            totals = cache_utils.get_or_set('mailing_stats', user.id, compute)
+
+    page = Paginator(rows.order_by('-id'), getattr(settings, 'MAILING_STATS_PAGE_SIZE', 50)).get_page(
+        request.GET.get('page')
+    )
+
+    query = request.GET.copy()
+    query.pop('page', None)
+
+    return render(request, 'mailing/stats.html', {
+        'form': form,
+        'stats': page.object_list,
+        'page_obj': page,
+        'query': query.urlencode(),
+        **totals,
+    })
+
+def export_response(request, name, queryset, fields, fmt):
+    response = StreamingHttpResponse(iter_export(queryset, fields, fmt), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+def invalid_filters(form):
+    # с неверным фильтром выгрузка не делается: иначе вместо части данных ушли бы все
+    return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
 
-        stats = {
-            'stats': stats_list,
-            'total_messages_sent': total_success,
-            'total_fail': total_fail,
-        }
-        cache.set(cache_key, stats, 300)
+@login_required(login_url='accounts:login')
+def export_clients(request):
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return invalid_filters(form)
+    owner = None if request.user.role == 'manager' else request.user
+    return export_response(
+        request, 'clients', client_queryset(owner), CLIENT_FIELDS, form.cleaned_data['format'] or 'csv'
+    )
 
-    return render(request, 'mailing/stats.html', stats)
+@login_required(login_url='accounts:login')
+def export_attempts(request):
+    form = ExportFilterForm(request.GET)
+    if not form.is_valid():
+        return invalid_filters(form)
+    filters = form.cleaned_data
+    owner = None if request.user.role == 'manager' else request.user
+    queryset = attempt_queryset(
+        owner, filters['mailing'], filters['date_from'], filters['date_to'], filters['status']
+    )
+    return export_response(request, 'attempts', queryset, ATTEMPT_FIELDS, filters['format'] or 'csv')
 
 @user_passes_test(lambda u: u.role == 'manager')
 def stop_mailing(request, pk):
     mailing = get_object_or_404(Mailing, pk=pk)
     mailing.status = 'Отключена'
     mailing.save()
-    cache.delete('home')
-    cache.delete(f'mailing_list_{request.user.id}')
     messages.success(request, "Рассылка отключена.")
     return redirect('mailing_list')
 